@@ -1,6 +1,27 @@
 from pathlib import Path
 from doit.tools import run_once
 
+MONTHLY_RAW_DIRS = {
+    "transportation-load": Path("data/raw/historic-transportation-load"),
+    "weather-observations": Path("data/raw/historic-weather-observations"),
+}
+PARTIALS_DIR = Path("data/interim")
+
+# a plain `doit` runs the pipeline; `doit profile` is only run on request
+DOIT_CONFIG = {
+    "default_tasks": [
+        "prepare",
+        "aggregate_month",
+        "clean_raw",
+        "create_db",
+        "teardown",
+    ]
+}
+
+
+def partial_path(tag, raw_path):
+    return PARTIALS_DIR / tag / "{}.feather".format(raw_path.stem)
+
 
 def show_cmd(task):
     return "executing... %s" % task.name
@@ -15,30 +36,58 @@ def task_prepare():
     }
 
 
+def task_aggregate_month():
+    # one subtask per monthly raw file, so that `doit -n <N>` can aggregate
+    # the months in parallel and only the changed months are rebuilt
+    action_path = Path("src/cleaning/aggregate_month.py")
+    for tag, raw_dir in MONTHLY_RAW_DIRS.items():
+        for raw_path in sorted(raw_dir.glob("*.csv")):
+            target_path = partial_path(tag, raw_path)
+            yield {
+                "name": raw_path.stem,
+                # the partials are rebuilt when the aggregation code changes
+                "file_dep": [raw_path, action_path, Path("src/cleaning/readers.py")],
+                "task_dep": ["prepare"],
+                "actions": [
+                    "python {} {} {} {}".format(action_path, tag, raw_path, target_path)
+                ],
+                "targets": [target_path],
+                "title": show_cmd,
+            }
+
+
 def task_clean_raw():
     action_path = Path("src/cleaning/clean_raw.py")
+    partial_paths = [
+        partial_path(tag, raw_path)
+        for tag, raw_dir in MONTHLY_RAW_DIRS.items()
+        for raw_path in sorted(raw_dir.glob("*.csv"))
+    ]
     return {
         "file_dep": [
             Path("data/raw/geolocation/automated-weather-stations-geoloc.csv"),
             Path("data/raw/geolocation/ferry-lines-geoloc.csv"),
             Path("data/raw/geolocation/ferry-terminals-geoloc.csv"),
             Path("data/raw/geolocation/icing-sensors-geoloc.csv"),
-            Path(
-                "data/raw/historic-transportation-load/transportation-load_202001.csv"
-            ),
-            Path("data/raw/historic-weather-observations/observations_202001.csv"),
             Path("data/raw/summary-stats/trips-per-ferry-line_2020.csv"),
-        ],
-        "task_dep": ["prepare"],
-        "actions": ["python {}".format(action_path)],
+        ]
+        + partial_paths,
+        "task_dep": ["aggregate_month"],
+        "actions": ["python {} --partials-dir {}".format(action_path, PARTIALS_DIR)],
         "targets": [
-            Path("data/cleaned/ferry-lines.csv"),
-            Path("data/cleaned/ferry-terminals.csv"),
-            Path("data/cleaned/terminals-lines.csv"),
-            Path("data/cleaned/transportation-load.csv"),
-            Path("data/cleaned/trips-per-ferry-line.csv"),
-            Path("data/cleaned/weather-observations.csv"),
-            Path("data/cleaned/weather-sensors.csv"),
+            Path("data/cleaned/ferry-lines.arrow"),
+            Path("data/cleaned/ferry-terminals.arrow"),
+            Path("data/cleaned/terminals-lines.arrow"),
+            Path("data/cleaned/transportation-load.arrow"),
+            Path("data/cleaned/load-lines.arrow"),
+            Path("data/cleaned/transfer-types.arrow"),
+            Path("data/cleaned/transportation-load-per-line.arrow"),
+            Path("data/cleaned/trips-per-ferry-line.arrow"),
+            Path("data/cleaned/weather-observations.arrow"),
+            Path("data/cleaned/weather-sensors.arrow"),
+            Path("data/derived/hourly-coverage.csv"),
+            Path("data/derived/weather-cube.npy"),
+            Path("data/derived/weather-cube.json"),
         ],
         "title": show_cmd,
     }
@@ -48,24 +97,40 @@ def task_create_db():
     action_path = Path("src/processing/create_db.py")
     return {
         "file_dep": [
-            Path("data/cleaned/ferry-lines.csv"),
-            Path("data/cleaned/ferry-terminals.csv"),
-            Path("data/cleaned/terminals-lines.csv"),
-            Path("data/cleaned/transportation-load.csv"),
-            Path("data/cleaned/trips-per-ferry-line.csv"),
-            Path("data/cleaned/weather-observations.csv"),
-            Path("data/cleaned/weather-sensors.csv"),
+            Path("data/cleaned/ferry-lines.arrow"),
+            Path("data/cleaned/ferry-terminals.arrow"),
+            Path("data/cleaned/terminals-lines.arrow"),
+            Path("data/cleaned/transportation-load.arrow"),
+            Path("data/cleaned/load-lines.arrow"),
+            Path("data/cleaned/transfer-types.arrow"),
+            Path("data/cleaned/transportation-load-per-line.arrow"),
+            Path("data/cleaned/trips-per-ferry-line.arrow"),
+            Path("data/cleaned/weather-observations.arrow"),
+            Path("data/cleaned/weather-sensors.arrow"),
         ],
         "task_dep": ["clean_raw"],
         "actions": ["python {}".format(action_path)],
         "targets": [
             Path("data/db/istanbul-ferries-db.sqlite3"),
-            Path("data/db/istanbul-ferries-dump.txt"),
+            Path("data/db/istanbul-ferries-dump.sql"),
         ],
         "title": show_cmd,
     }
 
 
+def task_profile():
+    # prints the report of the last runs with ISTANBUL_FERRIES_PROFILE=1 (or
+    # --profile), e.g. after `ISTANBUL_FERRIES_PROFILE=1 doit create_db`. It
+    # isn't one of the default tasks, and always runs when asked for
+    action_path = Path("src/profiling.py")
+    return {
+        "actions": ["python {}".format(action_path)],
+        "uptodate": [False],
+        "verbosity": 2,
+        "title": show_cmd,
+    }
+
+
 def task_teardown():
     action_path = Path("src/utility-scripts/teardown.py")
     return {
@@ -0,0 +1,294 @@
+"""
+Hourly passenger and weather series aligned as NumPy arrays.
+
+load_hourly() reads the hourly tables from the SQLite database and places
+every variable on one shared range of 'hour-key's, so that index i of every
+array is the same hour and missing hours are NaN.
+The statistics below work on these arrays without Python loops over the
+hours, and all of them ignore NaN:
+
+- rolling_mean() and rolling_std() of trailing windows, from prefix sums,
+  for one window or many windows at once,
+- lagged_correlation() for a range of lags at once, from FFT cross
+  correlations of the pairwise complete sums,
+- conditional_means() per hour of the day, weekday or hour of the week,
+- sweep_correlations() of the lagged correlations of rolling means, for
+  every combination of windows and lags.
+
+    series = load_hourly()
+    passengers = series.values["n-passengers"]
+    temp = series.values["avg-temp"]
+    lagged_correlation(passengers, temp, lags=range(-24, 25))
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from src.db_layout import to_hour_key
+from src.paths import DB_PATH
+from src.queries import connect_read_only
+
+# hourly table -> its variables that are loaded
+HOURLY_VARIABLES = {
+    "transportation-load": ["n-passengers"],
+    "weather-observations": [
+        "avg-temp",
+        "avg-humidity",
+        "avg-precip",
+        "avg-wind",
+        "avg-winddir",
+    ],
+}
+
+# 'values' maps a variable name to a float64 array with one value per hour
+HourlySeries = namedtuple("HourlySeries", ["hour_keys", "values"])
+
+
+# --- alignment ---
+def align(columns, start=None, end=None):
+    """Place (hour keys, values) pairs on one range of hours.
+
+    'columns' maps a name to the pair. The range spans all of the keys, or
+    'start' to 'end' (both included) when given. Returns an HourlySeries.
+    """
+    if start is None or end is None:
+        keys = [np.asarray(keys) for keys, _ in columns.values() if len(keys)]
+        if not keys:
+            raise ValueError("Cannot align series without any hours")
+    first = min(k.min() for k in keys) if start is None else to_hour_key(start)
+    last = max(k.max() for k in keys) if end is None else to_hour_key(end)
+    hour_keys = np.arange(first, last + 1)
+
+    values = {}
+    for name, (keys, column) in columns.items():
+        keys = np.asarray(keys)
+        inside = (keys >= first) & (keys <= last)
+        values[name] = np.full(len(hour_keys), np.nan)
+        values[name][keys[inside] - first] = np.asarray(column, dtype="f8")[inside]
+    return HourlySeries(hour_keys, values)
+
+
+def load_hourly(db_path=DB_PATH, start=None, end=None):
+    """Load the HOURLY_VARIABLES from the DB and align them.
+
+    Only the hours from 'start' to 'end' are read, when given.
+    """
+    conditions, params = [], []
+    if start is not None:
+        conditions.append('"hour-key" >= ?')
+        params.append(to_hour_key(start))
+    if end is not None:
+        conditions.append('"hour-key" <= ?')
+        params.append(to_hour_key(end))
+    where = " WHERE {}".format(" AND ".join(conditions)) if conditions else ""
+
+    columns = {}
+    conn = connect_read_only(db_path)
+    try:
+        for name, variables in HOURLY_VARIABLES.items():
+            dataset = pd.read_sql_query(
+                'SELECT "hour-key", {} FROM "{}"{}'.format(
+                    ", ".join('"{}"'.format(variable) for variable in variables),
+                    name,
+                    where,
+                ),
+                conn,
+                params=params,
+            )
+            keys = dataset["hour-key"].to_numpy()
+            for variable in variables:
+                # NULLs become NaN
+                columns[variable] = (
+                    keys,
+                    dataset[variable].to_numpy(dtype="f8", na_value=np.nan),
+                )
+    finally:
+        conn.close()
+    return align(columns, start, end)
+
+
+# --- rolling statistics ---
+def _prefix_sums(values, powers):
+    # cumulative sums of values ** power and of the valid values, with a
+    # leading 0, after centering the values to keep the sums small
+    values = np.asarray(values, dtype="f8")
+    valid = ~np.isnan(values)
+    centered = np.where(valid, values - np.nanmean(values), 0.0)
+    sums = [np.concatenate([[0.0], np.cumsum(centered**power)]) for power in powers]
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    return sums, counts
+
+
+def _window_diffs(prefix, windows):
+    # sums over the trailing window ending at every hour, one row per window
+    n = len(prefix) - 1
+    ends = np.arange(1, n + 1)
+    starts = np.maximum(ends - np.asarray(windows)[:, np.newaxis], 0)
+    return prefix[ends] - prefix[starts]
+
+
+def _windows(windows):
+    windows = np.atleast_1d(np.asarray(windows, dtype=int))
+    if (windows < 1).any():
+        raise ValueError("Windows must be at least 1 hour long")
+    return windows
+
+
+def _min_periods(min_periods, windows):
+    return windows[:, np.newaxis] if min_periods is None else min_periods
+
+
+def rolling_mean(values, windows, min_periods=None):
+    """Mean of the trailing window of every hour, ignoring NaN.
+
+    'windows' is a number of hours or a sequence of them; for a sequence the
+    result has one row per window. A mean over fewer than 'min_periods'
+    values (by default, the window) is NaN, like pandas' rolling().mean().
+    """
+    scalar = np.ndim(windows) == 0
+    windows = _windows(windows)
+    (sums,), counts = _prefix_sums(values, powers=[1])
+    window_sums = _window_diffs(sums, windows)
+    window_counts = _window_diffs(counts, windows)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = window_sums / window_counts + np.nanmean(values)
+    means[window_counts < _min_periods(min_periods, windows)] = np.nan
+    return means[0] if scalar else means
+
+
+def rolling_std(values, windows, min_periods=None, ddof=1):
+    """Standard deviation of the trailing window of every hour, ignoring NaN.
+
+    See rolling_mean(); a window with no more than 'ddof' values is NaN.
+    """
+    scalar = np.ndim(windows) == 0
+    windows = _windows(windows)
+    (sums, squares), counts = _prefix_sums(values, powers=[1, 2])
+    window_sums = _window_diffs(sums, windows)
+    window_squares = _window_diffs(squares, windows)
+    window_counts = _window_diffs(counts, windows)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variances = (window_squares - window_sums**2 / window_counts) / (
+            window_counts - ddof
+        )
+    stds = np.sqrt(np.maximum(variances, 0.0))
+    stds[
+        (window_counts < _min_periods(min_periods, windows)) | (window_counts <= ddof)
+    ] = np.nan
+    return stds[0] if scalar else stds
+
+
+# --- correlations ---
+def _standardize(values):
+    values = np.asarray(values, dtype="f8")
+    mean = np.nanmean(values, axis=-1, keepdims=True)
+    std = np.nanstd(values, axis=-1, keepdims=True)
+    std[~(std > 0)] = 1.0
+    return (values - mean) / std
+
+
+def _cross_sums(a, b, lags, size):
+    # sum over t of a[t] * b[t - lag] for every lag, along the last axis, from
+    # the spectra of a and b
+    return np.fft.irfft(a * np.conj(b), size)[..., lags % size]
+
+
+def lagged_correlation(x, y, lags, min_periods=3):
+    """Pearson correlation of x[t] and y[t - lag] for every lag.
+
+    A positive lag pairs every hour of 'x' with an earlier hour of 'y', e.g.
+    the passengers with the weather 'lag' hours before. Only the hours where
+    both values are present are used, and a lag with fewer than
+    'min_periods' such pairs is NaN. 'x' and 'y' can also be 2-D, with one
+    series per row; the result then has one row of lags per series.
+    """
+    lags = np.asarray(lags, dtype=int)
+    x, y = _standardize(x), _standardize(y)
+    n = x.shape[-1]
+    if y.shape[-1] != n:
+        raise ValueError("'x' and 'y' must have the same number of hours")
+    if len(lags) and np.abs(lags).max() >= n:
+        raise ValueError("Lags must be shorter than the series")
+    # long enough that the circular FFT correlation doesn't wrap around at
+    # any of the lags
+    size = 1 << int(np.ceil(np.log2(n + max(np.abs(lags).max(initial=0), 1))))
+
+    x_valid, y_valid = ~np.isnan(x), ~np.isnan(y)
+    x, y = np.where(x_valid, x, 0.0), np.where(y_valid, y, 0.0)
+    # every spectrum is used in more than one of the sums
+    spectra = {
+        name: np.fft.rfft(values, size)
+        for name, values in [
+            ("x", x),
+            ("y", y),
+            ("xx", x**2),
+            ("yy", y**2),
+            ("x_valid", x_valid.astype("f8")),
+            ("y_valid", y_valid.astype("f8")),
+        ]
+    }
+
+    def cross_sums(a, b):
+        return _cross_sums(spectra[a], spectra[b], lags, size)
+
+    pairs = np.rint(cross_sums("x_valid", "y_valid"))
+    sum_x = cross_sums("x", "y_valid")
+    sum_y = cross_sums("x_valid", "y")
+    sum_xx = cross_sums("xx", "y_valid")
+    sum_yy = cross_sums("x_valid", "yy")
+    sum_xy = cross_sums("x", "y")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = pairs * sum_xy - sum_x * sum_y
+        variances = (pairs * sum_xx - sum_x**2) * (pairs * sum_yy - sum_y**2)
+        correlations = covariance / np.sqrt(variances)
+    correlations[(pairs < min_periods) | ~(variances > 0)] = np.nan
+    return np.clip(correlations, -1.0, 1.0)
+
+
+def sweep_correlations(x, y, windows, lags, min_periods=None):
+    """Lagged correlations of the rolling means of 'x' and 'y'.
+
+    Returns a DataFrame with one row per window and one column per lag.
+    """
+    windows = _windows(windows)
+    lags = np.asarray(lags, dtype=int)
+    correlations = lagged_correlation(
+        rolling_mean(x, windows, min_periods),
+        rolling_mean(y, windows, min_periods),
+        lags,
+    )
+    return pd.DataFrame(
+        correlations,
+        index=pd.Index(windows, name="window"),
+        columns=pd.Index(lags, name="lag"),
+    )
+
+
+# --- conditional means ---
+# grouping -> (number of groups, group of an 'hour-key'); the keys count
+# hours from 1970-01-01 00:00, a Thursday, and the weekdays start on Monday
+GROUPINGS = {
+    "hour": (24, lambda keys: keys % 24),
+    "weekday": (7, lambda keys: (keys // 24 + 3) % 7),
+    "hour-of-week": (168, lambda keys: (keys // 24 + 3) % 7 * 24 + keys % 24),
+}
+
+
+def conditional_means(values, hour_keys, by="hour"):
+    """Mean of 'values' per hour of the day, weekday or hour of the week.
+
+    Returns a Series with one value per group, NaN for a group without
+    values.
+    """
+    n_groups, group_of = GROUPINGS[by]
+    values = np.asarray(values, dtype="f8")
+    valid = ~np.isnan(values)
+    groups = group_of(np.asarray(hour_keys))[valid]
+    sums = np.bincount(groups, weights=values[valid], minlength=n_groups)
+    counts = np.bincount(groups, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return pd.Series(means, index=pd.RangeIndex(n_groups, name=by))
@@ -0,0 +1,154 @@
+"""
+Partial aggregates of a single monthly raw file.
+
+Usage: python src/cleaning/aggregate_month.py <tag> <raw-path> <target-path>
+
+Every monthly 'transportation-load' or 'weather-observations' file is reduced
+to a small hourly partial aggregate that is written as Feather. clean_raw.py
+merges the partials of all months ('--partials-dir'), so that a changed month
+only requires its own partial to be rebuilt.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+
+from src.cleaning.readers import (
+    decategorize,
+    list_raw_files,
+    merge_partial_sums,
+    sum_csv_chunks,
+)
+
+# 'TRANSPORT_TYPE_ID' of ferries in the 'transportation-load' datasets
+FERRY_TRANSPORT_TYPE_ID = 3
+# the passengers of every hour are summed per line and transfer type
+LINE_LOAD_KEYS = ["DATE_TIME", "LINE", "TRANSFER_TYPE"]
+
+WEATHER_COLUMNS = [
+    "AVERAGE_TEMPERATURE",
+    "AVERAGE_HUMIDITY",
+    "AVERAGE_WIND",
+    "AVERAGE_DIRECTIONOFWIND",
+    "AVERAGE_PRECIPITATION",
+]
+# negative values in these columns are measurement errors
+NON_NEGATIVE_WEATHER_COLUMNS = [
+    "AVERAGE_HUMIDITY",
+    "AVERAGE_WIND",
+    "AVERAGE_PRECIPITATION",
+    "AVERAGE_DIRECTIONOFWIND",
+]
+
+# --- raw schemas ---
+# the columns of the monthly raw files that are used, and their dtypes at
+# read time: repeated strings are categorical and ids and counts are
+# downcast. The measurements stay float64, as float32 would round the parsed
+# values and change the hourly means
+TRANSPORTATION_LOAD_COLUMNS = [
+    "DATE_TIME",
+    "TRANSPORT_TYPE_ID",
+    "LINE",
+    "TRANSFER_TYPE",
+    "NUMBER_OF_PASSENGER",
+]
+TRANSPORTATION_LOAD_DTYPES = {
+    "DATE_TIME": "category",
+    "TRANSPORT_TYPE_ID": "int8",
+    "LINE": "category",
+    "TRANSFER_TYPE": "category",
+    "NUMBER_OF_PASSENGER": "int32",
+}
+WEATHER_OBSERVATIONS_COLUMNS = ["DATE_TIME"] + WEATHER_COLUMNS
+WEATHER_OBSERVATIONS_DTYPES = {
+    "DATE_TIME": "category",
+    **{col: "float64" for col in WEATHER_COLUMNS},
+}
+
+
+def aggregate_transportation_load(path, encoding="utf-8", sep=","):
+    # hourly ferry passenger sums per line and transfer type of one month
+    return sum_csv_chunks(
+        path,
+        by=LINE_LOAD_KEYS,
+        value="NUMBER_OF_PASSENGER",
+        filter_col="TRANSPORT_TYPE_ID",
+        filter_value=FERRY_TRANSPORT_TYPE_ID,
+        encoding=encoding,
+        sep=sep,
+        dtype=TRANSPORTATION_LOAD_DTYPES,
+    )
+
+
+def aggregate_weather_observations(path, encoding="utf-8", sep=","):
+    # hourly sums and counts of the valid observations of one month, which
+    # (unlike means) can be merged across months exactly
+    dataset = pd.read_csv(
+        path,
+        encoding=encoding,
+        sep=sep,
+        usecols=WEATHER_OBSERVATIONS_COLUMNS,
+        dtype=WEATHER_OBSERVATIONS_DTYPES,
+    )
+    dataset = decategorize(dataset)
+    dataset["DATE_TIME"] = pd.to_datetime(dataset["DATE_TIME"])
+    for col in NON_NEGATIVE_WEATHER_COLUMNS:
+        dataset.loc[dataset[col] < 0, col] = np.nan
+
+    grouped = dataset.groupby("DATE_TIME")[WEATHER_COLUMNS]
+    sums = grouped.sum().add_suffix(":sum")
+    counts = grouped.count().add_suffix(":count")
+    return pd.concat([sums, counts], axis=1).reset_index()
+
+
+def merge_transportation_load(partials):
+    return merge_partial_sums(partials, by=LINE_LOAD_KEYS, value="NUMBER_OF_PASSENGER")
+
+
+def merge_weather_observations(partials):
+    # hourly means over all observatories, from the summed partial aggregates
+    totals = pd.concat(partials, ignore_index=True).groupby("DATE_TIME").sum()
+    dataset = pd.DataFrame(index=totals.index)
+    for col in WEATHER_COLUMNS:
+        dataset[col] = totals[col + ":sum"] / totals[col + ":count"]
+    return dataset.reset_index()
+
+
+AGGREGATORS = {
+    "transportation-load": (aggregate_transportation_load, merge_transportation_load),
+    "weather-observations": (
+        aggregate_weather_observations,
+        merge_weather_observations,
+    ),
+}
+
+
+def partial_path(partials_dir, tag, raw_path):
+    return Path(partials_dir) / tag / "{}.feather".format(Path(raw_path).stem)
+
+
+def read_merged_partials(partials_dir, tag, raw_dir):
+    # only the partials of the raw files that are still present are merged
+    paths = [
+        partial_path(partials_dir, tag, raw_path)
+        for raw_path in list_raw_files(raw_dir)
+    ]
+    missing = [str(path) for path in paths if not path.exists()]
+    if missing:
+        raise FileNotFoundError(
+            "Missing partial aggregates: {}".format(", ".join(missing))
+        )
+    merge = AGGREGATORS[tag][1]
+    return merge([pd.read_feather(path) for path in paths])
+
+
+if __name__ == "__main__":
+    tag, raw_path, target_path = sys.argv[1:]
+    aggregate = AGGREGATORS[tag][0]
+
+    target_path = Path(target_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    feather.write_feather(aggregate(Path(raw_path)), target_path)
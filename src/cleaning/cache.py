@@ -0,0 +1,110 @@
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+
+import pandas as pd
+from pyarrow import feather
+
+# bump this whenever the code that parses or filters the cached raw frames
+# changes, so that entries written by the old code are never served again
+CLEANING_VERSION = 4
+CACHE_DIR = Path("data/cache")
+# temporary entries older than this (in seconds) were left behind by a run
+# that crashed, younger ones may still be written by a running process
+STALE_TMP_AGE = 3600
+
+# '<digest>--v<version>' at the end of an entry name
+_ENTRY_SUFFIX = re.compile(r"^[0-9a-f]{32}--v\d+$")
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParsedFrameCache:
+    """Feather cache of parsed raw files, keyed by content hash and version.
+
+    Entries are named '<stage>--<file name>--<digest>--v<version>.feather',
+    where 'stage' names what was done to the raw file (e.g. the ferry filter
+    of 'transportation-load'). An entry is only reused when the raw file's
+    content and the cleaning code version are both unchanged.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, version=CLEANING_VERSION, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.version = version
+        self.enabled = enabled
+
+    def entry_path(self, path, stage, digest):
+        return self.cache_dir / "{}--{}--{}--v{}.feather".format(
+            stage, Path(path).name, digest, self.version
+        )
+
+    def load_or_parse(self, path, stage, parse):
+        if not self.enabled:
+            return parse(path)
+
+        entry = self.entry_path(path, stage, file_digest(path))
+        if entry.exists():
+            return pd.read_feather(entry)
+
+        dataset = parse(path)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so that concurrent readers and
+        # interrupted runs never see a half written entry
+        tmp_entry = entry.with_name("{}.{}.tmp".format(entry.name, os.getpid()))
+        feather.write_feather(dataset, tmp_entry)
+        os.replace(tmp_entry, entry)
+        self.evict(path, stage, keep=entry)
+        return dataset
+
+    def evict(self, path, stage, keep=None):
+        # drop entries of the same raw file made from older contents/versions
+        for entry in self.cache_dir.glob(
+            "{}--{}--*.feather".format(stage, Path(path).name)
+        ):
+            if entry != keep:
+                entry.unlink(missing_ok=True)
+
+    def evict_stale(self, stage=None, live_paths=None):
+        """Remove entries of other code versions and of vanished raw files.
+
+        If 'stage' and 'live_paths' are given, entries of that stage whose raw
+        file is not among 'live_paths' are removed as well. Temporary files
+        left behind by crashed runs are removed too, and files that aren't
+        named like an entry are left alone.
+        """
+        if not self.cache_dir.exists():
+            return
+        live_names = None
+        if live_paths is not None:
+            live_names = {Path(path).name for path in live_paths}
+        for entry in self.cache_dir.glob("*.feather"):
+            # the stage and the file name may contain '--' themselves, the
+            # digest and the version never do
+            parts = entry.stem.rsplit("--", 2)
+            if len(parts) != 3 or not _ENTRY_SUFFIX.match("--".join(parts[1:])):
+                continue
+            stage_and_name, _, version = parts
+            if version != "v{}".format(self.version):
+                entry.unlink(missing_ok=True)
+            elif live_names is not None and stage_and_name.startswith(
+                "{}--".format(stage)
+            ):
+                if stage_and_name[len(stage) + 2 :] not in live_names:
+                    entry.unlink(missing_ok=True)
+
+        now = time.time()
+        for tmp_entry in self.cache_dir.glob("*.feather.*.tmp"):
+            try:
+                if now - tmp_entry.stat().st_mtime > STALE_TMP_AGE:
+                    tmp_entry.unlink(missing_ok=True)
+            except FileNotFoundError:
+                # renamed into place meanwhile
+                pass
@@ -1,14 +1,60 @@
+"""
+Cleans the raw datasets under 'data/raw' and writes them to 'data/cleaned'.
+
+Every dataset is loaded and cleaned by its own function. The functions are
+wired together by 'build_steps' with declared inputs and outputs and are run by
+the scheduler in 'src/cleaning/dag.py', so that independent datasets are
+cleaned concurrently on a process pool.
+"""
+
+import argparse
+import warnings
+from functools import partial
 from pathlib import Path
-import os
 
 import numpy as np
 import pandas as pd
-from shapely import geometry, ops
-from shapely.wkt import loads
 
-from src.helper_functions import try_wkt_conversion, convert_coord
+from src.db_layout import hour_keys
+from src.geometry import merge_lines, normalize_geometries, points_from_coords, to_batch
+from src.helper_functions import parse_coords
+from src.cleaning.aggregate_month import (
+    AGGREGATORS,
+    FERRY_TRANSPORT_TYPE_ID,
+    LINE_LOAD_KEYS,
+    TRANSPORTATION_LOAD_COLUMNS,
+    TRANSPORTATION_LOAD_DTYPES,
+    WEATHER_OBSERVATIONS_COLUMNS,
+    WEATHER_OBSERVATIONS_DTYPES,
+    read_merged_partials,
+)
+from src.cleaning.cache import CACHE_DIR, ParsedFrameCache
+from src.cleaning.dag import Step, run_steps
+from src.cleaning.gaps import COVERAGE_COLUMNS, fill_hourly_gaps
+from src.cleaning.repair import ReplacementEngine
+from src.cleaning.readers import (
+    decategorize,
+    list_raw_files,
+    read_dir,
+    read_filtered_csv,
+    stream_csv_dir_sums,
+)
+from src.intermediate import CLEANED_DIR, to_arrow_table, write_dataset
+from src.paths import DERIVED_DIR
+from src.processing.create_db import DB_PATH, build_db, profile_path
+from src.profiling import Profiler, count_rows, profiling_enabled
+from src.weather_cube import (
+    STATION_OBSERVATIONS_COLUMNS,
+    STATION_OBSERVATIONS_DTYPES,
+    build_cube,
+    write_cube,
+)
 
-# --- import data ---
+# --- raw datasets ---
+# the monthly datasets are read with 'usecols' and 'dtype', so that only the
+# used columns are parsed, and into compact dtypes (see aggregate_month.py);
+# the geolocation and summary files are small, and their cleaning relies on
+# pandas' default parsing of their misaligned columns
 import_dicts = [
     {
         "tag": "ferry-terminals",
@@ -52,6 +98,8 @@ import_dicts = [
         "path": Path("data/raw/historic-transportation-load/"),
         "encoding": "utf-8",
         "sep": ",",
+        "usecols": TRANSPORTATION_LOAD_COLUMNS,
+        "dtype": TRANSPORTATION_LOAD_DTYPES,
     },
     {
         "tag": "automated-weather-stations",
@@ -74,50 +122,17 @@ import_dicts = [
         "path": Path("data/raw/historic-weather-observations/"),
         "encoding": "utf-8",
         "sep": ",",
+        "usecols": WEATHER_OBSERVATIONS_COLUMNS,
+        "dtype": WEATHER_OBSERVATIONS_DTYPES,
     },
 ]
-datasets = {}
-for import_dict in import_dicts:
-    if import_dict["tag"] not in {"transportation-load", "weather-observations"}:
-        datasets[import_dict["tag"]] = pd.read_csv(
-            import_dict["path"],
-            encoding=import_dict["encoding"],
-            sep=import_dict["sep"],
-            names=import_dict["headers"],
-            skiprows=import_dict["skiprows"],
-        )
-    else:
-        # get all subfiles
-        dir_list = os.listdir(import_dict["path"])
-        # get first element as big dict
-        big_df = pd.read_csv(
-            os.path.join(import_dict["path"], dir_list[0]),
-            encoding=import_dict["encoding"],
-            sep=import_dict["sep"],
-        )
-        for dir in dir_list[1:]:
-            temp_df = pd.read_csv(
-                os.path.join(import_dict["path"], dir),
-                encoding=import_dict["encoding"],
-                sep=import_dict["sep"],
-            )
-            big_df = big_df.append(temp_df, ignore_index=True)
-        datasets[import_dict["tag"]] = big_df
-
-# --- clean 'ferry-terminals-geoloc.csv' ---
-dataset = datasets["ferry-terminals"]
-
-# filter by 'turu_iskele' (terminal type)
-dataset = dataset.loc[dataset["turu_iskele"] == "IDO Þehir Hatlarý", :]
-
-# drop unnecessary columns
-dataset = dataset.drop(["globalid", "turu_iskele"], axis=1)
 
+# --- value replacements ---
 # fix values in the 'terminal-name' column
 # code here is extremely verbose and not using any regex to fix commonly
 # occuring patterns on purpose because I am using real-life knowledge to
 # correct data quality.
-repl_dict = {
+TERMINAL_NAME_REPL = {
     "Anadolu Hisarý ÞH.": "Anadolu Hisarı",
     "Kabataþ ÞH.": "Kabataş",
     "Kadýköy-Beþiktaþ-Adalar ÞH.": "Kadıköy - Beşiktaş - Adalar",
@@ -168,10 +183,9 @@ repl_dict = {
     "Hasköy ÞH.": "Hasköy",
     "Ýstinye ÞH. (Arabalý Vapur)": "İstinye Car Ferry Terminal",
 }
-dataset = dataset.replace(repl_dict)
 
 # fix values in the 'has-line' column
-repl_dict = {
+HAS_LINE_REPL = {
     "Hattý": "Line",
     "Boðaz": "Bosphorus",
     "Kabataþ": "Kabataş",
@@ -196,413 +210,920 @@ repl_dict = {
     "R.KAVAÐI - SARIYER": "Rumeli Kavağı",
     "KÜÇÜK SU": "Küçüksu",
 }
-for pat, repl in repl_dict.items():
-    dataset.loc[:, "has-line"] = dataset.loc[:, "has-line"].str.replace(
-        pat, repl, regex=True
-    )
 
-# fix value formatting of the "has-line" column
-dataset.loc[:, "has-line"] = dataset.loc[:, "has-line"].str.replace(
-    r"(\w)-(\w)", lambda x: (x.group(1) + " - " + x.group(2)), regex=True
+# fix values in the "line-name" column
+# extends the 'has-line' replacements, the order of the entries matters.
+LINE_NAME_REPL = {
+    **HAS_LINE_REPL,
+    "Bosphorusdan Geliþ": "From Bosph. to South",
+    "Bosphorusa Gidiþ": "From South to Bosph.",
+    "Uðramasýz": "Not Visited",
+    "Kýnalýada": "Kınalıada",
+    "Uzun": "Long",
+    "Kýsa": "Short",
+    "Turu": "Tour",
+    "İstinye - Çubuklu (Car Ferry)": "İstinye - Çubuklu Car Ferry Line",
+    "Üsküdar - Karaköy - Eminönü - Eyüp (Haliç Line)": "$1",
+    "From Bosph. to South": "Bosphorus Line",
+    "From South to Bosph.": "Bosphorus Line",
+}
+
+# fix 'line-name' values of 'trips-per-ferry-line', keys are used uppercased
+TRIPS_LINE_NAME_REPL = {
+    **LINE_NAME_REPL,
+    "MUHTELÝF": "Muhtelif",
+    "RÝNG": "Ring",
+    "PAÞABAHÇE": "Paşabahçe",
+    "ÝSTANBUL": "İstanbul",
+    "GÝDÝÞ GELÝÞ": "Gidiş Geliş",
+    "KASIMPAÞA": "Kasımpaşa",
+    "SEFERLERÝ": "Seferleri",
+    "EMÝRGAN": "Emirgan",
+    "HEYBELÝADA": "Heybeliada",
+    "ÝSK": "Üsküdar",
+}
+
+
+# fix value formatting, e.g. 'Kadıköy-Beşiktaş' -> 'Kadıköy - Beşiktaş'
+def space_dashes(match):
+    return match.group(1) + " - " + match.group(2)
+
+
+DASH_REPL = (r"(\w)-(\w)", space_dashes)
+
+# compiled once, each applies its replacements in order and then 'DASH_REPL'
+HAS_LINE_REPAIR = ReplacementEngine([*HAS_LINE_REPL.items(), DASH_REPL])
+LINE_NAME_REPAIR = ReplacementEngine([*LINE_NAME_REPL.items(), DASH_REPL])
+TRIPS_LINE_NAME_REPAIR = ReplacementEngine(
+    (pat.upper(), repl) for pat, repl in TRIPS_LINE_NAME_REPL.items()
 )
-# fix 'shape-data' formatting
-# do this by writing to WKT and getting WKT expression back
-wkt_shape_data = [dataset["shape-data"].apply(lambda x: try_wkt_conversion(x))]
 
-# sort by 'terminal-name' columns, add unique id, and reorder columns
-dataset = dataset.sort_values(by="terminal-name").reset_index(drop=True)
-dataset["id"] = [i for i in range(1, len(dataset) + 1)]
-dataset = dataset.reindex(columns=["id", "terminal-name", "shape-data", "has-line"])
 
-# separate out the 'ferry-terminals' dataset from the 'terminals-lines' dataset
-datasets["terminals-lines"] = dataset.loc[:, ["id", "terminal-name", "has-line"]]
-dataset = dataset.drop("has-line", axis=1)
+# --- import data ---
+def load_raw_dataset(
+    import_dict, cache, streaming=False, chunksize=100_000, partials_dir=None
+):
+    tag = import_dict["tag"]
+    if tag not in {"transportation-load", "weather-observations"}:
+        return cache.load_or_parse(
+            import_dict["path"],
+            stage=tag,
+            parse=partial(
+                pd.read_csv,
+                encoding=import_dict["encoding"],
+                sep=import_dict["sep"],
+                names=import_dict["headers"],
+                skiprows=import_dict["skiprows"],
+            ),
+        )
 
-# re-write the dataset into the dict
-datasets["ferry-terminals"] = dataset
+    if partials_dir is not None and tag in AGGREGATORS:
+        # the monthly files were already reduced to hourly partial aggregates
+        return read_merged_partials(partials_dir, tag, import_dict["path"])
 
-# --- clean 'ferry-lines-geoloc.csv' ---
-dataset = datasets["ferry-lines"]
+    if tag == "transportation-load" and streaming:
+        # filter ferry rows and sum passengers per hour and line while reading
+        stage = "transportation-load-ferry-line-sums"
+        dataset = stream_csv_dir_sums(
+            import_dict["path"],
+            by=LINE_LOAD_KEYS,
+            value="NUMBER_OF_PASSENGER",
+            filter_col="TRANSPORT_TYPE_ID",
+            filter_value=FERRY_TRANSPORT_TYPE_ID,
+            chunksize=chunksize,
+            cache=cache,
+            cache_stage=stage,
+            encoding=import_dict["encoding"],
+            sep=import_dict["sep"],
+            dtype=import_dict["dtype"],
+        )
+    else:
+        if tag == "transportation-load":
+            # only ferry rows are ever used, so only those get cached
+            stage = "transportation-load-ferry-rows"
+            parse = partial(
+                read_filtered_csv,
+                filter_col="TRANSPORT_TYPE_ID",
+                filter_value=FERRY_TRANSPORT_TYPE_ID,
+                encoding=import_dict["encoding"],
+                sep=import_dict["sep"],
+                usecols=import_dict["usecols"],
+                dtype=import_dict["dtype"],
+            )
+        else:
+            stage = tag
+            parse = partial(
+                pd.read_csv,
+                encoding=import_dict["encoding"],
+                sep=import_dict["sep"],
+                usecols=import_dict["usecols"],
+                dtype=import_dict["dtype"],
+            )
+        # read all monthly subfiles in parallel and concatenate them once
+        dataset = read_dir(
+            import_dict["path"],
+            partial(cache.load_or_parse, stage=stage, parse=parse),
+        )
+    # forget the cached months that are no longer part of the raw data
+    cache.evict_stale(stage=stage, live_paths=list_raw_files(import_dict["path"]))
+    return dataset
+
+
+def load_station_observations(import_dict, cache):
+    # the monthly weather observations of every station, for the weather cube
+    stage = "weather-station-observations"
+    parse = partial(
+        pd.read_csv,
+        encoding=import_dict["encoding"],
+        sep=import_dict["sep"],
+        usecols=STATION_OBSERVATIONS_COLUMNS,
+        dtype=STATION_OBSERVATIONS_DTYPES,
+    )
+    dataset = read_dir(
+        import_dict["path"],
+        partial(cache.load_or_parse, stage=stage, parse=parse),
+    )
+    cache.evict_stale(stage=stage, live_paths=list_raw_files(import_dict["path"]))
+    return dataset
 
-# filter by only 'şehir hatları'
-dataset = dataset.loc[
-    dataset["isim_kurum"].str.contains("Þehir Hatlarý Turizm ve Tic. San. AÞ.")
-]
 
-# drop unnecessary columns
-dataset = dataset.loc[:, ["line-name", "shape-data"]]
+# --- clean 'ferry-terminals-geoloc.csv' ---
+def clean_ferry_terminals(dataset):
+    # filter by 'turu_iskele' (terminal type)
+    dataset = dataset.loc[dataset["turu_iskele"] == "IDO Þehir Hatlarý", :]
 
-# fix values in the "line-name" column
-# extending the previous 'repl_dict' since it hasn't been recycled yet.
-repl_dict["Bosphorusdan Geliþ"] = "From Bosph. to South"
-repl_dict["Bosphorusa Gidiþ"] = "From South to Bosph."
-repl_dict["Uðramasýz"] = "Not Visited"
-repl_dict["Kýnalýada"] = "Kınalıada"
-repl_dict["Uzun"] = "Long"
-repl_dict["Kýsa"] = "Short"
-repl_dict["Turu"] = "Tour"
-repl_dict["İstinye - Çubuklu (Car Ferry)"] = "İstinye - Çubuklu Car Ferry Line"
-repl_dict["Üsküdar - Karaköy - Eminönü - Eyüp (Haliç Line)"] = "$1"
-repl_dict["From Bosph. to South"] = "Bosphorus Line"
-repl_dict["From South to Bosph."] = "Bosphorus Line"
-for pat, repl in repl_dict.items():
-    dataset.loc[:, "line-name"] = dataset.loc[:, "line-name"].str.replace(
-        pat, repl, regex=True
-    )
-
-# fix value formatting of the "line-name" column
-dataset.loc[:, "line-name"] = dataset.loc[:, "line-name"].str.replace(
-    r"(\w)-(\w)", lambda x: (x.group(1) + " - " + x.group(2)), regex=True
-)
+    # drop unnecessary columns
+    dataset = dataset.drop(["globalid", "turu_iskele"], axis=1)
 
-# fix 'shape-data' formatting
-dataset["shape-data"] = (
-    dataset["shape-data"].str.replace(";", ",").apply(lambda x: try_wkt_conversion(x))
-)
-# drop NaN values
-dataset = dataset.dropna()
-
-# merge lines with multiple representations into one
-for line_name in ["Adalar - Bostancı", "Bosphorus Line"]:
-    subset = dataset.loc[dataset["line-name"] == line_name, "shape-data"]
-    multi_line = []
-    for value in subset.values:
-        multi_line.append(loads(value))
-    multi_line = geometry.MultiLineString(multi_line)
-    merged_line = ops.linemerge(multi_line)
-    dataset.loc[dataset["line-name"] == line_name, "shape-data"] = merged_line.wkt
-
-dataset = dataset.groupby("line-name").first()
-
-# Reset index and give a unique ID to all lines
-dataset = dataset.reset_index()
-dataset["id"] = [i for i in range(1, len(dataset["line-name"]) + 1)]
-
-# reorder and sort by 'line-name' columns
-dataset = dataset.reindex(columns=["id", "line-name", "shape-data"]).sort_values(
-    by="line-name"
-)
+    # fix values in the 'terminal-name' column
+    dataset = dataset.replace(TERMINAL_NAME_REPL)
+
+    # fix values and value formatting in the 'has-line' column
+    dataset.loc[:, "has-line"] = HAS_LINE_REPAIR.apply(dataset.loc[:, "has-line"])
+
+    # fix 'shape-data' formatting
+    # do this by parsing the WKT and writing the normalized WKT back
+    shapes = normalize_geometries(dataset["shape-data"])
+    warn_invalid_geometries(dataset["terminal-name"], shapes)
+    dataset["shape-data"] = shapes.wkt
+
+    # sort by 'terminal-name' columns, add unique id, and reorder columns
+    dataset = dataset.sort_values(by="terminal-name").reset_index(drop=True)
+    dataset["id"] = [i for i in range(1, len(dataset) + 1)]
+    dataset = dataset.reindex(columns=["id", "terminal-name", "shape-data", "has-line"])
+
+    # separate out the 'ferry-terminals' dataset from the 'terminals-lines' dataset
+    terminals_lines = dataset.loc[:, ["id", "terminal-name", "has-line"]]
+    dataset = dataset.drop("has-line", axis=1)
+
+    return dataset, terminals_lines
+
+
+# --- clean 'ferry-lines-geoloc.csv' ---
+def clean_ferry_lines(dataset):
+    # filter by only 'şehir hatları'
+    dataset = dataset.loc[
+        dataset["isim_kurum"].str.contains("Þehir Hatlarý Turizm ve Tic. San. AÞ.")
+    ]
+
+    # drop unnecessary columns
+    dataset = dataset.loc[:, ["line-name", "shape-data"]]
+
+    # fix values and value formatting in the "line-name" column
+    dataset.loc[:, "line-name"] = LINE_NAME_REPAIR.apply(dataset.loc[:, "line-name"])
+
+    # fix 'shape-data' formatting
+    shapes = normalize_geometries(dataset["shape-data"].str.replace(";", ","))
+    warn_invalid_geometries(dataset["line-name"], shapes)
+    dataset["shape-data"] = shapes.geometries
+    # drop NaN values, including the shapes that couldn't be parsed
+    dataset = dataset.dropna()
+
+    # merge lines with multiple representations into one
+    for line_name in ["Adalar - Bostancı", "Bosphorus Line"]:
+        line_mask = dataset["line-name"] == line_name
+        if line_mask.any():
+            merged_line = merge_lines(dataset.loc[line_mask, "shape-data"])
+            dataset.loc[line_mask, "shape-data"] = [merged_line] * line_mask.sum()
+    dataset["shape-data"] = to_batch(dataset["shape-data"]).wkt
+
+    dataset = dataset.groupby("line-name").first()
+
+    # Reset index and give a unique ID to all lines
+    dataset = dataset.reset_index()
+    dataset["id"] = [i for i in range(1, len(dataset["line-name"]) + 1)]
+
+    # reorder and sort by 'line-name' columns
+    dataset = dataset.reindex(columns=["id", "line-name", "shape-data"]).sort_values(
+        by="line-name"
+    )
+
+    return dataset
 
-# re-write the dataset into the dict
-datasets["ferry-lines"] = dataset
 
 # --- clean 'terminals-lines' dataframe ---
-dataset = datasets["terminals-lines"]
+def clean_terminals_lines(dataset, ferry_lines):
+    # explode 'has-line' column
+    nested_mask = dataset["has-line"].str.contains("/")
+    dataset.loc[nested_mask, "has-line"] = dataset.loc[
+        nested_mask, "has-line"
+    ].str.split("/")
+    dataset = dataset.explode(column="has-line")
+
+    # fix formatting errors caused by unnesting
+    dataset["has-line"] = dataset["has-line"].str.strip()
+
+    # join with 'ferry-lines' dataset
+    dataset = (
+        pd.merge(
+            left=dataset,
+            right=ferry_lines.loc[:, ["line-name", "id"]],
+            how="left",
+            left_on="has-line",
+            right_on="line-name",
+        )
+        .drop("line-name", axis=1)
+        .dropna()
+    )
 
-# explode 'has-line' column
-nested_mask = dataset["has-line"].str.contains("/")
-dataset.loc[nested_mask, "has-line"] = dataset.loc[nested_mask, "has-line"].str.split(
-    "/"
-)
-dataset = dataset.explode(column="has-line")
-
-# fix formatting errors caused by unnesting
-dataset["has-line"] = dataset["has-line"].str.strip()
-
-# join with 'ferry-lines' dataset
-dataset = (
-    pd.merge(
-        left=dataset,
-        right=datasets["ferry-lines"].loc[:, ["line-name", "id"]],
-        how="left",
-        left_on="has-line",
-        right_on="line-name",
-    )
-    .drop("line-name", axis=1)
-    .dropna()
-)
+    # rename columns
+    dataset = dataset.rename({"id_x": "terminal-id", "id_y": "line-id"}, axis=1)
 
-# rename columns
-dataset = dataset.rename({"id_x": "terminal-id", "id_y": "line-id"}, axis=1)
+    # fix minor data type problems
+    dataset["line-id"] = dataset["line-id"].astype(int)
 
-# fix minor data type problems
-dataset["line-id"] = dataset["line-id"].astype(int)
+    return dataset
 
-# re-write the dataset into the dict
-datasets["terminals-lines"] = dataset
 
 # --- clean 'passengers-per-ferry-line_2020.csv' ---
-dataset = datasets["trips-per-ferry-line"]
-
-# fix 'line-name' values
-repl_dict["MUHTELÝF"] = "Muhtelif"
-repl_dict["RÝNG"] = "Ring"
-repl_dict["PAÞABAHÇE"] = "Paşabahçe"
-repl_dict["ÝSTANBUL"] = "İstanbul"
-repl_dict["GÝDÝÞ GELÝÞ"] = "Gidiş Geliş"
-repl_dict["KASIMPAÞA"] = "Kasımpaşa"
-repl_dict["SEFERLERÝ"] = "Seferleri"
-repl_dict["EMÝRGAN"] = "Emirgan"
-repl_dict["HEYBELÝADA"] = "Heybeliada"
-repl_dict["ÝSK"] = "Üsküdar"
-
-for pat, repl in repl_dict.items():
-    dataset.loc[:, "line-name"] = dataset.loc[:, "line-name"].str.replace(
-        pat.upper(),
-        repl,
-        regex=True,
-    )
-
-# fix data type of "n-trips"
-dataset["n-trips"] = (
-    dataset["n-trips"]
-    .astype(str)
-    .str.rstrip("0")
-    .str.replace(".", "", regex=True)
-    .astype(int)
-)
+def clean_trips_per_ferry_line(dataset):
+    # fix 'line-name' values
+    dataset.loc[:, "line-name"] = TRIPS_LINE_NAME_REPAIR.apply(
+        dataset.loc[:, "line-name"]
+    )
+
+    # fix data type of "n-trips"
+    dataset["n-trips"] = (
+        dataset["n-trips"]
+        .astype(str)
+        .str.rstrip("0")
+        .str.replace(".", "", regex=True)
+        .astype(int)
+    )
+
+    # fix some 'n-trips' values manually
+    dataset.loc[dataset["n-trips"] == 449, "n-trips"] = 4490
+    dataset.loc[dataset["n-trips"] == 197, "n-trips"] = 1970
 
-# fix some 'n-trips' values manually
-dataset.loc[dataset["n-trips"] == 449, "n-trips"] = 4490
-dataset.loc[dataset["n-trips"] == 197, "n-trips"] = 1970
+    return dataset
 
-# re-write the dataset into the dict
-datasets["trips-per-ferry-line"] = dataset
 
 # --- clean 'transportation-load_2020xx.csv's ---
-dataset = datasets["transportation-load"]
+def sum_line_load(dataset, aggregated=False):
+    # hourly ferry passengers per 'LINE' and 'TRANSFER_TYPE'; aggregated
+    # datasets were already filtered and summed like this while being loaded
+    if not aggregated:
+        # filter rows
+        dataset = dataset.loc[
+            dataset["TRANSPORT_TYPE_ID"] == FERRY_TRANSPORT_TYPE_ID, :
+        ]
 
-# filter rows
-dataset = dataset.loc[dataset["TRANSPORT_TYPE_ID"] == 3, :]
+        # calculate true sum of 'NUMBER_OF_PASSENGER' & drop unnecessary columns
+        dataset = (
+            dataset.groupby(LINE_LOAD_KEYS, dropna=False)
+            .agg({"NUMBER_OF_PASSENGER": "sum"})
+            .reset_index()
+        )
+    return dataset
 
-# calculate true sum of 'NUMBER_OF_PASSENGER' & drop unnecessary columns
-dataset = dataset.groupby("DATE_TIME").agg({"NUMBER_OF_PASSENGER": sum}).reset_index()
 
-# reformat 'date_time' column
-# can be done by converting to DT object
-dataset["DATE_TIME"] = pd.to_datetime(dataset["DATE_TIME"])
+def clean_transportation_load(dataset, start=None, end=None, whole_years=False):
+    # reformat 'date_time' column
+    # can be done by converting to DT object, so that differently formatted
+    # values of the same hour are summed together
+    dataset = dataset.assign(DATE_TIME=pd.to_datetime(dataset["DATE_TIME"]))
 
-# fill non-existent days with NaN
-whole_year = pd.date_range(
-    start="1/1/2020 00:00:00", end="31/12/2020 23:00:00", freq="1H"
-)
-missing_dates = whole_year[~(whole_year.isin(dataset["DATE_TIME"]))]
+    # sum the hourly passengers of all lines
+    dataset = (
+        dataset.groupby("DATE_TIME").agg({"NUMBER_OF_PASSENGER": "sum"}).reset_index()
+    )
 
-missing_dates = pd.DataFrame(data=missing_dates, columns=["DATE_TIME"])
-missing_dates["NUMBER_OF_PASSENGER"] = [np.nan for i in range(0, len(missing_dates))]
+    # fill non-existent hours with NaN
+    dataset, coverage = fill_hourly_gaps(dataset, start, end, whole_years)
+
+    # expand 'DATE_TIME' column to diff. columns
+    dataset["day"] = dataset["DATE_TIME"].dt.day.astype(int)
+    dataset["month"] = dataset["DATE_TIME"].dt.month.astype(int)
+    dataset["year"] = dataset["DATE_TIME"].dt.year.astype(int)
+    dataset["hour"] = dataset["DATE_TIME"].dt.hour.astype(int)
+    # the hour as a single integer key, and the day of the week (Monday is 0)
+    dataset["hour-key"] = hour_keys(dataset["DATE_TIME"])
+    dataset["weekday"] = dataset["DATE_TIME"].dt.weekday.astype(int)
+
+    # drop columns, change column order and rename columns
+    dataset = (
+        dataset.drop(["DATE_TIME"], axis=1)
+        .reindex(
+            columns=[
+                "hour-key",
+                "day",
+                "month",
+                "year",
+                "hour",
+                "weekday",
+                "NUMBER_OF_PASSENGER",
+            ]
+        )
+        .rename({"NUMBER_OF_PASSENGER": "n-passengers"}, axis=1)
+    )
 
-dataset = pd.concat([dataset, missing_dates], ignore_index=True)
+    return dataset, coverage
 
-# expand 'DATE_TIME' column to diff. columns
-dataset["day"] = dataset["DATE_TIME"].dt.day.astype(int)
-dataset["month"] = dataset["DATE_TIME"].dt.month.astype(int)
-dataset["year"] = dataset["DATE_TIME"].dt.year.astype(int)
-dataset["hour"] = dataset["DATE_TIME"].dt.hour.astype(int)
 
-# drop columns, change column order and rename columns
-dataset = (
-    dataset.sort_values(by="DATE_TIME", axis=0, ascending=True, ignore_index=True)
-    .drop(["DATE_TIME"], axis=1)
-    .reindex(columns=["day", "month", "year", "hour", "NUMBER_OF_PASSENGER"])
-    .rename({"NUMBER_OF_PASSENGER": "n-passengers"}, axis=1)
-)
+def line_name_key(name):
+    # compare line names case-insensitively (with the Turkish dotted and
+    # dotless i) and regardless of the spacing around dashes
+    name = name.replace("İ", "i").replace("I", "ı").lower()
+    return " - ".join(part.strip() for part in name.split("-"))
 
-# rewrite the dataset back into the dict
-datasets["transportation-load"] = dataset
 
-# --- clean 'automated-weather-stations-geoloc.csv' ---
-dataset = datasets["automated-weather-stations"]
-dataset = list(dataset.index[:10].values)  # Need this because it turns out weird
-dataset = pd.DataFrame(dataset, columns=["header", "sensor-name", "shape-data"])
+def clean_transportation_load_per_line(dataset, ferry_lines):
+    """Hourly passengers per line and transfer type, and their dimensions.
 
-# split out the 'shape-data' column to two temp columns
-dataset["shape-data"] = dataset["shape-data"].str.split(",")
+    The 'LINE' and 'TRANSFER_TYPE' values are dictionary-encoded into the
+    'load-lines' and 'transfer-types' tables, whose ids are assigned in name
+    order. A load line is linked to the 'ferry-lines' row of the same name,
+    if there is one.
+    """
+    missing = dataset[LINE_LOAD_KEYS].isna().any(axis=1)
+    if missing.any():
+        warnings.warn(
+            "Dropping {} hourly line loads without a date, line or transfer "
+            "type".format(missing.sum())
+        )
+        dataset = dataset.loc[~missing, :]
 
-for i, col_label in enumerate(["TEMP_x", "TEMP_y"]):
-    dataset[col_label] = dataset["shape-data"].apply(lambda x: x[i]).str.strip()
+    # dimension tables
+    line_codes, line_names = pd.factorize(dataset["LINE"], sort=True)
+    type_codes, transfer_types = pd.factorize(dataset["TRANSFER_TYPE"], sort=True)
+    ferry_line_ids = dict(
+        zip(ferry_lines["line-name"].map(line_name_key), ferry_lines["id"])
+    )
+    load_lines = pd.DataFrame(
+        {
+            "id": np.arange(1, len(line_names) + 1),
+            "line-name": line_names,
+            "ferry-line-id": [
+                ferry_line_ids.get(line_name_key(name)) for name in line_names
+            ],
+        }
+    )
+    transfer_types = pd.DataFrame(
+        {
+            "id": np.arange(1, len(transfer_types) + 1),
+            "transfer-type": transfer_types,
+        }
+    )
 
-# turn degrees-minutes notation of 'shape-data' to degrees notation
-for col_label in ["TEMP_x", "TEMP_y"]:
-    dataset[col_label] = dataset[col_label].apply(
-        lambda x: convert_coord(x, "degrees_minutes", "degrees")
+    # fact table, keyed by hour, line and transfer type
+    dataset = pd.DataFrame(
+        {
+            "hour-key": hour_keys(pd.to_datetime(dataset["DATE_TIME"])).to_numpy(),
+            "line-id": line_codes + 1,
+            "transfer-type-id": type_codes + 1,
+            "n-passengers": dataset["NUMBER_OF_PASSENGER"].to_numpy(),
+        }
+    )
+    # differently formatted 'DATE_TIME' values of the same hour are merged
+    dataset = (
+        dataset.groupby(["hour-key", "line-id", "transfer-type-id"])
+        .agg({"n-passengers": "sum"})
+        .reset_index()
     )
+    return dataset, load_lines, transfer_types
 
-# recreate the 'shape-data' column using WKT notation
-points = []
-for x, y in zip(dataset["TEMP_x"].values, dataset["TEMP_y"].values):
-    point = geometry.Point((x, y)).wkt
-    points.append(point)
-dataset["shape-data"] = points
 
-# drop unnecessary columns
-dataset = dataset.loc[:, ["sensor-name", "shape-data"]]
+def warn_invalid_geometries(names, shapes):
+    if len(shapes.invalid):
+        warnings.warn(
+            "{} rows with unparseable 'shape-data': {}".format(
+                len(shapes.invalid), sorted(set(names.iloc[shapes.invalid]))
+            )
+        )
 
-# sort by 'sensor-name' and give all sensors a unique id
-dataset = dataset.sort_values(by="sensor-name")
-dataset["id"] = [i for i in range(1, len(dataset) + 1)]
 
-# reorder columns
-dataset = dataset.reindex(columns=["id", "sensor-name", "shape-data"])
+def parse_sensor_coords(dataset):
+    # parse 'shape-data' into latitude ('TEMP_x') and longitude ('TEMP_y')
+    coords = parse_coords(dataset["shape-data"])
+    if len(coords.invalid):
+        warnings.warn(
+            "Dropping sensors with unparseable coordinates: {}".format(
+                dataset["sensor-name"].iloc[coords.invalid].tolist()
+            )
+        )
+    dataset = dataset.assign(TEMP_x=coords.lat, TEMP_y=coords.lon)
+    return dataset.drop(dataset.index[coords.invalid])
 
-# rewrite the dataset back into the dict
-datasets["automated-weather-stations"] = dataset
 
-# --- clean 'icing-sensors.geoloc.csv' ---
-dataset = datasets["icing-sensors"]
-dataset = (
-    dataset.loc[:, ["station-header", "station-name_1"]]
-    .rename({"station-header": "sensor-name", "station-name_1": "shape-data"}, axis=1)
-    .reset_index(drop=True)
-)
-# split out the 'shape-data' column to two temp columns
-dataset["shape-data"] = dataset["shape-data"].str.split(",")
+# --- clean 'automated-weather-stations-geoloc.csv' ---
+def clean_automated_weather_stations(dataset):
+    # Need this because it turns out weird: the rows end up in the index, and
+    # the trailing empty rows are dropped
+    dataset = [row for row in dataset.index if isinstance(row[1], str)]
+    dataset = pd.DataFrame(dataset, columns=["header", "sensor-name", "shape-data"])
 
-for i, col_label in enumerate(["TEMP_x", "TEMP_y"]):
-    dataset[col_label] = dataset["shape-data"].apply(lambda x: x[i]).str.strip()
+    # turn degrees-minutes notation of 'shape-data' to degrees notation
+    dataset = parse_sensor_coords(dataset)
 
-# turn degrees-minutes-seconds notation of 'shape-data' to degrees notation
-for col_label in ["TEMP_x", "TEMP_y"]:
-    dataset[col_label] = dataset[col_label].apply(
-        lambda x: convert_coord(x, "degrees_minutes_seconds", "degrees")
+    # recreate the 'shape-data' column using WKT notation, as (lon lat) points
+    # like the ferry terminals and lines
+    dataset["shape-data"] = points_from_coords(
+        lon=dataset["TEMP_y"], lat=dataset["TEMP_x"]
+    ).wkt
+
+    # drop unnecessary columns
+    dataset = dataset.loc[:, ["sensor-name", "shape-data"]]
+
+    # sort by 'sensor-name' and give all sensors a unique id
+    dataset = dataset.sort_values(by="sensor-name")
+    dataset["id"] = [i for i in range(1, len(dataset) + 1)]
+
+    # reorder columns
+    dataset = dataset.reindex(columns=["id", "sensor-name", "shape-data"])
+
+    return dataset
+
+
+# --- clean 'icing-sensors.geoloc.csv' ---
+def clean_icing_sensors(dataset):
+    dataset = (
+        dataset.loc[:, ["station-header", "station-name_1"]]
+        .rename(
+            {"station-header": "sensor-name", "station-name_1": "shape-data"}, axis=1
+        )
+        .reset_index(drop=True)
     )
+    # turn degrees-minutes-seconds notation of 'shape-data' to degrees notation
+    dataset = parse_sensor_coords(dataset)
 
-# recreate the 'shape-data' column using WKT notation
-points = []
-for x, y in zip(dataset["TEMP_x"].values, dataset["TEMP_y"].values):
-    point = geometry.Point((x, y)).wkt
-    points.append(point)
-dataset["shape-data"] = points
+    # recreate the 'shape-data' column using WKT notation, as (lon lat) points
+    # like the ferry terminals and lines
+    dataset["shape-data"] = points_from_coords(
+        lon=dataset["TEMP_y"], lat=dataset["TEMP_x"]
+    ).wkt
 
+    # sort by 'sensor-name' and give all sensors a unique id
+    dataset = dataset.sort_values(by="sensor-name")
+    dataset["id"] = [i for i in range(1, len(dataset) + 1)]
 
-# sort by 'sensor-name' and give all sensors a unique id
-dataset = dataset.sort_values(by="sensor-name")
-dataset["id"] = [i for i in range(1, len(dataset) + 1)]
+    #  reorder columns
+    dataset = dataset.reindex(columns=["id", "sensor-name", "shape-data"])
 
-#  reorder columns
-dataset = dataset.reindex(columns=["id", "sensor-name", "shape-data"])
+    return dataset
 
-# rewrite the dataset back into the dict
-datasets["icing-sensors"] = dataset
+
+def icing_station_names(dataset):
+    # station name -> 'sensor-name' of the icing sensors, which are named
+    # after their location (in 'station-header', as the columns are shifted)
+    # in 'weather-sensors' and after their station in the observations
+    return dict(
+        zip(
+            dataset.index.get_level_values(1).astype(str).str.strip(),
+            dataset["station-header"].astype(str).str.strip(),
+        )
+    )
 
 
 # --- merge 'automated-weather-stations' and 'icing-sensors' ---
-dataset = pd.concat(
-    objs=[datasets["automated-weather-stations"], datasets["icing-sensors"]],
-    ignore_index=True,
-)
+def merge_weather_sensors(automated_weather_stations, icing_sensors):
+    dataset = pd.concat(
+        objs=[automated_weather_stations, icing_sensors],
+        ignore_index=True,
+    )
 
-# Fix 'sensor-name' string formatting issues
-dataset["sensor-name"] = dataset["sensor-name"].str.lstrip()
+    # Fix 'sensor-name' string formatting issues
+    dataset["sensor-name"] = dataset["sensor-name"].str.lstrip()
+
+    # sort by 'sensor-name' and give all sensors a unique id
+    dataset = dataset.sort_values(by="sensor-name", ascending=True).reset_index(
+        drop=True
+    )
+    dataset["id"] = [i for i in range(1, len(dataset) + 1)]
 
-# sort by 'sensor-name' and give all sensors a unique id
-dataset = dataset.sort_values(by="sensor-name", ascending=True).reset_index(drop=True)
-dataset["id"] = [i for i in range(1, len(dataset) + 1)]
+    return dataset
 
-# write the dataset into the dict
-datasets["weather-sensors"] = dataset
 
 # --- clean 'observations-load_2020xx.csv's ---
-dataset = datasets["weather-observations"]
-
-# drop unnecessary columns
-dataset = dataset.loc[
-    :,
-    [
-        "DATE_TIME",
-        "AVERAGE_TEMPERATURE",
-        "AVERAGE_HUMIDITY",
-        "AVERAGE_WIND",
-        "AVERAGE_DIRECTIONOFWIND",
-        "AVERAGE_PRECIPITATION",
-    ],
-]
+def clean_weather_observations(
+    dataset, aggregated=False, start=None, end=None, whole_years=False
+):
+    # partial aggregates are already valid hourly means over all stations
+    if not aggregated:
+        # drop unnecessary columns
+        dataset = dataset.loc[
+            :,
+            [
+                "DATE_TIME",
+                "AVERAGE_TEMPERATURE",
+                "AVERAGE_HUMIDITY",
+                "AVERAGE_WIND",
+                "AVERAGE_DIRECTIONOFWIND",
+                "AVERAGE_PRECIPITATION",
+            ],
+        ]
 
-# fix 'DATE_TIME' column value format discrepancies
-# can be done by converting to DT object
-dataset["DATE_TIME"] = pd.to_datetime(dataset["DATE_TIME"])
-
-# replace illogical values in numerical columns with NaN
-for col in [
-    "AVERAGE_HUMIDITY",
-    "AVERAGE_WIND",
-    "AVERAGE_PRECIPITATION",
-    "AVERAGE_DIRECTIONOFWIND",
-]:
-    illogical_mask = dataset[col] < 0
-    dataset.loc[illogical_mask, col] = np.nan
-
-# group by 'DATE_TIME' to get an avg of different stations
-dataset = (
-    dataset.groupby("DATE_TIME")
-    .agg(
-        {
-            "AVERAGE_TEMPERATURE": "mean",
-            "AVERAGE_HUMIDITY": "mean",
-            "AVERAGE_WIND": "mean",
-            "AVERAGE_DIRECTIONOFWIND": "mean",
-            "AVERAGE_PRECIPITATION": "mean",
-        }
-    )
-    .reset_index()
-)
+        # read as categories, but parsed as plain values
+        dataset = decategorize(dataset)
+
+        # fix 'DATE_TIME' column value format discrepancies
+        # can be done by converting to DT object
+        dataset["DATE_TIME"] = pd.to_datetime(dataset["DATE_TIME"])
+
+        # replace illogical values in numerical columns with NaN
+        for col in [
+            "AVERAGE_HUMIDITY",
+            "AVERAGE_WIND",
+            "AVERAGE_PRECIPITATION",
+            "AVERAGE_DIRECTIONOFWIND",
+        ]:
+            illogical_mask = dataset[col] < 0
+            dataset.loc[illogical_mask, col] = np.nan
+
+        # group by 'DATE_TIME' to get an avg of different stations
+        dataset = (
+            dataset.groupby("DATE_TIME")
+            .agg(
+                {
+                    "AVERAGE_TEMPERATURE": "mean",
+                    "AVERAGE_HUMIDITY": "mean",
+                    "AVERAGE_WIND": "mean",
+                    "AVERAGE_DIRECTIONOFWIND": "mean",
+                    "AVERAGE_PRECIPITATION": "mean",
+                }
+            )
+            .reset_index()
+        )
 
-# fill non-existent days with NaN
-whole_year = pd.date_range(
-    start="1/1/2020 00:00:00", end="31/12/2020 23:00:00", freq="1H"
-)
-missing_dates = whole_year[~(whole_year.isin(dataset["DATE_TIME"]))]
-
-missing_dates = pd.DataFrame(data=missing_dates, columns=["DATE_TIME"])
-for col_header in [
-    "AVERAGE_TEMPERATURE",
-    "AVERAGE_HUMIDITY",
-    "AVERAGE_WIND",
-    "AVERAGE_DIRECTIONOFWIND",
-    "AVERAGE_PRECIPITATION",
-]:
-    missing_dates[col_header] = [np.nan for i in range(0, len(missing_dates))]
-
-dataset = pd.concat([dataset, missing_dates], ignore_index=True)
-
-# expand 'DATE_TIME' column to diff. columns
-dataset["day"] = dataset["DATE_TIME"].dt.day.astype(int)
-dataset["month"] = dataset["DATE_TIME"].dt.month.astype(int)
-dataset["year"] = dataset["DATE_TIME"].dt.year.astype(int)
-dataset["hour"] = dataset["DATE_TIME"].dt.hour.astype(int)
-
-# sort date_time and then clean up columns
-dataset = (
-    dataset.sort_values(by="DATE_TIME", ascending=True)
-    .drop("DATE_TIME", axis=1)
-    .rename(
-        {
-            "AVERAGE_TEMPERATURE": "avg-temp",
-            "AVERAGE_HUMIDITY": "avg-humidity",
-            "AVERAGE_WIND": "avg-wind",
-            "AVERAGE_DIRECTIONOFWIND": "avg-winddir",
-            "AVERAGE_PRECIPITATION": "avg-precip",
-        },
-        axis=1,
-    )
-    .reindex(
-        columns=[
-            "day",
-            "month",
-            "year",
-            "hour",
-            "avg-temp",
-            "avg-humidity",
-            "avg-precip",
-            "avg-wind",
-            "avg-winddir",
-        ]
+    # fill non-existent hours with NaN
+    dataset, coverage = fill_hourly_gaps(dataset, start, end, whole_years)
+
+    # expand 'DATE_TIME' column to diff. columns
+    dataset["day"] = dataset["DATE_TIME"].dt.day.astype(int)
+    dataset["month"] = dataset["DATE_TIME"].dt.month.astype(int)
+    dataset["year"] = dataset["DATE_TIME"].dt.year.astype(int)
+    dataset["hour"] = dataset["DATE_TIME"].dt.hour.astype(int)
+    # the hour as a single integer key, and the day of the week (Monday is 0)
+    dataset["hour-key"] = hour_keys(dataset["DATE_TIME"])
+    dataset["weekday"] = dataset["DATE_TIME"].dt.weekday.astype(int)
+
+    # clean up columns, the hours are already sorted
+    dataset = (
+        dataset.drop("DATE_TIME", axis=1)
+        .rename(
+            {
+                "AVERAGE_TEMPERATURE": "avg-temp",
+                "AVERAGE_HUMIDITY": "avg-humidity",
+                "AVERAGE_WIND": "avg-wind",
+                "AVERAGE_DIRECTIONOFWIND": "avg-winddir",
+                "AVERAGE_PRECIPITATION": "avg-precip",
+            },
+            axis=1,
+        )
+        .reindex(
+            columns=[
+                "hour-key",
+                "day",
+                "month",
+                "year",
+                "hour",
+                "weekday",
+                "avg-temp",
+                "avg-humidity",
+                "avg-precip",
+                "avg-wind",
+                "avg-winddir",
+            ]
+        )
     )
-)
 
-# rewrite to datasets dictionary
-datasets["weather-observations"] = dataset
+    return dataset, coverage
 
-# --- export data ---
-for dataset_name in [
+
+CLEANED_DATASETS = [
     "ferry-terminals",
     "ferry-lines",
     "terminals-lines",
     "trips-per-ferry-line",
     "transportation-load",
+    "load-lines",
+    "transfer-types",
+    "transportation-load-per-line",
     "weather-sensors",
     "weather-observations",
-]:
-    path = Path("data/cleaned/{}.csv".format(dataset_name))
-    datasets[dataset_name].to_csv(
-        path_or_buf=path, sep=",", index=False, encoding="utf-8-sig"
+]
+# datasets whose missing hours are filled, and the report of their coverage
+HOURLY_DATASETS = ["transportation-load", "weather-observations"]
+COVERAGE_FILE = "hourly-coverage.csv"
+
+
+def build_steps(
+    cache,
+    streaming=False,
+    chunksize=100_000,
+    partials_dir=None,
+    start=None,
+    end=None,
+    whole_years=False,
+):
+    # 'raw-<tag>' outputs are the raw datasets as listed in 'import_dicts';
+    # the hourly datasets are filled from 'start' to 'end', or over the
+    # whole years of the data with 'whole_years' (see gaps.py)
+    load = partial(
+        load_raw_dataset,
+        cache=cache,
+        streaming=streaming,
+        chunksize=chunksize,
+        partials_dir=partials_dir,
+    )
+    steps = [
+        Step(
+            "load {}".format(import_dict["tag"]),
+            partial(load, import_dict),
+            inputs=(),
+            outputs=("raw-{}".format(import_dict["tag"]),),
+        )
+        for import_dict in import_dicts
+    ]
+    # per station, unlike the hourly means of 'weather-observations'
+    steps.append(
+        Step(
+            "load station-observations",
+            partial(
+                load_station_observations,
+                next(d for d in import_dicts if d["tag"] == "weather-observations"),
+                cache,
+            ),
+            inputs=(),
+            outputs=("raw-station-observations",),
+        )
+    )
+    # monthly datasets that were reduced to hourly sums while being loaded
+    aggregated = {
+        tag
+        for tag in AGGREGATORS
+        if partials_dir is not None or (streaming and tag == "transportation-load")
+    }
+    steps += [
+        Step(
+            "clean ferry-terminals",
+            clean_ferry_terminals,
+            inputs=("raw-ferry-terminals",),
+            outputs=("ferry-terminals", "terminals-has-line"),
+        ),
+        Step(
+            "clean ferry-lines",
+            clean_ferry_lines,
+            inputs=("raw-ferry-lines",),
+            outputs=("ferry-lines",),
+        ),
+        Step(
+            "clean terminals-lines",
+            clean_terminals_lines,
+            inputs=("terminals-has-line", "ferry-lines"),
+            outputs=("terminals-lines",),
+        ),
+        Step(
+            "clean trips-per-ferry-line",
+            clean_trips_per_ferry_line,
+            inputs=("raw-trips-per-ferry-line",),
+            outputs=("trips-per-ferry-line",),
+        ),
+        Step(
+            "sum line-load",
+            partial(
+                sum_line_load,
+                aggregated="transportation-load" in aggregated,
+            ),
+            inputs=("raw-transportation-load",),
+            outputs=("line-load",),
+        ),
+        Step(
+            "clean transportation-load",
+            partial(
+                clean_transportation_load,
+                start=start,
+                end=end,
+                whole_years=whole_years,
+            ),
+            inputs=("line-load",),
+            outputs=("transportation-load", "transportation-load-coverage"),
+        ),
+        Step(
+            "clean transportation-load-per-line",
+            clean_transportation_load_per_line,
+            inputs=("line-load", "ferry-lines"),
+            outputs=("transportation-load-per-line", "load-lines", "transfer-types"),
+        ),
+        Step(
+            "clean automated-weather-stations",
+            clean_automated_weather_stations,
+            inputs=("raw-automated-weather-stations",),
+            outputs=("automated-weather-stations",),
+        ),
+        Step(
+            "clean icing-sensors",
+            clean_icing_sensors,
+            inputs=("raw-icing-sensors",),
+            outputs=("icing-sensors",),
+        ),
+        Step(
+            "merge weather-sensors",
+            merge_weather_sensors,
+            inputs=("automated-weather-stations", "icing-sensors"),
+            outputs=("weather-sensors",),
+        ),
+        Step(
+            "clean weather-observations",
+            partial(
+                clean_weather_observations,
+                aggregated="weather-observations" in aggregated,
+                start=start,
+                end=end,
+                whole_years=whole_years,
+            ),
+            inputs=("raw-weather-observations",),
+            outputs=("weather-observations", "weather-observations-coverage"),
+        ),
+        Step(
+            "name icing-stations",
+            icing_station_names,
+            inputs=("raw-icing-sensors",),
+            outputs=("icing-station-names",),
+        ),
+        Step(
+            "build weather-cube",
+            partial(build_cube, start=start, end=end, whole_years=whole_years),
+            inputs=(
+                "raw-station-observations",
+                "weather-sensors",
+                "icing-station-names",
+            ),
+            outputs=("weather-cube",),
+        ),
+    ]
+    return steps
+
+
+# --- export data ---
+def export_datasets(
+    datasets, cleaned_dir=CLEANED_DIR, csv=False, derived_dir=DERIVED_DIR
+):
+    # the Arrow files are read by create_db.py, the .csv files are optional
+    # human readable copies. The coverage report and the weather cube go to
+    # 'derived_dir', which outlives the clean-up of 'cleaned_dir'
+    tables = {}
+    for dataset_name in CLEANED_DATASETS:
+        tables[dataset_name] = to_arrow_table(dataset_name, datasets[dataset_name])
+        write_dataset(dataset_name, tables[dataset_name], cleaned_dir)
+        if csv:
+            path = Path(cleaned_dir) / "{}.csv".format(dataset_name)
+            datasets[dataset_name].to_csv(
+                path_or_buf=path, sep=",", index=False, encoding="utf-8-sig"
+            )
+    export_coverage(datasets, derived_dir)
+    write_cube(*datasets["weather-cube"], derived_dir=derived_dir)
+    return tables
+
+
+def export_coverage(datasets, derived_dir=DERIVED_DIR):
+    # the missing hours of the hourly datasets per month, a small report
+    # that is always written as .csv
+    coverage = pd.concat(
+        [
+            datasets["{}-coverage".format(name)].assign(dataset=name)
+            for name in HOURLY_DATASETS
+        ],
+        ignore_index=True,
+    )
+    coverage = coverage.reindex(columns=["dataset"] + COVERAGE_COLUMNS)
+    Path(derived_dir).mkdir(parents=True, exist_ok=True)
+    coverage.to_csv(
+        path_or_buf=Path(derived_dir) / COVERAGE_FILE,
+        sep=",",
+        index=False,
+        encoding="utf-8-sig",
+    )
+
+
+def main(argv=None):
+    # --- parse command line options ---
+    parser = argparse.ArgumentParser(
+        description="Clean the raw datasets under 'data/raw'."
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="read 'transportation-load' in chunks, keeping only hourly ferry sums",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="number of raw rows per chunk in streaming mode",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always re-parse the raw files instead of using the parsed file cache",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=CACHE_DIR,
+        help="directory of the parsed raw file cache",
+    )
+    parser.add_argument(
+        "--partials-dir",
+        type=Path,
+        default=None,
+        help=(
+            "merge the per-month partial aggregates written by aggregate_month.py "
+            "under this directory instead of reading the monthly raw files"
+        ),
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help=(
+            "number of worker processes for independent cleaning steps, "
+            "0 runs all steps one after another in this process"
+        ),
+    )
+    parser.add_argument(
+        "--start",
+        default=None,
+        help=(
+            "first hour of the hourly datasets, e.g. '2020-01-01 00:00' "
+            "(default: the first hour in the data)"
+        ),
+    )
+    parser.add_argument(
+        "--end",
+        default=None,
+        help="last hour of the hourly datasets (default: the last hour in the data)",
+    )
+    parser.add_argument(
+        "--whole-years",
+        action="store_true",
+        help=(
+            "fill the hourly datasets from the first to the last hour of the "
+            "calendar years in the data, where '--start' or '--end' isn't given"
+        ),
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="also export the cleaned datasets as .csv files",
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help=(
+            "also build the database straight from the cleaned datasets, "
+            "without reading the exported files back"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="write a profiling report of the cleaning steps next to the DB",
+    )
+    args = parser.parse_args(argv)
+    profiler = Profiler("clean_raw", profiling_enabled(args.profile))
+
+    # parsed (and, for 'transportation-load', filtered) raw files are cached by
+    # content hash, so that re-cleaning only parses the files that changed
+    cache = ParsedFrameCache(cache_dir=args.cache_dir, enabled=not args.no_cache)
+    cache.evict_stale()
+
+    steps = build_steps(
+        cache,
+        streaming=args.streaming,
+        chunksize=args.chunksize,
+        partials_dir=args.partials_dir,
+        start=args.start,
+        end=args.end,
+        whole_years=args.whole_years,
+    )
+    datasets = run_steps(steps, max_workers=args.workers, profiler=profiler)
+    with profiler.stage("export datasets") as record:
+        tables = export_datasets(datasets, csv=args.csv)
+        record["rows-in"] = record["rows-out"] = count_rows(tables)
+    if args.db:
+        build_db(tables, profiler=profiler)
+    profiler.write_report(profile_path(DB_PATH))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from src.profiling import profile_call
+
+# 'func' is called with the values of 'inputs' (in order) and must return one
+# value per name in 'outputs' (a tuple if there is more than one)
+Step = namedtuple("Step", ["name", "func", "inputs", "outputs"])
+
+
+def check_steps(steps, available=()):
+    """Return 'steps' in a valid execution order or raise a ValueError."""
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError("Step names must be unique")
+
+    producers = {}
+    for step in steps:
+        for output in step.outputs:
+            if output in producers or output in available:
+                raise ValueError("'{}' is produced more than once".format(output))
+            producers[output] = step.name
+    for step in steps:
+        for name in step.inputs:
+            if name not in producers and name not in available:
+                raise ValueError(
+                    "Input '{}' of step '{}' is never produced".format(name, step.name)
+                )
+
+    ordered = []
+    done = set(available)
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if done.issuperset(step.inputs)]
+        if not ready:
+            raise ValueError(
+                "Steps {} depend on each other".format([step.name for step in pending])
+            )
+        for step in ready:
+            pending.remove(step)
+            ordered.append(step)
+            done.update(step.outputs)
+    return ordered
+
+
+def _store_outputs(results, step, value):
+    if len(step.outputs) == 1:
+        value = (value,)
+    if len(value) != len(step.outputs):
+        raise ValueError(
+            "Step '{}' returned {} values for outputs {}".format(
+                step.name, len(value), step.outputs
+            )
+        )
+    results.update(zip(step.outputs, value))
+
+
+def run_steps(steps, inputs=None, max_workers=None, profiler=None):
+    """Run 'steps' as a DAG and return a dict of all inputs and outputs.
+
+    A step is submitted to the process pool as soon as all of its inputs are
+    available, so independent branches run concurrently and the wall-clock
+    time is bounded by the longest chain of steps. 'max_workers=0' runs the
+    steps one after another in the calling process. With an enabled
+    'profiler', every step is profiled where it runs and its record is added
+    to the profiler.
+    """
+    results = dict(inputs or {})
+    ordered = check_steps(steps, available=results)
+    profiled = profiler is not None and profiler.enabled
+
+    if max_workers == 0:
+        for step in ordered:
+            args = [results[name] for name in step.inputs]
+            if profiled:
+                value = profiler.call(step.name, step.func, *args)
+            else:
+                value = step.func(*args)
+            _store_outputs(results, step, value)
+        return results
+
+    pending = list(ordered)
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            ready = [step for step in pending if all(i in results for i in step.inputs)]
+            for step in ready:
+                pending.remove(step)
+                args = [results[name] for name in step.inputs]
+                if profiled:
+                    future = executor.submit(profile_call, step.name, step.func, *args)
+                else:
+                    future = executor.submit(step.func, *args)
+                running[future] = step
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                value = future.result()
+                if profiled:
+                    value, record = value
+                    profiler.add(record)
+                _store_outputs(results, step, value)
+    return results
@@ -0,0 +1,103 @@
+"""
+Filling the missing hours of the hourly datasets.
+
+The hours are handled as integer 'hour-key's (see helper_functions.py), so a
+dataset is filled by a single reindex onto the range of keys. By default the
+range runs from the first to the last hour of the data. With 'whole_years'
+it is padded to the whole calendar years of the data instead (e.g. weather
+observations of May 2020 are filled to all of 2020). A 'start' and 'end'
+date/time can be given as well, and rows outside of them are dropped.
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.db_layout import HOUR_KEY_EPOCH, hour_keys, to_hour_key
+
+COVERAGE_COLUMNS = [
+    "year",
+    "month",
+    "n-hours",
+    "n-missing",
+    "n-gaps",
+    "longest-gap",
+]
+
+
+def hour_range(keys, start=None, end=None, whole_years=False):
+    """Return the first and last 'hour-key' of the range to fill.
+
+    A missing 'start' or 'end' is the first or last of 'keys', or with
+    'whole_years' the first or last hour of its calendar year.
+    """
+    if start is None or end is None:
+        if not len(keys):
+            raise ValueError("Cannot derive the hour range of an empty dataset")
+        first, last = int(keys.min()), int(keys.max())
+        if whole_years:
+            years = HOUR_KEY_EPOCH + pd.to_timedelta([first, last], unit="h")
+            first = to_hour_key(pd.Timestamp(year=years[0].year, month=1, day=1))
+            last = to_hour_key(pd.Timestamp(year=years[1].year + 1, month=1, day=1)) - 1
+    if start is not None:
+        first = to_hour_key(start)
+    if end is not None:
+        last = to_hour_key(end)
+    if last < first:
+        raise ValueError("The hour range ends before it starts")
+    return first, last
+
+
+def coverage_by_month(keys, missing):
+    """Per month: its hours, the missing ones, and the runs of missing hours.
+
+    A run of missing hours (a gap) is counted in the month in which it
+    starts, and 'longest-gap' is the length of its longest gap in hours.
+    """
+    date_times = HOUR_KEY_EPOCH + pd.to_timedelta(keys, unit="h")
+    months = pd.DataFrame(
+        {"year": date_times.year, "month": date_times.month, "missing": missing}
+    )
+
+    # a gap starts at every missing hour that follows a present one
+    starts = missing & ~np.concatenate([[False], missing[:-1]])
+    gap_ids = np.cumsum(starts)[missing]
+    gaps = pd.DataFrame(
+        {
+            "year": date_times.year[starts],
+            "month": date_times.month[starts],
+            "length": np.bincount(gap_ids)[1:],
+        }
+    )
+
+    coverage = months.groupby(["year", "month"]).agg(
+        **{"n-hours": ("missing", "size"), "n-missing": ("missing", "sum")}
+    )
+    gap_stats = gaps.groupby(["year", "month"]).agg(
+        **{"n-gaps": ("length", "size"), "longest-gap": ("length", "max")}
+    )
+    coverage = coverage.join(gap_stats).fillna(0).astype(int)
+    return coverage.reset_index().reindex(columns=COVERAGE_COLUMNS)
+
+
+def fill_hourly_gaps(dataset, start=None, end=None, whole_years=False):
+    """Reindex 'dataset' onto every hour of its range (see hour_range()).
+
+    'dataset' has one row per hour in its datetime64 'DATE_TIME' column. The
+    missing hours get NaN values, and the result is sorted by 'DATE_TIME'.
+    Returns the filled dataset and its coverage_by_month().
+    """
+    keys = hour_keys(dataset["DATE_TIME"])
+    if keys.duplicated().any():
+        raise ValueError("'DATE_TIME' has more than one row per hour")
+    first, last = hour_range(keys, start, end, whole_years)
+    all_keys = pd.RangeIndex(first, last + 1)
+
+    dataset = (
+        dataset.drop(columns="DATE_TIME")
+        .set_index(pd.Index(keys.to_numpy()))
+        .reindex(all_keys)
+    )
+    dataset.insert(0, "DATE_TIME", HOUR_KEY_EPOCH + pd.to_timedelta(all_keys, unit="h"))
+
+    missing = ~all_keys.isin(keys)
+    return dataset.reset_index(drop=True), coverage_by_month(all_keys, missing)
@@ -0,0 +1,167 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import pandas as pd
+
+
+def _as_list(cols):
+    return [cols] if isinstance(cols, str) else list(cols)
+
+
+def decategorize(dataset):
+    # categorical columns back to plain values, once a frame was filtered
+    # down, so that grouping by them only yields the observed groups
+    cat_cols = [
+        col
+        for col, dtype in dataset.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    ]
+    if not cat_cols:
+        return dataset
+    return dataset.astype({col: object for col in cat_cols})
+
+
+def list_raw_files(dir_path, pattern="*.csv"):
+    # sort by file name so that monthly drops (e.g. '..._202001.csv') are
+    # always read in chronological order, whatever the file system returns
+    return sorted(Path(dir_path).glob(pattern), key=lambda path: path.name)
+
+
+def read_dir(
+    dir_path,
+    read_file,
+    pattern="*.csv",
+    max_workers=None,
+    use_processes=False,
+    sort_by=None,
+):
+    """Apply 'read_file' to every file in 'dir_path' on a worker pool.
+
+    Files are read in file name order and concatenated once. The result is
+    optionally sorted by 'sort_by' with a stable sort, so the output never
+    depends on the order in which the workers finish.
+    """
+    paths = list_raw_files(dir_path, pattern)
+    if not paths:
+        raise FileNotFoundError(
+            "No files matching '{}' under '{}'".format(pattern, dir_path)
+        )
+
+    if len(paths) == 1:
+        frames = [read_file(paths[0])]
+    else:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=max_workers) as executor:
+            # 'map' yields results in submission order
+            frames = list(executor.map(read_file, paths))
+
+    dataset = pd.concat(frames, ignore_index=True)
+    if sort_by is not None:
+        dataset = dataset.sort_values(by=sort_by, kind="mergesort", ignore_index=True)
+    return dataset
+
+
+def read_csv_dir(
+    dir_path,
+    pattern="*.csv",
+    max_workers=None,
+    use_processes=False,
+    sort_by=None,
+    **read_csv_kwargs,
+):
+    return read_dir(
+        dir_path,
+        partial(pd.read_csv, **read_csv_kwargs),
+        pattern=pattern,
+        max_workers=max_workers,
+        use_processes=use_processes,
+        sort_by=sort_by,
+    )
+
+
+def read_filtered_csv(path, filter_col, filter_value, **read_csv_kwargs):
+    dataset = pd.read_csv(path, **read_csv_kwargs)
+    return decategorize(
+        dataset.loc[dataset[filter_col] == filter_value, :].reset_index(drop=True)
+    )
+
+
+def sum_csv_chunks(
+    path,
+    by,
+    value,
+    filter_col=None,
+    filter_value=None,
+    chunksize=100_000,
+    **read_csv_kwargs,
+):
+    """Stream 'path' in chunks and return the sums of 'value' per 'by' key.
+
+    'by' is a column name or a list of them, and missing keys form groups
+    of their own. A 'dtype' for columns that are not read is ignored. Rows
+    are filtered on 'filter_col == filter_value' inside the chunk loop so
+    that at most 'chunksize' unfiltered rows are held in memory at any time.
+    """
+    by = _as_list(by)
+    usecols = by + [value] if filter_col is None else by + [filter_col, value]
+    partials = []
+    reader = pd.read_csv(path, usecols=usecols, chunksize=chunksize, **read_csv_kwargs)
+    with reader:
+        for chunk in reader:
+            if filter_col is not None:
+                chunk = chunk.loc[chunk[filter_col] == filter_value, by + [value]]
+            chunk = decategorize(chunk)
+            partials.append(
+                chunk.groupby(by, dropna=False).agg({value: "sum"}).reset_index()
+            )
+    return merge_partial_sums(partials, by, value)
+
+
+def merge_partial_sums(partials, by, value):
+    # sums are associative, so re-grouping the stacked partial sums gives the
+    # same result as grouping all of the rows at once
+    by = _as_list(by)
+    partials = [partial for partial in partials if len(partial)]
+    if not partials:
+        return pd.DataFrame(columns=by + [value])
+    dataset = pd.concat(partials, ignore_index=True)
+    return dataset.groupby(by, dropna=False).agg({value: "sum"}).reset_index()
+
+
+def stream_csv_dir_sums(
+    dir_path,
+    by,
+    value,
+    pattern="*.csv",
+    filter_col=None,
+    filter_value=None,
+    chunksize=100_000,
+    cache=None,
+    cache_stage=None,
+    **read_csv_kwargs,
+):
+    """Chunked, filtered 'by'/'value' sums over every file in 'dir_path'.
+
+    Only one chunk and the (small) per-file partial sums are alive at once,
+    so peak memory does not grow with the number of files. When a 'cache' is
+    given, the per-file partial sums are stored under 'cache_stage'.
+    """
+    paths = list_raw_files(dir_path, pattern)
+    if not paths:
+        raise FileNotFoundError(
+            "No files matching '{}' under '{}'".format(pattern, dir_path)
+        )
+
+    sum_file = partial(
+        sum_csv_chunks,
+        by=by,
+        value=value,
+        filter_col=filter_col,
+        filter_value=filter_value,
+        chunksize=chunksize,
+        **read_csv_kwargs,
+    )
+    if cache is not None:
+        sum_file = partial(cache.load_or_parse, stage=cache_stage, parse=sum_file)
+    return merge_partial_sums([sum_file(path) for path in paths], by, value)
@@ -0,0 +1,43 @@
+import re
+
+import numpy as np
+
+
+class ReplacementEngine:
+    """Ordered regex replacements compiled once and applied per distinct value.
+
+    'rules' is a mapping or an iterable of (pattern, repl) pairs, where 'repl'
+    is a string or a callable as accepted by re.sub. Applying the engine gives
+    the same result as calling Series.str.replace(pattern, repl, regex=True)
+    once per rule, in order.
+
+    The rules cannot be folded into a single alternation because they chain:
+    the output of one rule is matched by later ones (e.g. 'Boðaz' ->
+    'Bosphorus' -> 'From Bosph. to South' -> 'Bosphorus Line'). Instead, the
+    column is reduced to its distinct values, which are usually a handful,
+    and a combined alternation of all patterns is used to skip the values that
+    no rule can change.
+    """
+
+    def __init__(self, rules):
+        if hasattr(rules, "items"):
+            rules = rules.items()
+        self.rules = [(re.compile(pattern), repl) for pattern, repl in rules]
+        # a value that matches none of the patterns is left as is by the rules
+        self.any_rule = re.compile(
+            "|".join("(?:{})".format(pattern.pattern) for pattern, _ in self.rules)
+        )
+
+    def repair(self, value):
+        if not isinstance(value, str):
+            # like the .str accessor, non-string values become NaN
+            return np.nan
+        if self.any_rule.search(value) is None:
+            return value
+        for pattern, repl in self.rules:
+            value = pattern.sub(repl, value)
+        return value
+
+    def apply(self, series):
+        repaired = {value: self.repair(value) for value in series.dropna().unique()}
+        return series.map(repaired)
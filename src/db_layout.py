@@ -0,0 +1,111 @@
+"""
+Keys and names of the DB tables, shared by the build and the read side.
+
+The build (src/processing, src/cleaning) writes the tables and the read side
+(queries.py, the service) looks them up by these definitions. The module only
+depends on NumPy and pandas, so that readers don't import the build code or
+shapely with it.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+# --- Hour keys ---
+# the 'hour-key' of the hourly tables counts whole hours from this timestamp
+HOUR_KEY_EPOCH = pd.Timestamp("1970-01-01 00:00:00")
+
+
+def hour_keys(date_times):
+    # 'date_times' is a datetime64 Series of naive local (Istanbul) times
+    return (date_times - HOUR_KEY_EPOCH) // pd.Timedelta(hours=1)
+
+
+def to_hour_key(date_time):
+    # hours since HOUR_KEY_EPOCH of a date/time string or Timestamp,
+    # rounded down to the hour
+    return int((pd.Timestamp(date_time) - HOUR_KEY_EPOCH) // pd.Timedelta(hours=1))
+
+
+# --- Rollups ---
+# hourly table -> variables that are rolled up
+ROLLUP_SOURCES = {
+    "transportation-load": ["n-passengers"],
+    "weather-observations": [
+        "avg-temp",
+        "avg-humidity",
+        "avg-precip",
+        "avg-wind",
+        "avg-winddir",
+    ],
+}
+
+# grain -> [(key column, SQL expression over the hourly table, type)]. The
+# first key column is the primary key of the rollup, and only depends on the
+# 'hour-key', so that the group of a deleted hour is known too. The weeks
+# start on Monday and 1970-01-01 (day 0) was a Thursday
+GRAINS = {
+    "daily": [
+        ("day-key", '"hour-key" / 24', "INTEGER"),
+        ("year", '"year"', "INTEGER"),
+        ("month", '"month"', "INTEGER"),
+        ("day", '"day"', "INTEGER"),
+        ("weekday", '"weekday"', "INTEGER"),
+    ],
+    "weekly": [
+        ("week-key", '("hour-key" / 24 + 3) / 7', "INTEGER"),
+        (
+            "week-start",
+            "date((\"hour-key\" / 24 + 3) / 7 * 7 * 86400 - 3 * 86400, 'unixepoch')",
+            "TEXT",
+        ),
+    ],
+    "monthly": [
+        (
+            "month-key",
+            "CAST(strftime('%Y', \"hour-key\" * 3600, 'unixepoch') AS INTEGER) * 12"
+            " + CAST(strftime('%m', \"hour-key\" * 3600, 'unixepoch') AS INTEGER)"
+            " - 1",
+            "INTEGER",
+        ),
+        ("year", '"year"', "INTEGER"),
+        ("month", '"month"', "INTEGER"),
+    ],
+    "hour-of-week": [
+        (
+            "hour-of-week",
+            '("hour-key" / 24 + 3) % 7 * 24 + "hour-key" % 24',
+            "INTEGER",
+        ),
+        ("weekday", '"weekday"', "INTEGER"),
+        ("hour", '"hour"', "INTEGER"),
+    ],
+}
+
+
+def rollup_name(table, grain):
+    return "{}-{}".format(table, grain)
+
+
+# --- Simplified ferry-line shapes ---
+# tolerances of the simplified 'ferry-lines' geometries, in metres: level i
+# (from 1) is simplified with the i-th tolerance, and level 0 is the original
+LINE_SHAPE_TOLERANCES = [5, 25, 100, 500]
+# metres per pixel of a Web Mercator map at zoom level 0, at the equator
+ZOOM_0_METRES_PER_PIXEL = 156_543.034
+
+
+def metres_per_pixel(zoom, lat=41.0):
+    # scale of a Web Mercator map (e.g. OpenStreetMap tiles) at 'lat', by
+    # default that of the city
+    return ZOOM_0_METRES_PER_PIXEL * math.cos(math.radians(lat)) / 2**zoom
+
+
+def shape_level(scale, tolerances=LINE_SHAPE_TOLERANCES):
+    """The level of the line shapes to draw at 'scale' metres per pixel.
+
+    The coarsest level whose tolerance is at most a pixel, so that the
+    simplification can't be seen; 0 (the original) at finer scales.
+    """
+    return int(np.searchsorted(np.asarray(tolerances), scale, side="right"))
@@ -0,0 +1,131 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# 'geometries' holds shapely objects (None where invalid), 'wkt' and 'wkb' the
+# normalized serializations, and 'invalid' the positions that failed to parse
+GeometryBatch = namedtuple("GeometryBatch", ["geometries", "wkt", "wkb", "invalid"])
+
+# mean Earth radius, in metres
+EARTH_RADIUS = 6_371_008.8
+METRES_PER_DEGREE = math.pi / 180 * EARTH_RADIUS
+
+
+def _as_object_array(values):
+    # missing values (NaN, None) become None, which shapely treats as missing
+    values = pd.Series(np.asarray(values, dtype=object), dtype=object)
+    return values.where(values.notna(), None).to_numpy()
+
+
+def to_batch(geometries):
+    geometries = np.asarray(geometries, dtype=object)
+    invalid = shapely.is_missing(geometries)
+    return GeometryBatch(
+        geometries=geometries,
+        # full precision, like the 'wkt' property of shapely geometries
+        wkt=shapely.to_wkt(geometries, rounding_precision=-1),
+        wkb=shapely.to_wkb(geometries),
+        invalid=np.flatnonzero(invalid),
+    )
+
+
+def normalize_geometries(wkt_strs):
+    """Parse a whole column of WKT strings with shapely's array functions.
+
+    Strings that can't be parsed are reported in 'invalid' instead of being
+    silently turned into NaN.
+    """
+    geometries = shapely.from_wkt(_as_object_array(wkt_strs), on_invalid="ignore")
+    return to_batch(geometries)
+
+
+def points_from_coords(lon, lat):
+    # positions where either coordinate is NaN are reported as invalid
+    lon = np.asarray(lon, dtype="float64")
+    lat = np.asarray(lat, dtype="float64")
+    geometries = shapely.points(lon, lat).astype(object)
+    geometries[np.isnan(lon) | np.isnan(lat)] = None
+    return to_batch(geometries)
+
+
+def from_wkb(wkb_values):
+    return shapely.from_wkb(_as_object_array(wkb_values), on_invalid="ignore")
+
+
+def merge_lines(geometries):
+    # merge (multi)linestrings that represent the same line into one geometry
+    parts = shapely.get_parts(np.asarray(geometries, dtype=object))
+    return shapely.line_merge(shapely.multilinestrings(parts))
+
+
+def _local_scale(lat):
+    # metres per degree of longitude and latitude around 'lat'
+    return np.array(
+        [METRES_PER_DEGREE * math.cos(math.radians(lat)), METRES_PER_DEGREE]
+    )
+
+
+def to_local_metres(geometries, lon, lat):
+    # equirectangular projection centred on (lon, lat), accurate to well
+    # under a percent over the few tens of kilometres of the city
+    scale = _local_scale(lat)
+    return shapely.transform(
+        np.asarray(geometries, dtype=object),
+        lambda coords: (coords - [lon, lat]) * scale,
+    )
+
+
+def from_local_metres(geometries, lon, lat):
+    # inverse of to_local_metres()
+    scale = _local_scale(lat)
+    return shapely.transform(
+        np.asarray(geometries, dtype=object),
+        lambda coords: coords / scale + [lon, lat],
+    )
+
+
+def k_nearest(geometries, candidates, k):
+    """Match every geometry with its 'k' nearest candidates using an STRtree.
+
+    Returns the arrays (geometry index, rank, candidate index, distance),
+    sorted by geometry index and rank, where rank 1 is the nearest
+    candidate. Ties are broken by candidate index.
+
+    All geometries are queried at once: the search radius of each geometry
+    starts at the distance to its nearest candidate and is doubled for the
+    geometries that have fewer than 'k' candidates within it.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    candidates = np.asarray(candidates, dtype=object)
+    tree = shapely.STRtree(candidates)
+    k = min(k, len(tree))
+
+    (nearest_idx, _), radius = tree.query_nearest(
+        geometries, return_distance=True, all_matches=False
+    )
+    # 'query_nearest' leaves out missing geometries
+    radii = np.full(len(geometries), np.nan)
+    radii[nearest_idx] = radius
+    pending = np.flatnonzero(~np.isnan(radii))
+    while len(pending):
+        geom_idx, _ = tree.query(
+            geometries[pending], predicate="dwithin", distance=radii[pending]
+        )
+        short = np.bincount(geom_idx, minlength=len(pending)) < k
+        pending = pending[short]
+        radii[pending] = np.maximum(radii[pending] * 2, 1e-9)
+
+    geom_idx, cand_idx = tree.query(
+        geometries, predicate="dwithin", distance=np.nan_to_num(radii, nan=-1.0)
+    )
+    distance = shapely.distance(geometries[geom_idx], candidates[cand_idx])
+    order = np.lexsort((cand_idx, distance, geom_idx))
+    geom_idx, cand_idx, distance = geom_idx[order], cand_idx[order], distance[order]
+    # position of each match among the matches of its geometry, from 0
+    starts = np.searchsorted(geom_idx, geom_idx, side="left")
+    rank = np.arange(len(geom_idx)) - starts
+    keep = rank < k
+    return geom_idx[keep], rank[keep] + 1, cand_idx[keep], distance[keep]
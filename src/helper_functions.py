@@ -1,4 +1,7 @@
+from collections import namedtuple
+
 import numpy as np
+import pandas as pd
 from shapely.wkt import loads
 
 
@@ -38,3 +41,52 @@ def degrees_minutes_seconds_to_degrees(coord_str):
         -1 if orientation in {"S", "W"} else 1
     )
     return result
+
+
+# one 'degrees minutes [seconds] hemisphere' coordinate, in all of the glyph
+# variants found in the raw data, e.g. 41⁰ 6’ N, 28⁰ 5 E, 40⁰ 59′ 35.79″ N
+# or 41°12'24.00"N
+_COORD_PATTERN = (
+    r"\s*(\d+(?:\.\d+)?)\s*[⁰°]"
+    r"\s*(\d+(?:\.\d+)?)\s*[’′'\\]*"
+    r"\s*(?:(\d+(?:\.\d+)?)\s*[″\"\\]*)?"
+    r"\s*([NSEW])\s*"
+)
+COORD_PAIR_PATTERN = "^" + _COORD_PATTERN + "," + _COORD_PATTERN + "$"
+
+ParsedCoords = namedtuple("ParsedCoords", ["lat", "lon", "invalid"])
+
+
+def parse_coords(coord_strs):
+    """Parse 'lat, lon' degree/minute(/second) strings in one vectorized pass.
+
+    Returns float64 arrays of latitudes and longitudes in degrees (NaN where
+    a string could not be parsed) and the positions of the invalid strings.
+    """
+    coord_strs = pd.Series(np.asarray(coord_strs, dtype=object), dtype=object)
+    parts = coord_strs.str.extract(COORD_PAIR_PATTERN)
+
+    def numbers(col):
+        # the matched digits as float64, NaN where there was no match
+        return pd.to_numeric(parts[col], errors="coerce").to_numpy(dtype="f8")
+
+    coords = []
+    for degrees, minutes, seconds, orientation in [(0, 1, 2, 3), (4, 5, 6, 7)]:
+        value = (
+            numbers(degrees)
+            + (numbers(minutes) / 60)
+            + (np.nan_to_num(numbers(seconds), nan=0.0) / 3600)
+        )
+        hemisphere = parts[orientation].to_numpy(dtype=object)
+        value = value * np.where(np.isin(hemisphere, ["S", "W"]), -1, 1)
+        coords.append((value, np.isin(hemisphere, ["N", "S"])))
+
+    # the pair is usually written latitude first, but accept either order
+    (first, first_is_lat), (second, second_is_lat) = coords
+    lat = np.where(first_is_lat, first, second)
+    lon = np.where(first_is_lat, second, first)
+
+    invalid = parts[0].isna().to_numpy() | (first_is_lat == second_is_lat)
+    lat[invalid] = np.nan
+    lon[invalid] = np.nan
+    return ParsedCoords(lat, lon, np.flatnonzero(invalid))
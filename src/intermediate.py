@@ -0,0 +1,157 @@
+"""
+Arrow IPC intermediate files of the cleaned datasets.
+
+clean_raw.py writes every cleaned dataset to 'data/cleaned/<name>.arrow' with
+the explicit schema in SCHEMAS, and create_db.py memory-maps the files back.
+The files are uncompressed, so reading them doesn't copy the column buffers.
+Geometries are stored as WKB.
+"""
+
+import os
+from pathlib import Path
+
+import pyarrow as pa
+
+from src.geometry import normalize_geometries
+
+CLEANED_DIR = Path("data/cleaned")
+
+_TIME_FIELDS = [
+    pa.field("hour-key", pa.int32(), nullable=False),
+    pa.field("day", pa.int8(), nullable=False),
+    pa.field("month", pa.int8(), nullable=False),
+    pa.field("year", pa.int16(), nullable=False),
+    pa.field("hour", pa.int8(), nullable=False),
+    pa.field("weekday", pa.int8(), nullable=False),
+]
+
+# dataset name -> schema of its intermediate file, in DB load order
+SCHEMAS = {
+    "ferry-lines": pa.schema(
+        [
+            pa.field("id", pa.int32(), nullable=False),
+            pa.field("line-name", pa.string()),
+            pa.field("shape-data", pa.binary()),
+        ]
+    ),
+    "ferry-terminals": pa.schema(
+        [
+            pa.field("id", pa.int32(), nullable=False),
+            pa.field("terminal-name", pa.string()),
+            pa.field("shape-data", pa.binary()),
+        ]
+    ),
+    "terminals-lines": pa.schema(
+        [
+            pa.field("terminal-id", pa.int32(), nullable=False),
+            pa.field("terminal-name", pa.string()),
+            pa.field("has-line", pa.string()),
+            pa.field("line-id", pa.int32()),
+        ]
+    ),
+    "trips-per-ferry-line": pa.schema(
+        [
+            pa.field("year", pa.int16()),
+            pa.field("line-name", pa.string(), nullable=False),
+            pa.field("n-trips", pa.int32()),
+        ]
+    ),
+    "transportation-load": pa.schema(
+        _TIME_FIELDS + [pa.field("n-passengers", pa.int64())]
+    ),
+    "load-lines": pa.schema(
+        [
+            pa.field("id", pa.int16(), nullable=False),
+            pa.field("line-name", pa.string(), nullable=False),
+            pa.field("ferry-line-id", pa.int32()),
+        ]
+    ),
+    "transfer-types": pa.schema(
+        [
+            pa.field("id", pa.int8(), nullable=False),
+            pa.field("transfer-type", pa.string(), nullable=False),
+        ]
+    ),
+    "transportation-load-per-line": pa.schema(
+        [
+            pa.field("hour-key", pa.int32(), nullable=False),
+            pa.field("line-id", pa.int16(), nullable=False),
+            pa.field("transfer-type-id", pa.int8(), nullable=False),
+            pa.field("n-passengers", pa.int32()),
+        ]
+    ),
+    "weather-sensors": pa.schema(
+        [
+            pa.field("id", pa.int32(), nullable=False),
+            pa.field("sensor-name", pa.string()),
+            pa.field("shape-data", pa.binary()),
+        ]
+    ),
+    "weather-observations": pa.schema(
+        _TIME_FIELDS
+        + [
+            pa.field("avg-temp", pa.float64()),
+            pa.field("avg-humidity", pa.float64()),
+            pa.field("avg-precip", pa.float64()),
+            pa.field("avg-wind", pa.float64()),
+            pa.field("avg-winddir", pa.float64()),
+        ]
+    ),
+}
+
+
+def dataset_path(name, cleaned_dir=CLEANED_DIR):
+    return Path(cleaned_dir) / "{}.arrow".format(name)
+
+
+def to_arrow_table(name, dataset):
+    """Convert a cleaned DataFrame to an Arrow table with the schema of 'name'.
+
+    The WKT geometries are converted to WKB, and NaN becomes null. Raises a
+    ValueError if a column is missing or a value doesn't fit its type.
+    """
+    schema = SCHEMAS[name]
+    arrays = []
+    for field in schema:
+        if field.name not in dataset:
+            raise ValueError("'{}' has no '{}' column".format(name, field.name))
+        values = dataset[field.name]
+        if pa.types.is_binary(field.type):
+            values = normalize_geometries(values).wkb
+        try:
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError("'{}' column '{}': {}".format(name, field.name, e))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def write_dataset(name, dataset, cleaned_dir=CLEANED_DIR):
+    path = dataset_path(name, cleaned_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = dataset if isinstance(dataset, pa.Table) else to_arrow_table(name, dataset)
+    # write to a temporary file first so that a reader never maps a half
+    # written file
+    tmp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_dataset(name, cleaned_dir=CLEANED_DIR):
+    """Memory-map the intermediate file of 'name' as an Arrow table."""
+    path = dataset_path(name, cleaned_dir)
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    if not table.schema.equals(SCHEMAS[name]):
+        raise ValueError(
+            "'{}' doesn't match the schema of '{}':\n{}".format(
+                path, name, table.schema
+            )
+        )
+    return table
+
+
+def read_datasets(cleaned_dir=CLEANED_DIR):
+    return {name: read_dataset(name, cleaned_dir) for name in SCHEMAS}
@@ -0,0 +1,14 @@
+"""
+Locations of the database files and of the other derived outputs.
+
+Kept apart from create_db.py, so that the read side (queries.py, the
+service) can find the database without importing the build code and its
+dependencies. Unlike 'data/cleaned', which teardown.py empties after every
+doit run, DERIVED_DIR is kept.
+"""
+
+from pathlib import Path
+
+DB_PATH = Path("data/db/istanbul-ferries-db.sqlite3")
+DUMP_PATH = Path("data/db/istanbul-ferries-dump.sql")
+DERIVED_DIR = Path("data/derived")
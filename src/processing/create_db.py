@@ -1,132 +1,356 @@
-import os
-from pathlib import Path
-import io
-import sqlite3
+"""
+Create the SQLite database and its SQL dump from the cleaned datasets.
 
+Usage: python src/processing/create_db.py [--cleaned-dir DIR] [--db-path PATH]
+                                          [--dump-path PATH] [--dump-dir DIR]
+                                          [--dump-compression gzip|zstd]
+                                          [--profile]
 
-import pandas as pd
+The cleaned datasets are memory-mapped from the Arrow files written by
+clean_raw.py, and bulk loaded in a single transaction with executemany. The
+secondary indexes are only created once all rows are in. build_db() can also
+be called with the cleaned tables directly (see clean_raw.py '--db').
 
+'--dump-dir' additionally writes the per-table dump of dump.py, which is
+faster to write and to restore than the single-file dump.
+"""
 
-# --- Create connection with the database ---
-# connect
-db_path = Path("data/db/istanbul-ferries-db.sqlite3")
-conn = sqlite3.connect(db_path)
-# set up db
-cursor = conn.cursor()
-# list to hold all queries
-sql_queries = []
+import argparse
+import io
+import sqlite3
+from pathlib import Path
 
-# --- Create tables in the database ---
-# create the "ferry-terminals" table
-query = """
-CREATE TABLE IF NOT EXISTS "ferry-terminals" (
-    "id"            INTEGER PRIMARY KEY NOT NULL,
-    "terminal-name" TEXT,
-    "shape-data"    BLOB
-);
-"""
-sql_queries.append(query)
+import pyarrow as pa
+
+from src.db_layout import ROLLUP_SOURCES
+from src.intermediate import CLEANED_DIR, read_datasets
+from src.paths import DB_PATH, DUMP_PATH
+from src.processing.dump import dump_db
+from src.processing.rollups import (
+    drop_rollups,
+    load_hourly_rows,
+    refresh_rollups,
+)
+from src.profiling import PROFILE_PATH, Profiler, profiling_enabled
+from src.processing.spatial import (
+    GEOMETRY_TABLES,
+    create_rtree,
+    dump_statements,
+    update_ferry_line_shapes,
+    update_terminal_nearest_sensors,
+)
 
-# create the "ferry-lines" table
-query = """
+# --- Tables of the database ---
+# table name -> CREATE TABLE statement, in load order
+TABLES = {
+    "ferry-lines": """
 CREATE TABLE IF NOT EXISTS "ferry-lines" (
     "id"         INTEGER PRIMARY KEY NOT NULL,
     "line-name"  TEXT,
     "shape-data" BLOB
 );
-"""
-sql_queries.append(query)
-
-# create the "terminals-lines" table
-query = """
+""",
+    "ferry-terminals": """
+CREATE TABLE IF NOT EXISTS "ferry-terminals" (
+    "id"            INTEGER PRIMARY KEY NOT NULL,
+    "terminal-name" TEXT,
+    "shape-data"    BLOB
+);
+""",
+    "terminals-lines": """
 CREATE TABLE IF NOT EXISTS "terminals-lines" (
     "terminal-id"   INTEGER NOT NULL,
     "terminal-name" TEXT,
     "has-line"      TEXT,
     "line-id"       INTEGER
 );
-"""
-sql_queries.append(query)
-
-# create the "trips-per-ferry-line" table
-query = """
+""",
+    "trips-per-ferry-line": """
 CREATE TABLE IF NOT EXISTS "trips-per-ferry-line" (
     "year"      INTEGER,
     "line-name" TEXT PRIMARY KEY NOT NULL,
     "n-trips"   INTEGER
 );
-"""
-sql_queries.append(query)
-
-# create the "transportation-load" table
-query = """
+""",
+    "transportation-load": """
 CREATE TABLE IF NOT EXISTS "transportation-load" (
+    "hour-key"     INTEGER PRIMARY KEY NOT NULL,
     "day"          INTEGER,
     "month"        INTEGER,
     "year"         INTEGER,
     "hour"         INTEGER,
+    "weekday"      INTEGER,
     "n-passengers" INTEGER
+) WITHOUT ROWID;
+""",
+    "load-lines": """
+CREATE TABLE IF NOT EXISTS "load-lines" (
+    "id"            INTEGER PRIMARY KEY NOT NULL,
+    "line-name"     TEXT UNIQUE NOT NULL,
+    "ferry-line-id" INTEGER
 );
-"""
-sql_queries.append(query)
-
-# create the "weather-sensors" table
-query = """
+""",
+    "transfer-types": """
+CREATE TABLE IF NOT EXISTS "transfer-types" (
+    "id"            INTEGER PRIMARY KEY NOT NULL,
+    "transfer-type" TEXT UNIQUE NOT NULL
+);
+""",
+    "transportation-load-per-line": """
+CREATE TABLE IF NOT EXISTS "transportation-load-per-line" (
+    "hour-key"         INTEGER NOT NULL,
+    "line-id"          INTEGER NOT NULL,
+    "transfer-type-id" INTEGER NOT NULL,
+    "n-passengers"     INTEGER,
+    PRIMARY KEY ("hour-key", "line-id", "transfer-type-id")
+) WITHOUT ROWID;
+""",
+    "weather-sensors": """
 CREATE TABLE IF NOT EXISTS "weather-sensors" (
     "id"          INTEGER PRIMARY KEY NOT NULL,
     "sensor-name" TEXT,
     "shape-data"  BLOB
 );
-"""
-sql_queries.append(query)
-
-# create the "weather-observations" table
-query = """
+""",
+    "weather-observations": """
 CREATE TABLE IF NOT EXISTS "weather-observations" (
+    "hour-key"     INTEGER PRIMARY KEY NOT NULL,
     "day"          INTEGER,
     "month"        INTEGER,
     "year"         INTEGER,
     "hour"         INTEGER,
+    "weekday"      INTEGER,
     "avg-temp"     REAL,
     "avg-humidity" REAL,
     "avg-precip"   REAL,
     "avg-wind"     REAL,
     "avg-winddir"  REAL
-);
-"""
-sql_queries.append(query)
-
-# Execute and commit all SQL queries
-for query in sql_queries:
-    cursor.execute(query)
-    conn.commit()
-
-# Populate the tables
-datasets_path = Path("data/cleaned/")
-datasets = [
-    "ferry-lines",
-    "ferry-terminals",
-    "terminals-lines",
-    "trips-per-ferry-line",
-    "transportation-load",
-    "weather-sensors",
-    "weather-observations",
-]
-for dataset in datasets:
-    df = pd.read_csv(
-        os.path.join(datasets_path, (dataset + ".csv")),
-        sep=",",
-        encoding="utf-8-sig",
+) WITHOUT ROWID;
+""",
+}
+
+# secondary indexes, created once the rows are loaded
+INDEXES = {
+    "terminals-lines-terminal-id": (
+        'CREATE INDEX "terminals-lines-terminal-id" '
+        'ON "terminals-lines" ("terminal-id")'
+    ),
+    "terminals-lines-line-id": (
+        'CREATE INDEX "terminals-lines-line-id" ON "terminals-lines" ("line-id")'
+    ),
+}
+# the per-line loads of a line over time, carrying the key and passengers
+INDEXES["transportation-load-per-line-line"] = (
+    'CREATE INDEX "transportation-load-per-line-line" '
+    'ON "transportation-load-per-line" ("line-id", "hour-key", "n-passengers")'
+)
+# the hourly tables are keyed by 'hour-key' (hours since 1970-01-01 00:00),
+# which is also the column they are joined on. Their indexes by month, hour
+# of day and weekday carry the key implicitly, as the tables are WITHOUT
+# ROWID, and the value columns explicitly, so filtering and joining by these
+# columns never reads the table itself
+for table, value_cols in [
+    ("transportation-load", ', "n-passengers"'),
+    (
+        "weather-observations",
+        ', "avg-temp", "avg-humidity", "avg-precip", "avg-wind", "avg-winddir"',
+    ),
+]:
+    for name, cols in [
+        ("month", '"year", "month"'),
+        ("hour", '"hour"'),
+        ("weekday", '"weekday", "hour"'),
+    ]:
+        index = "{}-{}".format(table, name)
+        INDEXES[index] = 'CREATE INDEX "{}" ON "{}" ({}{})'.format(
+            index, table, cols, value_cols
+        )
+
+# version of the schema above; tables of DBs created with another version
+# are dropped and recreated
+SCHEMA_VERSION = 3
+
+
+# ingest-time settings: the DB is rebuilt from the cleaned datasets anyway,
+# so durability is traded for speed while loading
+INGEST_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    # negative values are in KiB
+    "cache_size": "-65536",
+    "temp_store": "MEMORY",
+}
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+
+
+def set_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute("PRAGMA {} = {}".format(name, value))
+
+
+def column_values(column):
+    # plain Python values; NumPy's tolist() is much faster than to_pylist(),
+    # and SQLite stores the NaN of missing floats as NULL
+    if pa.types.is_floating(column.type) or (
+        pa.types.is_integer(column.type) and column.null_count == 0
+    ):
+        return column.to_numpy().tolist()
+    return column.to_pylist()
+
+
+def table_rows(table):
+    return zip(*[column_values(column) for column in table.columns])
+
+
+def insert_rows(conn, table, dataset):
+    conn.executemany(
+        "INSERT INTO {} ({}) VALUES ({})".format(
+            table,
+            ", ".join('"{}"'.format(col) for col in dataset.column_names),
+            ", ".join("?" for _ in dataset.column_names),
+        ),
+        table_rows(dataset),
     )
-    df.to_sql(dataset, con=conn, if_exists="append", index=False)
 
 
-# --- Create a data dump ---
-dump_path = Path("data/db/istanbul-ferries-dump.sql")
-with io.open(dump_path, "w", encoding="utf-8-sig") as f:
-    for line in conn.iterdump():
-        f.write("%s\n" % line)
+def bulk_load(conn, datasets, profiler=None):
+    """Replace the rows of every table in TABLES with the Arrow 'datasets'.
+
+    All tables are filled with executemany in one transaction, with the
+    ingest PRAGMAs set and the secondary indexes dropped, and the indexes are
+    rebuilt afterwards. The hourly tables of the rollups are staged first,
+    and only their changed hours are written (see rollups.py). Returns the
+    number of rows loaded.
+    """
+    profiler = profiler or Profiler("create_db")
+    set_pragmas(conn, INGEST_PRAGMAS)
+    n_rows = 0
+    with conn:
+        conn.execute("BEGIN")
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version != SCHEMA_VERSION:
+            for table in TABLES:
+                conn.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+            # the rollups of the dropped hours are rebuilt from scratch
+            drop_rollups(conn)
+            conn.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        for table, query in TABLES.items():
+            conn.execute(query)
+        for index in INDEXES:
+            conn.execute('DROP INDEX IF EXISTS "{}"'.format(index))
+
+        for table in TABLES:
+            dataset = datasets[table]
+            with profiler.stage(
+                "load {}".format(table), rows_in=dataset.num_rows
+            ) as record:
+                if table in ROLLUP_SOURCES:
+                    conn.execute(
+                        'CREATE TEMP TABLE "staged" AS SELECT * FROM "{}" WHERE 0'.format(
+                            table
+                        )
+                    )
+                    insert_rows(conn, 'temp."staged"', dataset)
+                    record["rows-out"] = load_hourly_rows(conn, table, 'temp."staged"')
+                    conn.execute('DROP TABLE temp."staged"')
+                else:
+                    conn.execute('DELETE FROM "{}"'.format(table))
+                    insert_rows(conn, '"{}"'.format(table), dataset)
+                    record["rows-out"] = dataset.num_rows
+            n_rows += dataset.num_rows
+
+        with profiler.stage("create indexes"):
+            for query in INDEXES.values():
+                conn.execute(query)
+    set_pragmas(conn, DEFAULT_PRAGMAS)
+    return n_rows
+
+
+def build_db(
+    datasets,
+    db_path=DB_PATH,
+    dump_path=DUMP_PATH,
+    dump_dir=None,
+    dump_compression=None,
+    profiler=None,
+):
+    profiler = profiler or Profiler("create_db")
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    try:
+        bulk_load(conn, datasets, profiler)
+
+        # --- Create the spatial indexes ---
+        # an R*Tree over the bounding boxes of each table's geometries
+        for dataset in GEOMETRY_TABLES:
+            with profiler.stage("create rtree {}".format(dataset)):
+                create_rtree(conn, dataset)
+
+        # --- Link the terminals to their nearest weather sensors ---
+        with profiler.stage("update terminal-nearest-sensors"):
+            update_terminal_nearest_sensors(conn, k=3)
+
+        # --- Simplify the ferry lines for drawing at smaller scales ---
+        with profiler.stage("update ferry-line-shapes"):
+            update_ferry_line_shapes(conn)
+
+        # --- Refresh the rollups of the hourly tables ---
+        with profiler.stage("refresh rollups") as record:
+            record["rows-in"] = sum(refresh_rollups(conn).values())
+
+        # --- Create a data dump ---
+        if dump_path is not None:
+            with profiler.stage("dump"):
+                with io.open(dump_path, "w", encoding="utf-8-sig") as f:
+                    for line in dump_statements(conn):
+                        f.write("%s\n" % line)
+    finally:
+        conn.close()
+
+    # --- Create a per-table data dump ---
+    if dump_dir is not None:
+        with profiler.stage("dump per table") as record:
+            record["rows-out"] = sum(
+                dump_db(db_path, dump_dir, dump_compression).values()
+            )
+
+
+def profile_path(db_path):
+    # the profiling report is written next to the DB
+    return Path(db_path).parent / PROFILE_PATH.name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create the SQLite database from the cleaned datasets."
+    )
+    parser.add_argument("--cleaned-dir", type=Path, default=CLEANED_DIR)
+    parser.add_argument("--db-path", type=Path, default=DB_PATH)
+    parser.add_argument("--dump-path", type=Path, default=DUMP_PATH)
+    parser.add_argument("--dump-dir", type=Path, default=None)
+    parser.add_argument("--dump-compression", choices=["gzip", "zstd"], default=None)
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="write a profiling report of the stages next to the DB",
+    )
+    args = parser.parse_args(argv)
+
+    profiler = Profiler("create_db", profiling_enabled(args.profile))
+    with profiler.stage("read cleaned datasets") as record:
+        datasets = read_datasets(args.cleaned_dir)
+        record["rows-out"] = sum(table.num_rows for table in datasets.values())
+    build_db(
+        datasets,
+        args.db_path,
+        args.dump_path,
+        args.dump_dir,
+        args.dump_compression,
+        profiler,
+    )
+    profiler.write_report(profile_path(args.db_path))
+
 
-# --- Close the cursor and the connection ---
-cursor.close()
-conn.close()
+if __name__ == "__main__":
+    main()
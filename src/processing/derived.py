@@ -0,0 +1,43 @@
+import hashlib
+
+
+def query_fingerprint(conn, query, params=()):
+    # digest of the rows returned by 'query', which must have an ORDER BY
+    digest = hashlib.blake2b(digest_size=16)
+    for row in conn.execute(query, params):
+        digest.update(repr(row).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def table_fingerprint(conn, table, order_by="id"):
+    return query_fingerprint(
+        conn, 'SELECT * FROM "{}" ORDER BY "{}"'.format(table, order_by)
+    )
+
+
+def inputs_fingerprint(conn, tables, **params):
+    return "|".join(
+        [table_fingerprint(conn, table) for table in tables]
+        + ["{}={}".format(key, value) for key, value in sorted(params.items())]
+    )
+
+
+def stored_fingerprint(conn, table):
+    # fingerprint of the inputs that 'table' was last built from, if any
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS "derived-tables" (
+            "table-name"         TEXT PRIMARY KEY NOT NULL,
+            "inputs-fingerprint" TEXT
+        )
+        """)
+    row = conn.execute(
+        'SELECT "inputs-fingerprint" FROM "derived-tables" WHERE "table-name" = ?',
+        (table,),
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def store_fingerprint(conn, table, fingerprint):
+    conn.execute(
+        'INSERT OR REPLACE INTO "derived-tables" VALUES (?, ?)', (table, fingerprint)
+    )
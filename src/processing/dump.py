@@ -0,0 +1,221 @@
+"""
+Per-table SQL dumps of the database, written in parallel from a snapshot.
+
+Usage: python src/processing/dump.py dump <db-path> <dump-dir> [--compression gzip|zstd]
+       python src/processing/dump.py restore <dump-dir> <db-path>
+
+The database is first copied with the sqlite3 backup API, so that the dump is
+consistent even if the database is written to meanwhile. Every table is then
+dumped by its own worker process to '<NNN>-<table>.sql', with its CREATE
+statement and multi-row INSERTs. The last file holds the indexes. The values
+are quoted by SQLite itself (quote()), and the files can be compressed with
+gzip or, if the 'zstandard' package is installed, zstd.
+
+Restoring runs every file in order into a new database, one transaction per
+file, with the ingest PRAGMAs of create_db.py.
+"""
+
+import argparse
+import gzip
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# number of rows per INSERT statement
+BATCH_SIZE = 500
+
+SUFFIXES = {None: ".sql", "gzip": ".sql.gz", "zstd": ".sql.zst"}
+
+
+def open_dump_file(path, mode, compression=None):
+    # 'mode' is "w" or "r", the files are always UTF-8 text
+    if compression is None:
+        return open(path, mode, encoding="utf-8")
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "zstd compression requires the 'zstandard' package"
+            ) from None
+        return zstandard.open(path, mode + "t", encoding="utf-8")
+    raise ValueError("Unknown compression '{}'".format(compression))
+
+
+def compression_of(path):
+    for compression, suffix in SUFFIXES.items():
+        if compression is not None and path.name.endswith(suffix):
+            return compression
+    return None
+
+
+def schema_objects(conn):
+    """The tables (incl. virtual tables) and the other schema statements.
+
+    Returns ([(table, create statement)], [statement]), in creation order.
+    The shadow tables of virtual tables are left out, as they are recreated
+    by the CREATE VIRTUAL TABLE statement.
+    """
+    rows = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall()
+    virtual = [
+        name
+        for obj_type, name, sql in rows
+        if obj_type == "table" and sql.upper().startswith("CREATE VIRTUAL TABLE")
+    ]
+    shadows = {
+        "{}_{}".format(name, suffix)
+        for name in virtual
+        for suffix in ["node", "parent", "rowid"]
+    }
+    tables = [
+        (name, sql)
+        for obj_type, name, sql in rows
+        if obj_type == "table" and name not in shadows
+    ]
+    others = [sql for obj_type, name, sql in rows if obj_type != "table"]
+    return tables, others
+
+
+def dump_table(snapshot_path, table, create_sql, path, compression, batch_size):
+    conn = sqlite3.connect("file:{}?mode=ro".format(snapshot_path), uri=True)
+    try:
+        columns = [
+            row[1] for row in conn.execute('PRAGMA table_info("{}")'.format(table))
+        ]
+        # let SQLite format every row as a SQL literal tuple
+        query = 'SELECT {} FROM "{}"'.format(
+            " || ',' || ".join('quote("{}")'.format(col) for col in columns), table
+        )
+        n_rows = 0
+        with open_dump_file(path, "w", compression) as f:
+            f.write("BEGIN TRANSACTION;\n{};\n".format(create_sql))
+            cursor = conn.execute(query)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                f.write(
+                    'INSERT INTO "{}" VALUES\n({});\n'.format(
+                        table, "),\n(".join(row[0] for row in batch)
+                    )
+                )
+                n_rows += len(batch)
+            f.write("COMMIT;\n")
+    finally:
+        conn.close()
+    return n_rows
+
+
+def dump_db(
+    db_path, dump_dir, compression=None, max_workers=None, batch_size=BATCH_SIZE
+):
+    """Dump 'db_path' to one file per table under 'dump_dir'.
+
+    Returns a dict of table -> number of dumped rows.
+    """
+    dump_dir = Path(dump_dir)
+    dump_dir.mkdir(parents=True, exist_ok=True)
+    suffix = SUFFIXES[compression]
+    for old in dump_dir.glob("*.sql*"):
+        old.unlink()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = Path(tmp_dir) / "snapshot.sqlite3"
+        source = sqlite3.connect(db_path)
+        snapshot = sqlite3.connect(snapshot_path)
+        try:
+            source.backup(snapshot)
+            tables, others = schema_objects(snapshot)
+            (user_version,) = snapshot.execute("PRAGMA user_version").fetchone()
+        finally:
+            snapshot.close()
+            source.close()
+
+        paths = [
+            dump_dir / "{:03d}-{}{}".format(i, table, suffix)
+            for i, (table, _) in enumerate(tables)
+        ]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    dump_table,
+                    snapshot_path,
+                    table,
+                    create_sql,
+                    path,
+                    compression,
+                    batch_size,
+                )
+                for (table, create_sql), path in zip(tables, paths)
+            ]
+            n_rows = {
+                table: future.result() for (table, _), future in zip(tables, futures)
+            }
+
+    # indexes, triggers and views, once all rows are in
+    path = dump_dir / "{:03d}-schema{}".format(len(tables), suffix)
+    with open_dump_file(path, "w", compression) as f:
+        f.write("BEGIN TRANSACTION;\n")
+        for sql in others:
+            f.write("{};\n".format(sql))
+        f.write("PRAGMA user_version = {};\nCOMMIT;\n".format(user_version))
+    return n_rows
+
+
+def restore_db(dump_dir, db_path):
+    """Create 'db_path' from the files written by dump_db()."""
+    # imported here, so that the dump workers don't import create_db's
+    # dependencies
+    from src.processing.create_db import DEFAULT_PRAGMAS, INGEST_PRAGMAS, set_pragmas
+
+    db_path = Path(db_path)
+    if db_path.exists():
+        raise FileExistsError("'{}' already exists".format(db_path))
+    paths = sorted(Path(dump_dir).glob("*.sql*"), key=lambda path: path.name)
+    if not paths:
+        raise FileNotFoundError("No dump files under '{}'".format(dump_dir))
+
+    tmp_path = db_path.with_name("{}.{}.tmp".format(db_path.name, os.getpid()))
+    conn = sqlite3.connect(tmp_path)
+    try:
+        set_pragmas(conn, INGEST_PRAGMAS)
+        for path in paths:
+            with open_dump_file(path, "r", compression_of(path)) as f:
+                conn.executescript(f.read())
+        set_pragmas(conn, DEFAULT_PRAGMAS)
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dump or restore the database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    dump = commands.add_parser("dump")
+    dump.add_argument("db_path", type=Path)
+    dump.add_argument("dump_dir", type=Path)
+    dump.add_argument("--compression", choices=["gzip", "zstd"], default=None)
+    dump.add_argument("--workers", type=int, default=None)
+    restore = commands.add_parser("restore")
+    restore.add_argument("dump_dir", type=Path)
+    restore.add_argument("db_path", type=Path)
+    args = parser.parse_args(argv)
+
+    if args.command == "dump":
+        dump_db(args.db_path, args.dump_dir, args.compression, args.workers)
+    else:
+        restore_db(args.dump_dir, args.db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Materialized rollups of the hourly tables.
+
+For every hourly table in ROLLUP_SOURCES and every grain in GRAINS, a
+'<table>-<grain>' table holds the sum, mean, min, max, count and number of
+missing values of each variable per group, next to the number of hours in
+the group.
+
+The rollups are refreshed incrementally. create_db.py loads the hourly
+tables through load_hourly_rows(), which only writes the hours whose rows
+were inserted, changed or deleted, and records their hour-keys in
+'rollup-changes'. refresh_rollups() then re-aggregates only the groups of
+these hours, reading the hours of each group through an index.
+"""
+
+from src.db_layout import GRAINS, ROLLUP_SOURCES, rollup_name
+
+# grain -> condition on the hours of the group whose key is 'g."key"', which
+# can be looked up by the primary key or the indexes of the hourly tables
+GROUP_HOURS = {
+    "daily": '"hour-key" >= g."key" * 24 AND "hour-key" < (g."key" + 1) * 24',
+    "weekly": (
+        '"hour-key" >= (g."key" * 7 - 3) * 24 AND "hour-key" < (g."key" * 7 + 4) * 24'
+    ),
+    "monthly": '"year" = g."key" / 12 AND "month" = g."key" % 12 + 1',
+    "hour-of-week": '"weekday" = g."key" / 24 AND "hour" = g."key" % 24',
+}
+
+# statistic -> (type, aggregate over the hours of a group)
+STATISTICS = {
+    "sum": ("REAL", 'SUM("{var}")'),
+    "mean": ("REAL", 'AVG("{var}")'),
+    "min": ("REAL", 'MIN("{var}")'),
+    "max": ("REAL", 'MAX("{var}")'),
+    "count": ("INTEGER", 'COUNT("{var}")'),
+    "missing": ("INTEGER", 'COUNT(*) - COUNT("{var}")'),
+}
+
+CHANGES_TABLE = "rollup-changes"
+
+
+def stat_columns(variables):
+    # [(column, type, aggregate)] of the statistics of 'variables'
+    columns = [("hours", "INTEGER", "COUNT(*)")]
+    for var in variables:
+        for stat, (col_type, aggregate) in STATISTICS.items():
+            columns.append(
+                ("{}-{}".format(var, stat), col_type, aggregate.format(var=var))
+            )
+    return columns
+
+
+def create_rollup(conn, table, grain):
+    keys = GRAINS[grain]
+    columns = ['"{}" {} NOT NULL'.format(name, col_type) for name, _, col_type in keys]
+    columns += [
+        '"{}" {}'.format(col, col_type)
+        for col, col_type, _ in stat_columns(ROLLUP_SOURCES[table])
+    ]
+    conn.execute('DROP TABLE IF EXISTS "{}"'.format(rollup_name(table, grain)))
+    conn.execute(
+        'CREATE TABLE "{}" ({}, PRIMARY KEY ("{}")) WITHOUT ROWID'.format(
+            rollup_name(table, grain), ", ".join(columns), keys[0][0]
+        )
+    )
+
+
+def drop_rollups(conn):
+    for table in ROLLUP_SOURCES:
+        for grain in GRAINS:
+            conn.execute('DROP TABLE IF EXISTS "{}"'.format(rollup_name(table, grain)))
+
+
+def create_changes_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS "{}" (
+            "table-name" TEXT NOT NULL,
+            "hour-key"   INTEGER NOT NULL,
+            PRIMARY KEY ("table-name", "hour-key")
+        ) WITHOUT ROWID
+        """.format(CHANGES_TABLE))
+
+
+def load_hourly_rows(conn, table, staged):
+    """Replace the rows of the hourly 'table' with those of table 'staged'.
+
+    Both tables have the same columns. Only the hours whose rows differ are
+    deleted and inserted, and their hour-keys are recorded for
+    refresh_rollups(). Returns the number of changed hours.
+    """
+    create_changes_table(conn)
+    conn.execute('DROP TABLE IF EXISTS temp."changed-hours"')
+    conn.execute("""
+        CREATE TEMP TABLE "changed-hours" AS
+        SELECT "hour-key" FROM (SELECT * FROM {staged} EXCEPT SELECT * FROM "{table}")
+        UNION
+        SELECT "hour-key" FROM (SELECT * FROM "{table}" EXCEPT SELECT * FROM {staged})
+        """.format(table=table, staged=staged))
+    changed = 'SELECT "hour-key" FROM temp."changed-hours"'
+    conn.execute('DELETE FROM "{}" WHERE "hour-key" IN ({})'.format(table, changed))
+    conn.execute(
+        'INSERT INTO "{}" SELECT * FROM {} WHERE "hour-key" IN ({})'.format(
+            table, staged, changed
+        )
+    )
+    n_changed = conn.execute(
+        'INSERT OR IGNORE INTO "{}" SELECT ?, "hour-key" FROM temp."changed-hours"'.format(
+            CHANGES_TABLE
+        ),
+        (table,),
+    ).rowcount
+    conn.execute('DROP TABLE temp."changed-hours"')
+    return n_changed
+
+
+def aggregate_groups(conn, table, grain, changed_only=True):
+    """(Re)aggregate the groups of the changed hours of 'table', or all."""
+    keys = GRAINS[grain]
+    columns = stat_columns(ROLLUP_SOURCES[table])
+    rollup = rollup_name(table, grain)
+    if changed_only:
+        groups = 'SELECT DISTINCT {} AS "key" FROM "{}" WHERE "table-name" = ?'.format(
+            keys[0][1], CHANGES_TABLE
+        )
+        # groups whose hours were all deleted are gone
+        conn.execute(
+            'DELETE FROM "{}" WHERE "{}" IN ({})'.format(rollup, keys[0][0], groups),
+            (table,),
+        )
+        # CROSS JOIN keeps the few groups as the outer loop
+        source = '({}) AS g CROSS JOIN "{}" ON {}'.format(
+            groups, table, GROUP_HOURS[grain]
+        )
+        params = (table,)
+    else:
+        source = '"{}"'.format(table)
+        params = ()
+    conn.execute(
+        """
+        INSERT INTO "{rollup}" ({names})
+        SELECT {selects}
+        FROM {source}
+        GROUP BY {group_by}
+        """.format(
+            rollup=rollup,
+            names=", ".join(
+                ['"{}"'.format(name) for name, _, _ in keys]
+                + ['"{}"'.format(col) for col, _, _ in columns]
+            ),
+            selects=", ".join(
+                [expr for _, expr, _ in keys] + [agg for _, _, agg in columns]
+            ),
+            source=source,
+            group_by=", ".join(expr for _, expr, _ in keys),
+        ),
+        params,
+    )
+
+
+def refresh_rollups(conn):
+    """Bring every rollup up to date with the changes of its hourly table.
+
+    Missing rollups are aggregated from all hours. Returns a dict of hourly
+    table -> number of changed hours whose groups were re-aggregated.
+    """
+    create_changes_table(conn)
+    existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+    n_hours = {}
+    with conn:
+        # the former watermarks of the rollups
+        conn.execute('DROP TABLE IF EXISTS "rollup-watermarks"')
+        for table in ROLLUP_SOURCES:
+            if not existing.issuperset(rollup_name(table, grain) for grain in GRAINS):
+                for grain in GRAINS:
+                    create_rollup(conn, table, grain)
+                    aggregate_groups(conn, table, grain, changed_only=False)
+                (n_hours[table],) = conn.execute(
+                    'SELECT COUNT(*) FROM "{}"'.format(table)
+                ).fetchone()
+            else:
+                (n_hours[table],) = conn.execute(
+                    'SELECT COUNT(*) FROM "{}" WHERE "table-name" = ?'.format(
+                        CHANGES_TABLE
+                    ),
+                    (table,),
+                ).fetchone()
+                if n_hours[table]:
+                    for grain in GRAINS:
+                        aggregate_groups(conn, table, grain)
+            conn.execute(
+                'DELETE FROM "{}" WHERE "table-name" = ?'.format(CHANGES_TABLE),
+                (table,),
+            )
+    return n_hours
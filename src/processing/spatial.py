@@ -0,0 +1,274 @@
+import math
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from src.db_layout import LINE_SHAPE_TOLERANCES
+from src.geometry import (
+    METRES_PER_DEGREE,
+    from_local_metres,
+    from_wkb,
+    k_nearest,
+    to_local_metres,
+)
+from src.processing.derived import (
+    inputs_fingerprint,
+    store_fingerprint,
+    stored_fingerprint,
+)
+
+# tables whose 'shape-data' column holds WKB geometries in (lon lat) order
+GEOMETRY_TABLES = ["ferry-terminals", "ferry-lines", "weather-sensors"]
+
+
+def rtree_name(table):
+    return "{}-rtree".format(table)
+
+
+def create_rtree(conn, table):
+    """(Re)build the R*Tree index over the bounding boxes of 'table' geometries.
+
+    The R*Tree stores the boxes as 32-bit floats rounded outwards, so it can
+    return a few extra candidates but never misses one.
+    """
+    rows = pd.read_sql_query('SELECT "id", "shape-data" FROM "{}"'.format(table), conn)
+    bounds = shapely.bounds(from_wkb(rows["shape-data"]))
+    # rows without a geometry are left out of the index
+    valid = ~np.isnan(bounds).any(axis=1)
+
+    rtree = rtree_name(table)
+    conn.execute('DROP TABLE IF EXISTS "{}"'.format(rtree))
+    conn.execute(
+        'CREATE VIRTUAL TABLE "{}" USING rtree('
+        '"id", "min-x", "max-x", "min-y", "max-y")'.format(rtree)
+    )
+    conn.executemany(
+        'INSERT INTO "{}" VALUES (?, ?, ?, ?, ?)'.format(rtree),
+        zip(
+            rows["id"][valid].tolist(),
+            bounds[valid, 0].tolist(),
+            bounds[valid, 2].tolist(),
+            bounds[valid, 1].tolist(),
+            bounds[valid, 3].tolist(),
+        ),
+    )
+    conn.commit()
+
+
+def _bbox_candidates(conn, table, bbox):
+    # rows whose bounding box intersects 'bbox' = (min_x, min_y, max_x, max_y)
+    min_x, min_y, max_x, max_y = bbox
+    query = """
+    SELECT t.*
+    FROM "{table}" AS t
+    JOIN "{rtree}" AS r ON t."id" = r."id"
+    WHERE r."max-x" >= ? AND r."min-x" <= ? AND r."max-y" >= ? AND r."min-y" <= ?
+    ORDER BY t."id"
+    """.format(table=table, rtree=rtree_name(table))
+    candidates = pd.read_sql_query(query, conn, params=(min_x, max_x, min_y, max_y))
+    candidates["shape-data"] = from_wkb(candidates["shape-data"])
+    return candidates
+
+
+def within_bbox(conn, table, bbox):
+    """Rows of 'table' whose geometry intersects 'bbox' (lon/lat degrees).
+
+    The R*Tree narrows the table down to the rows whose bounding box
+    overlaps 'bbox', and only those are tested exactly with shapely. The
+    'shape-data' column of the result holds shapely geometries.
+    """
+    candidates = _bbox_candidates(conn, table, bbox)
+    exact = shapely.intersects(candidates["shape-data"].to_numpy(), shapely.box(*bbox))
+    return candidates.loc[exact, :].reset_index(drop=True)
+
+
+def within_radius(conn, table, lon, lat, radius):
+    """Rows of 'table' within 'radius' metres of the point (lon, lat).
+
+    The R*Tree is queried with the bounding box of the circle, and the exact
+    distances of the remaining candidates are added as a 'distance' column,
+    in metres.
+    """
+    d_lat = radius / METRES_PER_DEGREE
+    d_lon = d_lat / math.cos(math.radians(lat))
+    candidates = _bbox_candidates(
+        conn, table, (lon - d_lon, lat - d_lat, lon + d_lon, lat + d_lat)
+    )
+    local = to_local_metres(candidates["shape-data"], lon, lat)
+    candidates["distance"] = shapely.distance(local, shapely.Point(0, 0))
+    exact = candidates["distance"] <= radius
+    return candidates.loc[exact, :].reset_index(drop=True)
+
+
+def dump_statements(conn):
+    """conn.iterdump(), with the R*Tree tables dumped so that they can be replayed.
+
+    iterdump() writes virtual tables straight into 'sqlite_master' and also
+    dumps their shadow tables, which doesn't restore into a working R*Tree.
+    Here every R*Tree is dumped as its CREATE VIRTUAL TABLE statement followed
+    by its rows, and the shadow tables are left out.
+    """
+    rtrees = {}
+    shadows = []
+    for table in GEOMETRY_TABLES:
+        rtree = rtree_name(table)
+        (sql,) = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE name = ?", (rtree,)
+        ).fetchone()
+        rtrees["'{}'".format(rtree)] = sql
+        for suffix in ["node", "parent", "rowid"]:
+            shadows.append('"{}_{}"'.format(rtree, suffix))
+
+    for statement in conn.iterdump():
+        if statement.startswith("PRAGMA writable_schema"):
+            continue
+        if statement.startswith("INSERT INTO sqlite_master"):
+            for quoted_name, sql in rtrees.items():
+                if quoted_name in statement:
+                    yield "{};".format(sql)
+                    break
+            else:
+                yield statement
+            continue
+        if any(
+            statement.startswith("CREATE TABLE {}".format(shadow))
+            or statement.startswith("INSERT INTO {}".format(shadow))
+            for shadow in shadows
+        ):
+            continue
+        yield statement
+
+
+def nearest_sensors(conn, k):
+    """The 'k' nearest weather sensors of every ferry terminal, in metres."""
+    terminals = pd.read_sql_query(
+        'SELECT "id", "shape-data" FROM "ferry-terminals" ORDER BY "id"', conn
+    )
+    sensors = pd.read_sql_query(
+        'SELECT "id", "shape-data" FROM "weather-sensors" ORDER BY "id"', conn
+    )
+    terminal_shapes = from_wkb(terminals["shape-data"])
+    sensor_shapes = from_wkb(sensors["shape-data"])
+
+    # project both tables around the centre of the sensors' extent
+    min_x, min_y, max_x, max_y = shapely.total_bounds(sensor_shapes)
+    lon, lat = (min_x + max_x) / 2, (min_y + max_y) / 2
+    terminal_idx, rank, sensor_idx, distance = k_nearest(
+        to_local_metres(terminal_shapes, lon, lat),
+        to_local_metres(sensor_shapes, lon, lat),
+        k,
+    )
+    return pd.DataFrame(
+        {
+            "terminal-id": terminals["id"].to_numpy()[terminal_idx],
+            "rank": rank,
+            "sensor-id": sensors["id"].to_numpy()[sensor_idx],
+            "distance": distance,
+        }
+    )
+
+
+def update_terminal_nearest_sensors(conn, k=3):
+    """(Re)build the 'terminal-nearest-sensors' table if its inputs changed.
+
+    The fingerprint of 'ferry-terminals', 'weather-sensors' and 'k' is kept
+    in the 'derived-tables' table, so the table is only rebuilt when one of
+    them differs from the last build. Returns True if it was rebuilt.
+    """
+    table = "terminal-nearest-sensors"
+    fingerprint = inputs_fingerprint(conn, ["ferry-terminals", "weather-sensors"], k=k)
+    if stored_fingerprint(conn, table) == fingerprint:
+        return False
+
+    dataset = nearest_sensors(conn, k)
+    conn.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+    conn.execute("""
+        CREATE TABLE "{}" (
+            "terminal-id" INTEGER NOT NULL,
+            "rank"        INTEGER NOT NULL,
+            "sensor-id"   INTEGER NOT NULL,
+            "distance"    REAL,
+            PRIMARY KEY ("terminal-id", "rank")
+        )
+        """.format(table))
+    dataset.to_sql(table, con=conn, if_exists="append", index=False)
+    store_fingerprint(conn, table, fingerprint)
+    conn.commit()
+    return True
+
+
+def simplified_lines(conn, tolerances=LINE_SHAPE_TOLERANCES):
+    """Every 'ferry-lines' geometry at every level of simplification.
+
+    The lines are simplified in local metres with shapely's topology
+    preserving simplification, so that a simplified line never crosses
+    itself where the original didn't. Level 0 is the original line, whose
+    'shape-data' is left NULL, as it is already stored in 'ferry-lines'.
+    """
+    lines = pd.read_sql_query(
+        'SELECT "id", "shape-data" FROM "ferry-lines" ORDER BY "id"', conn
+    )
+    shapes = from_wkb(lines["shape-data"])
+    min_x, min_y, max_x, max_y = shapely.total_bounds(shapes)
+    lon, lat = (min_x + max_x) / 2, (min_y + max_y) / 2
+    local = to_local_metres(shapes, lon, lat)
+
+    levels = []
+    for level, tolerance in enumerate([0] + list(tolerances)):
+        simplified = shapes
+        if level:
+            simplified = from_local_metres(
+                shapely.simplify(local, tolerance, preserve_topology=True), lon, lat
+            )
+        bounds = shapely.bounds(simplified)
+        levels.append(
+            pd.DataFrame(
+                {
+                    "line-id": lines["id"].to_numpy(),
+                    "level": level,
+                    "tolerance": float(tolerance),
+                    "n-vertices": shapely.get_num_coordinates(simplified),
+                    "min-x": bounds[:, 0],
+                    "max-x": bounds[:, 2],
+                    "min-y": bounds[:, 1],
+                    "max-y": bounds[:, 3],
+                    "shape-data": shapely.to_wkb(simplified) if level else None,
+                }
+            )
+        )
+    return pd.concat(levels, ignore_index=True)
+
+
+def update_ferry_line_shapes(conn, tolerances=LINE_SHAPE_TOLERANCES):
+    """(Re)build the 'ferry-line-shapes' table if its inputs changed.
+
+    Like 'terminal-nearest-sensors', the table is only rebuilt when
+    'ferry-lines' or the tolerances differ from the last build. Returns True
+    if it was rebuilt.
+    """
+    table = "ferry-line-shapes"
+    fingerprint = inputs_fingerprint(conn, ["ferry-lines"], tolerances=tolerances)
+    if stored_fingerprint(conn, table) == fingerprint:
+        return False
+
+    dataset = simplified_lines(conn, tolerances)
+    conn.execute('DROP TABLE IF EXISTS "{}"'.format(table))
+    conn.execute("""
+        CREATE TABLE "{}" (
+            "line-id"    INTEGER NOT NULL,
+            "level"      INTEGER NOT NULL,
+            "tolerance"  REAL NOT NULL,
+            "n-vertices" INTEGER,
+            "min-x"      REAL,
+            "max-x"      REAL,
+            "min-y"      REAL,
+            "max-y"      REAL,
+            "shape-data" BLOB,
+            PRIMARY KEY ("level", "line-id")
+        )
+        """.format(table))
+    dataset.to_sql(table, con=conn, if_exists="append", index=False)
+    store_fingerprint(conn, table, fingerprint)
+    conn.commit()
+    return True
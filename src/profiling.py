@@ -0,0 +1,192 @@
+"""
+Opt-in profiling of the named stages of clean_raw.py and create_db.py.
+
+Turned on with the '--profile' flag of both scripts, or by setting the
+ISTANBUL_FERRIES_PROFILE environment variable to 1 (e.g. for a doit run).
+Every stage records its wall time, CPU time, the rows it was given and
+returned, and the peak memory allocated while it ran (as traced by
+tracemalloc, so memory allocated by Arrow itself is not included). Tracing
+slows down stages that allocate many small objects, e.g. the SQL dump.
+
+The records of each script are written to the 'PROFILE_PATH' JSON report
+next to the DB, under the script's name, and `python src/profiling.py` (or
+`doit profile`) prints a summary of the report.
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+PROFILE_ENV = "ISTANBUL_FERRIES_PROFILE"
+PROFILE_PATH = Path("data/db/istanbul-ferries-profile.json")
+
+
+def profiling_enabled(flag=False):
+    return flag or os.environ.get(PROFILE_ENV, "") not in {"", "0"}
+
+
+def count_rows(value):
+    # rows of a DataFrame, Series or Arrow table, summed over tuples and dicts
+    if isinstance(value, (tuple, list)):
+        counts = [count_rows(item) for item in value]
+    elif isinstance(value, dict):
+        counts = [count_rows(item) for item in value.values()]
+    elif hasattr(value, "num_rows"):
+        return value.num_rows
+    elif hasattr(value, "shape") and len(getattr(value, "shape")) >= 1:
+        return value.shape[0]
+    else:
+        return None
+    counts = [count for count in counts if count is not None]
+    return sum(counts) if counts else None
+
+
+def _start_tracing():
+    # the peak is reset, so nested stages report the peak since they started
+    # and the enclosing stage under-reports
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        return False
+    tracemalloc.start()
+    return True
+
+
+def profile_call(name, func, *args):
+    """Call 'func(*args)' and return (its value, the stage's record).
+
+    A top-level function, so that it can be run on a process pool.
+    """
+    started_tracing = _start_tracing()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        value = func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    record = {
+        "stage": name,
+        "wall-seconds": time.perf_counter() - wall,
+        "cpu-seconds": time.process_time() - cpu,
+        "rows-in": count_rows(args),
+        "rows-out": count_rows(value),
+        "peak-mb": peak / (1 << 20),
+        "pid": os.getpid(),
+    }
+    return value, record
+
+
+class Profiler:
+    """Collects the records of the stages of one script run.
+
+    When disabled, stage() and call() only run the code, so they can be
+    left in place.
+    """
+
+    def __init__(self, script, enabled=False):
+        self.script = script
+        self.enabled = enabled
+        self.records = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Profile the block; set 'rows-out' on the yielded record."""
+        record = {"stage": name, "rows-in": rows_in, "rows-out": None}
+        if not self.enabled:
+            yield record
+            return
+        started_tracing = _start_tracing()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+            record["peak-mb"] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+        record["wall-seconds"] = time.perf_counter() - wall
+        record["cpu-seconds"] = time.process_time() - cpu
+        record["pid"] = os.getpid()
+        self.records.append(record)
+
+    def call(self, name, func, *args):
+        if not self.enabled:
+            return func(*args)
+        value, record = profile_call(name, func, *args)
+        self.records.append(record)
+        return value
+
+    def add(self, record):
+        self.records.append(record)
+
+    def write_report(self, path=PROFILE_PATH):
+        """Replace this script's section of the JSON report at 'path'."""
+        if not self.enabled:
+            return
+        path = Path(path)
+        report = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as f:
+                report = json.load(f)
+        report[self.script] = {
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "wall-seconds": time.perf_counter() - self.started,
+            "stages": self.records,
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def format_summary(report):
+    lines = []
+    for script, run in report.items():
+        lines.append(
+            "{} ({:.2f} s, finished {})".format(
+                script, run["wall-seconds"], run["finished"]
+            )
+        )
+        lines.append(
+            "  {:<40} {:>9} {:>9} {:>10} {:>10} {:>9}".format(
+                "stage", "wall s", "cpu s", "rows in", "rows out", "peak MiB"
+            )
+        )
+        stages = sorted(run["stages"], key=lambda record: -record["wall-seconds"])
+        for record in stages:
+            lines.append(
+                "  {:<40} {:>9.3f} {:>9.3f} {:>10} {:>10} {:>9.1f}".format(
+                    record["stage"],
+                    record["wall-seconds"],
+                    record["cpu-seconds"],
+                    "-" if record["rows-in"] is None else record["rows-in"],
+                    "-" if record["rows-out"] is None else record["rows-out"],
+                    record["peak-mb"],
+                )
+            )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print the profiling report.")
+    parser.add_argument("report_path", type=Path, nargs="?", default=PROFILE_PATH)
+    args = parser.parse_args(argv)
+
+    if not args.report_path.exists():
+        print(
+            "No profiling report at '{}', run with {}=1 first".format(
+                args.report_path, PROFILE_ENV
+            )
+        )
+        return
+    with open(args.report_path, encoding="utf-8") as f:
+        print(format_summary(json.load(f)))
+
+
+if __name__ == "__main__":
+    main()
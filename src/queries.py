@@ -0,0 +1,406 @@
+"""
+Read access to the database for the notebook, dashboards and services.
+
+    from src.queries import passengers, weather, terminal_lines
+
+    passengers("2020-03-01", "2020-04-01")
+    weather("2020-03-01", "2020-04-01")
+    terminal_lines(1)
+    line_shapes(zoom=11)
+
+The queries run on pooled read-only connections with a large 'mmap_size'.
+They use SQLite's locking, so while create_db.py rewrites the DB a query
+waits for it (up to BUSY_TIMEOUT seconds) instead of reading torn pages.
+Each query is a constant SQL string with parameters, so its prepared
+statement is reused by the connection's statement cache. The results are
+kept in a size-bounded LRU cache, keyed by the query, its parameters and the
+content hash of the DB file; a rebuilt DB therefore never serves stale
+results, and its connections are reopened.
+"""
+
+import hashlib
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from src.db_layout import (
+    GRAINS,
+    ROLLUP_SOURCES,
+    metres_per_pixel,
+    rollup_name,
+    shape_level,
+    to_hour_key,
+)
+from src.paths import DB_PATH
+
+# connections per pool and results per cache
+POOL_SIZE = 4
+CACHE_SIZE = 128
+# rows per chunk of iter_query(), and rows it reads per connection checkout
+CHUNK_ROWS = 5000
+BATCH_ROWS = 50000
+# seconds a query waits for the lock of a DB that is being rebuilt
+BUSY_TIMEOUT = 30
+
+# read-side settings of the pooled connections
+READ_PRAGMAS = {
+    "query_only": "ON",
+    # 256 MiB, more than the whole DB
+    "mmap_size": 268435456,
+    # negative values are in KiB
+    "cache_size": -16384,
+}
+
+# --- Content hash of the DB file ---
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def file_hash(path):
+    # blake2b of the file's bytes, recomputed only when its size or
+    # modification time changed
+    path = Path(path).resolve()
+    stat = path.stat()
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _hashes_lock:
+        cached = _hashes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    with _hashes_lock:
+        _hashes[path] = (key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+# --- Connection pool ---
+def connect_read_only(db_path):
+    if not Path(db_path).exists():
+        # mode=ro would fail with a less helpful message
+        raise FileNotFoundError("No database at '{}'".format(db_path))
+    conn = sqlite3.connect(
+        "file:{}?mode=ro".format(Path(db_path).resolve().as_posix()),
+        uri=True,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=256,
+    )
+    for pragma, value in READ_PRAGMAS.items():
+        conn.execute("PRAGMA {} = {}".format(pragma, value))
+    return conn
+
+
+class ConnectionPool:
+    """Up to 'size' read-only connections to 'db_path', shared by threads.
+
+    The connections are opened lazily and belong to one version of the DB
+    file: when its content hash changed, they are closed and reopened.
+    """
+
+    def __init__(self, db_path=DB_PATH, size=POOL_SIZE):
+        self.db_path = Path(db_path)
+        self.size = size
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, db_hash):
+        self.db_hash = db_hash
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._reset(None)
+
+    @contextmanager
+    def connection(self):
+        """Yield (connection, content hash of the DB it reads)."""
+        db_hash = file_hash(self.db_path)
+        with self._lock:
+            if db_hash != self.db_hash:
+                # connections in use still hold the former semaphore and queue
+                stale = self._idle
+                self._reset(db_hash)
+                while not stale.empty():
+                    stale.get_nowait().close()
+            idle, slots = self._idle, self._slots
+        slots.acquire()
+        try:
+            try:
+                conn = idle.get_nowait()
+            except queue.Empty:
+                conn = connect_read_only(self.db_path)
+            try:
+                yield conn, db_hash
+            finally:
+                if idle is self._idle:
+                    idle.put(conn)
+                else:
+                    conn.close()
+        finally:
+            slots.release()
+
+
+# --- Result cache ---
+class ResultCache:
+    """Thread-safe LRU cache of query results, bounded to 'size' entries."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._results:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return self._results[key]
+
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_cache = ResultCache()
+
+
+def get_pool(db_path=DB_PATH):
+    key = Path(db_path).resolve()
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path)
+        return _pools[key]
+
+
+def read_query(query, params=(), db_path=DB_PATH):
+    """The rows of 'query' as a DataFrame, from the cache if possible.
+
+    The returned DataFrame is a copy, so it can be modified freely.
+    """
+    pool = get_pool(db_path)
+    key = (str(pool.db_path.resolve()), file_hash(db_path), query, tuple(params))
+    result = _cache.get(key)
+    if result is None:
+        with pool.connection() as (conn, db_hash):
+            result = pd.read_sql_query(query, conn, params=params)
+        # keyed by the hash of the DB that was actually read
+        _cache.put(key[:1] + (db_hash,) + key[2:], result)
+    return result.copy()
+
+
+def iter_query(query, params=(), chunk_rows=CHUNK_ROWS, db_path=DB_PATH):
+    """The rows of 'query' as DataFrames of up to 'chunk_rows' rows.
+
+    A cached result is sliced. Otherwise the rows are read in batches of
+    about BATCH_ROWS rows, with LIMIT and OFFSET (so the query must end with
+    an ORDER BY over unique columns). A connection is only held while a batch
+    is read, never while its chunks are consumed: a slow consumer can't
+    starve the pool or keep a read transaction open. A DB that is rebuilt
+    between two batches raises a RuntimeError. The whole result is cached
+    once the last batch was read. There is always at least one, possibly
+    empty, chunk.
+    """
+    pool = get_pool(db_path)
+    key = (str(pool.db_path.resolve()), file_hash(db_path), query, tuple(params))
+    result = _cache.get(key)
+    if result is not None:
+        for start in range(0, max(len(result), 1), chunk_rows):
+            yield result.iloc[start : start + chunk_rows].copy()
+        return
+
+    # whole chunks per batch
+    batch_rows = chunk_rows * max(BATCH_ROWS // chunk_rows, 1)
+    batch_query = "{} LIMIT ? OFFSET ?".format(query.rstrip())
+    batches = []
+    n_rows = 0
+    read_hash = None
+    while True:
+        with pool.connection() as (conn, db_hash):
+            batch = pd.read_sql_query(
+                batch_query, conn, params=tuple(params) + (batch_rows, n_rows)
+            )
+        if read_hash is not None and db_hash != read_hash:
+            raise RuntimeError("The database was rebuilt during the query")
+        read_hash = db_hash
+        batches.append(batch)
+        # only the first batch may be empty
+        for start in range(0, len(batch) if n_rows else max(len(batch), 1), chunk_rows):
+            yield batch.iloc[start : start + chunk_rows].copy()
+        n_rows += len(batch)
+        if len(batch) < batch_rows:
+            break
+    # a batch of only NULLs has object columns, which read_query() wouldn't
+    result = pd.concat(batches, ignore_index=True).infer_objects()
+    _cache.put(key[:1] + (read_hash,) + key[2:], result)
+
+
+def run_query(query, params=(), db_path=DB_PATH, chunk_rows=None):
+    # the whole result of read_query(), or the chunks of iter_query()
+    if chunk_rows is None:
+        return read_query(query, params, db_path)
+    return iter_query(query, params, chunk_rows, db_path)
+
+
+# --- Common queries ---
+PASSENGERS_QUERY = """
+SELECT "hour-key", "year", "month", "day", "hour", "weekday", "n-passengers"
+FROM "transportation-load"
+WHERE "hour-key" >= ? AND "hour-key" < ?
+ORDER BY "hour-key"
+"""
+
+LINE_PASSENGERS_QUERY = """
+SELECT p."hour-key", l."line-name", t."transfer-type", p."n-passengers"
+FROM "transportation-load-per-line" AS p
+JOIN "load-lines" AS l ON l."id" = p."line-id"
+JOIN "transfer-types" AS t ON t."id" = p."transfer-type-id"
+WHERE l."line-name" = ? AND p."hour-key" >= ? AND p."hour-key" < ?
+ORDER BY p."hour-key", t."transfer-type"
+"""
+
+WEATHER_QUERY = """
+SELECT "hour-key", "year", "month", "day", "hour", "weekday",
+       "avg-temp", "avg-humidity", "avg-precip", "avg-wind", "avg-winddir"
+FROM "weather-observations"
+WHERE "hour-key" >= ? AND "hour-key" < ?
+ORDER BY "hour-key"
+"""
+
+TERMINAL_LINES_QUERY = """
+SELECT f."id", f."line-name", f."shape-data"
+FROM "terminals-lines" AS t
+JOIN "ferry-lines" AS f ON f."id" = t."line-id"
+WHERE t."terminal-id" = ?
+ORDER BY f."id"
+"""
+
+SHAPE_LEVELS_QUERY = """
+SELECT DISTINCT "level", "tolerance"
+FROM "ferry-line-shapes"
+WHERE "level" > 0
+ORDER BY "level"
+"""
+
+LINE_SHAPES_QUERY = """
+SELECT f."id", f."line-name", s."level", s."tolerance", s."n-vertices",
+       s."min-x", s."max-x", s."min-y", s."max-y",
+       COALESCE(s."shape-data", f."shape-data") AS "shape-data"
+FROM "ferry-line-shapes" AS s
+JOIN "ferry-lines" AS f ON f."id" = s."line-id"
+WHERE s."level" = ?
+ORDER BY f."id"
+"""
+
+
+def passengers(start, end, line_name=None, db_path=DB_PATH, chunk_rows=None):
+    """Hourly ferry passengers from 'start' (inclusive) to 'end' (exclusive).
+
+    Without 'line_name', the columns are hour-key, year, month, day, hour,
+    weekday (ints) and n-passengers (float if there are missing hours).
+    With a 'line_name' of 'load-lines', they are hour-key, line-name,
+    transfer-type and n-passengers, one row per transfer type.
+
+    Like every query below, it returns an iterator of DataFrames of up to
+    'chunk_rows' rows instead if 'chunk_rows' is given (see iter_query()).
+    """
+    if line_name is None:
+        return run_query(
+            PASSENGERS_QUERY,
+            (to_hour_key(start), to_hour_key(end)),
+            db_path,
+            chunk_rows,
+        )
+    return run_query(
+        LINE_PASSENGERS_QUERY,
+        (line_name, to_hour_key(start), to_hour_key(end)),
+        db_path,
+        chunk_rows,
+    )
+
+
+def weather(start, end, db_path=DB_PATH, chunk_rows=None):
+    """Hourly weather from 'start' (inclusive) to 'end' (exclusive).
+
+    The columns are hour-key, year, month, day, hour, weekday (ints) and
+    avg-temp, avg-humidity, avg-precip, avg-wind, avg-winddir (floats).
+    """
+    return run_query(
+        WEATHER_QUERY, (to_hour_key(start), to_hour_key(end)), db_path, chunk_rows
+    )
+
+
+def terminal_lines(terminal_id, db_path=DB_PATH, chunk_rows=None):
+    """The ferry lines of a terminal: id, line-name and shape-data (WKB)."""
+    return run_query(TERMINAL_LINES_QUERY, (int(terminal_id),), db_path, chunk_rows)
+
+
+def line_shapes(scale=None, zoom=None, db_path=DB_PATH, chunk_rows=None):
+    """The ferry lines simplified for a map 'scale' (metres per pixel).
+
+    The scale can also be given as the 'zoom' level of a Web Mercator map.
+    The lines are simplified with the largest tolerance that is at most a
+    pixel, or are the original lines without a scale. The columns are id,
+    line-name, level, tolerance, n-vertices, the bounding box (min-x, max-x,
+    min-y, max-y) and shape-data (WKB).
+    """
+    if zoom is not None:
+        scale = metres_per_pixel(float(zoom))
+    level = 0
+    if scale is not None:
+        levels = read_query(SHAPE_LEVELS_QUERY, db_path=db_path)
+        level = shape_level(float(scale), levels["tolerance"].to_numpy())
+    return run_query(LINE_SHAPES_QUERY, (level,), db_path, chunk_rows)
+
+
+def rollup(table, grain, db_path=DB_PATH, chunk_rows=None):
+    """The '<table>-<grain>' rollup of an hourly table (see rollups.py)."""
+    if table not in ROLLUP_SOURCES or grain not in GRAINS:
+        raise ValueError("No rollup of '{}' by '{}'".format(table, grain))
+    return run_query(
+        'SELECT * FROM "{}" ORDER BY "{}"'.format(
+            rollup_name(table, grain), GRAINS[grain][0][0]
+        ),
+        db_path=db_path,
+        chunk_rows=chunk_rows,
+    )
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def cache_info():
+    return {"hits": _cache.hits, "misses": _cache.misses, "size": _cache.size}
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,468 @@
+"""
+Local HTTP/JSON service over the database, for concurrent dashboards.
+
+Usage: python src/service.py [--host HOST] [--port PORT] [--workers N]
+                             [--db-path PATH]
+
+    GET /passengers?start=2020-03-01&end=2020-04-01[&line=MOTOR TEKNE]
+    GET /weather?start=2020-03-01&end=2020-04-01
+    GET /terminal-lines?terminal-id=1
+    GET /line-shapes[?zoom=11 | ?scale=75]
+    GET /rollups?table=transportation-load&grain=monthly
+    GET /health
+
+Every data endpoint takes 'format=json' (default, a list of records),
+'format=ndjson' or 'format=arrow' (an Arrow IPC stream). The latter two are
+streamed: every chunk of 'chunk-rows' rows is sent as NDJSON lines or as
+one Arrow record batch as soon as it is read. The rows are read in bounded
+batches (see queries.iter_query()), so a slow client holds neither a pooled
+connection nor a thread while it reads. Geometries are WKT in JSON and WKB
+in Arrow.
+
+The queries of src/queries.py (pooled read-only connections, LRU result
+cache) run on a bounded thread pool, and identical requests that arrive
+while a JSON one is already running wait for its result instead of querying
+again. A response that fails after it started is cut off, without its last
+chunk.
+The service only binds to localhost by default.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import pyarrow as pa
+import shapely
+
+from src import queries
+from src.geometry import from_wkb
+
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = 4
+CHUNK_ROWS = 5000
+# longest accepted request line or header line, longer ones raise a
+# ValueError in readline()
+MAX_LINE = 8192
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+GEOMETRY_COLUMNS = ["shape-data"]
+
+
+class BadRequest(ValueError):
+    pass
+
+
+# --- Endpoints ---
+# path -> function(params, db_path, chunk_rows=None) that returns a DataFrame,
+# or an iterator of DataFrames of up to 'chunk_rows' rows, run on the thread
+# pool
+def required(params, name):
+    if not params.get(name):
+        raise BadRequest("Missing parameter '{}'".format(name))
+    return params[name]
+
+
+def get_passengers(params, db_path, chunk_rows=None):
+    return queries.passengers(
+        required(params, "start"),
+        required(params, "end"),
+        params.get("line"),
+        db_path=db_path,
+        chunk_rows=chunk_rows,
+    )
+
+
+def get_weather(params, db_path, chunk_rows=None):
+    return queries.weather(
+        required(params, "start"),
+        required(params, "end"),
+        db_path=db_path,
+        chunk_rows=chunk_rows,
+    )
+
+
+def get_terminal_lines(params, db_path, chunk_rows=None):
+    return queries.terminal_lines(
+        required(params, "terminal-id"), db_path=db_path, chunk_rows=chunk_rows
+    )
+
+
+def get_line_shapes(params, db_path, chunk_rows=None):
+    return queries.line_shapes(
+        params.get("scale"),
+        params.get("zoom"),
+        db_path=db_path,
+        chunk_rows=chunk_rows,
+    )
+
+
+def get_rollup(params, db_path, chunk_rows=None):
+    return queries.rollup(
+        required(params, "table"),
+        required(params, "grain"),
+        db_path=db_path,
+        chunk_rows=chunk_rows,
+    )
+
+
+ROUTES = {
+    "/passengers": get_passengers,
+    "/weather": get_weather,
+    "/terminal-lines": get_terminal_lines,
+    "/line-shapes": get_line_shapes,
+    "/rollups": get_rollup,
+}
+
+
+# --- Encoding of the results ---
+def with_wkt(dataset):
+    geom_cols = [col for col in GEOMETRY_COLUMNS if col in dataset.columns]
+    if geom_cols:
+        dataset = dataset.copy()
+        for col in geom_cols:
+            dataset[col] = shapely.to_wkt(from_wkb(dataset[col]))
+    return dataset
+
+
+def to_records_json(dataset):
+    return with_wkt(dataset).to_json(orient="records", force_ascii=False)
+
+
+def to_ndjson(dataset):
+    if dataset.empty:
+        return ""
+    lines = with_wkt(dataset).to_json(orient="records", lines=True, force_ascii=False)
+    return lines if lines.endswith("\n") else lines + "\n"
+
+
+def ndjson_stream(chunks):
+    for chunk in chunks:
+        yield to_ndjson(chunk).encode("utf-8")
+
+
+def _take(buffer):
+    # the bytes written to 'buffer' since the last call
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def arrow_stream(chunks):
+    """Encode DataFrame chunks as an Arrow IPC stream, one batch per chunk.
+
+    Every batch is yielded as soon as it is encoded. The stream has one
+    schema, so chunks are held back only while a column is still all NULL
+    (and its type unknown); later chunks are cast to the schema.
+    """
+    buffer = io.BytesIO()
+    pending = []
+    types = {}
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            pending.append(chunk)
+            for field in pa.Schema.from_pandas(chunk, preserve_index=False):
+                if field.name not in types and not pa.types.is_null(field.type):
+                    types[field.name] = field.type
+            if len(types) < len(chunk.columns):
+                continue
+            schema = pa.schema([(col, types[col]) for col in chunk.columns])
+            writer = pa.ipc.new_stream(buffer, schema)
+            chunks_to_write, pending = pending, []
+        else:
+            chunks_to_write = [chunk]
+        for to_write in chunks_to_write:
+            writer.write_batch(
+                pa.RecordBatch.from_pandas(
+                    to_write, schema=schema, preserve_index=False
+                )
+            )
+            yield _take(buffer)
+
+    if writer is None:
+        # columns that are NULL in every row keep the null type
+        schema = pa.schema(
+            [(col, types.get(col, pa.null())) for col in pending[0].columns]
+        )
+        writer = pa.ipc.new_stream(buffer, schema)
+        for to_write in pending:
+            writer.write_batch(
+                pa.RecordBatch.from_pandas(
+                    to_write, schema=schema, preserve_index=False
+                )
+            )
+    writer.close()
+    yield _take(buffer)
+
+
+# --- HTTP ---
+async def read_request(reader):
+    # (method, path, params) of the request, its headers are skipped
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise BadRequest("Malformed request line")
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+    method, target, _ = parts
+    url = urlsplit(target)
+    return method, url.path, dict(parse_qsl(url.query))
+
+
+def response_head(status, content_type, length=None):
+    head = [
+        "HTTP/1.1 {} {}".format(status, STATUS_TEXT[status]),
+        "Content-Type: {}".format(content_type),
+        "Connection: close",
+    ]
+    if length is None:
+        head.append("Transfer-Encoding: chunked")
+    else:
+        head.append("Content-Length: {}".format(length))
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_body(writer, status, content_type, body):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    writer.write(response_head(status, content_type, len(body)) + body)
+    await writer.drain()
+
+
+async def send_json(writer, status, obj):
+    await send_body(writer, status, CONTENT_TYPES["json"], json.dumps(obj))
+
+
+class StreamAborted(Exception):
+    """A chunked response failed after its status line was sent."""
+
+
+async def send_chunked(writer, content_type, chunks):
+    # 'chunks' is an async iterator of bytes. Once the head is sent, a
+    # failure can't be reported with another status: the response is cut
+    # off without its last chunk, so that the client sees it as incomplete
+    writer.write(response_head(200, content_type))
+    try:
+        async for chunk in chunks:
+            if chunk:
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+    except ConnectionError:
+        raise
+    except Exception as e:
+        raise StreamAborted() from e
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def _prepend(first, chunks):
+    try:
+        yield first
+        yield from chunks
+    finally:
+        chunks.close()
+
+
+class QueryService:
+    def __init__(self, db_path=queries.DB_PATH, workers=WORKERS):
+        self.db_path = Path(db_path)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="query"
+        )
+        # (path, params) -> future of the running query
+        self.in_flight = {}
+        self.n_requests = 0
+        self.n_coalesced = 0
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        queries.close_pools()
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    async def fetch(self, path, params):
+        """The DataFrame of 'path', shared by identical concurrent requests."""
+        key = (path, tuple(sorted(params.items())))
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.n_coalesced += 1
+        else:
+            future = asyncio.ensure_future(self.run(ROUTES[path], params, self.db_path))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # a client that disconnects must not cancel the query of the others
+        return await asyncio.shield(future)
+
+    async def open_chunks(self, path, params, chunk_rows):
+        """An iterator of the DataFrame chunks of 'path'.
+
+        The rows are read from the DB in batches, or from the result of an
+        identical request that is running. The first chunk is read right
+        away, so that invalid parameters and failing queries are reported
+        before the response starts.
+        """
+        future = self.in_flight.get((path, tuple(sorted(params.items()))))
+        if future is not None:
+            self.n_coalesced += 1
+            dataset = await asyncio.shield(future)
+            chunks = (
+                dataset.iloc[start : start + chunk_rows]
+                for start in range(0, max(len(dataset), 1), chunk_rows)
+            )
+        else:
+            chunks = await self.run(ROUTES[path], params, self.db_path, chunk_rows)
+        try:
+            first = await self.run(next, chunks)
+        except BaseException:
+            await self.run(chunks.close)
+            raise
+        return _prepend(first, chunks)
+
+    async def iterate(self, iterator):
+        # every step of a blocking iterator runs on the thread pool
+        done = object()
+        while True:
+            item = await self.run(next, iterator, done)
+            if item is done:
+                return
+            yield item
+
+    async def respond(self, writer, path, params):
+        if path == "/health":
+            await send_json(
+                writer,
+                200,
+                {
+                    "status": "ok",
+                    "requests": self.n_requests,
+                    "coalesced": self.n_coalesced,
+                    "in-flight": len(self.in_flight),
+                    "cache": queries.cache_info(),
+                },
+            )
+            return
+        if path not in ROUTES:
+            await send_json(writer, 404, {"error": "Unknown path '{}'".format(path)})
+            return
+
+        output_format = params.pop("format", "json")
+        if output_format not in CONTENT_TYPES:
+            raise BadRequest("Unknown format '{}'".format(output_format))
+        try:
+            chunk_rows = int(params.pop("chunk-rows", CHUNK_ROWS))
+        except ValueError:
+            raise BadRequest("'chunk-rows' must be an integer") from None
+        if chunk_rows < 1:
+            raise BadRequest("'chunk-rows' must be positive")
+
+        if output_format == "json":
+            dataset = await self.fetch(path, params)
+            body = await self.run(to_records_json, dataset)
+            await send_body(writer, 200, CONTENT_TYPES["json"], body)
+            return
+
+        # NDJSON and Arrow are encoded and sent chunk by chunk, as the rows
+        # are read
+        chunks = await self.open_chunks(path, params, chunk_rows)
+        encode = ndjson_stream if output_format == "ndjson" else arrow_stream
+        encoded = encode(chunks)
+        try:
+            await send_chunked(
+                writer, CONTENT_TYPES[output_format], self.iterate(encoded)
+            )
+        finally:
+            # ends the read of a client that went away midway
+            await self.run(encoded.close)
+            await self.run(chunks.close)
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    return
+                method, path, params = request
+                self.n_requests += 1
+                if method != "GET":
+                    await send_json(writer, 405, {"error": "Only GET is supported"})
+                else:
+                    await self.respond(writer, path, params)
+            except StreamAborted:
+                # the connection is closed below, mid-response
+                pass
+            except (BadRequest, ValueError, KeyError) as e:
+                # invalid parameters, e.g. an unparseable date
+                await send_json(writer, 400, {"error": str(e)})
+            except ConnectionError:
+                pass
+            except Exception as e:
+                await send_json(
+                    writer, 500, {"error": "{}: {}".format(type(e).__name__, e)}
+                )
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def start_server(service, host=HOST, port=PORT):
+    # port 0 picks a free port, see server.sockets[0].getsockname()
+    return await asyncio.start_server(service.handle, host, port, limit=MAX_LINE)
+
+
+async def serve(db_path=queries.DB_PATH, host=HOST, port=PORT, workers=WORKERS):
+    service = QueryService(db_path, workers)
+    server = await start_server(service, host, port)
+    host, port = server.sockets[0].getsockname()[:2]
+    print("Serving {} on http://{}:{}".format(db_path, host, port), flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the database over HTTP on localhost."
+    )
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--db-path", type=Path, default=queries.DB_PATH)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.db_path, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
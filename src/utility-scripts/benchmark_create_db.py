@@ -0,0 +1,100 @@
+"""
+Compare the rows/second of the bulk loader with the former to_sql() path.
+
+Usage: python src/utility-scripts/benchmark_create_db.py [--repeat N]
+
+Both paths load the cleaned datasets under 'data/cleaned' (the Arrow files
+written by clean_raw.py) into a fresh database in a temporary directory.
+'--repeat' stacks the hourly tables N times to get a larger load.
+"""
+
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.intermediate import CLEANED_DIR, read_datasets
+from src.processing.create_db import INDEXES, TABLES, bulk_load
+
+# tables that are stacked '--repeat' times; the copies of the hourly tables
+# are shifted in time so that their keys stay unique
+REPEATABLE_TABLES = [
+    "terminals-lines",
+    "transportation-load",
+    "transportation-load-per-line",
+    "weather-observations",
+]
+
+
+def stack(table, repeat):
+    if "hour-key" not in table.column_names:
+        return pa.concat_tables([table] * repeat)
+    hour_keys = table.column("hour-key")
+    span = pc.max(hour_keys).as_py() - pc.min(hour_keys).as_py() + 1
+    index = table.column_names.index("hour-key")
+    return pa.concat_tables(
+        [
+            table.set_column(
+                index,
+                table.schema.field(index),
+                pc.add(hour_keys, pa.scalar(i * span, hour_keys.type)),
+            )
+            for i in range(repeat)
+        ]
+    )
+
+
+def to_sql_load(conn, datasets):
+    # the loading code of create_db.py before the bulk loader: one commit per
+    # CREATE TABLE, then to_sql() per table with the default settings; the
+    # indexes of the bulk loader are added at the end to compare like for like
+    for query in TABLES.values():
+        conn.execute(query)
+        conn.commit()
+    n_rows = 0
+    for table in TABLES:
+        dataset = datasets[table].to_pandas()
+        dataset.to_sql(table, con=conn, if_exists="append", index=False)
+        n_rows += len(dataset)
+    for query in INDEXES.values():
+        conn.execute(query)
+    conn.commit()
+    return n_rows
+
+
+def time_load(load, datasets, tmp_dir, name):
+    db_path = Path(tmp_dir) / "{}.sqlite3".format(name)
+    conn = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    n_rows = load(conn, datasets)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return n_rows, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--cleaned-dir", type=Path, default=CLEANED_DIR)
+    args = parser.parse_args(argv)
+
+    datasets = read_datasets(args.cleaned_dir)
+    for table in REPEATABLE_TABLES:
+        datasets[table] = stack(datasets[table], args.repeat)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, load in [("to_sql", to_sql_load), ("bulk_load", bulk_load)]:
+            n_rows, elapsed = time_load(load, datasets, tmp_dir, name)
+            print(
+                "{:<10} {:>10,} rows in {:>7.3f} s: {:>12,.0f} rows/s".format(
+                    name, n_rows, elapsed, n_rows / elapsed
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
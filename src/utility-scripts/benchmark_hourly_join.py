@@ -0,0 +1,220 @@
+"""
+Compare the latency of hourly passenger/weather joins before and after the
+'hour-key' schema.
+
+Usage: python src/utility-scripts/benchmark_hourly_join.py [--repeat N]
+
+The 'transportation-load' and 'weather-observations' Arrow files under
+'data/cleaned' are loaded into two databases in a temporary directory: one
+with the former schema (four time columns, no key and no index) and one with
+the schema of create_db.py. '--repeat' appends N - 1 shifted copies of the
+year, so that the tables are N years long.
+"""
+
+import argparse
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.db_layout import HOUR_KEY_EPOCH
+from src.intermediate import CLEANED_DIR, read_dataset, to_arrow_table
+from src.processing.create_db import INDEXES, TABLES, table_rows
+
+HOURLY_TABLES = ["transportation-load", "weather-observations"]
+
+FORMER_TABLES = {
+    "transportation-load": """
+CREATE TABLE "transportation-load" (
+    "day" INTEGER, "month" INTEGER, "year" INTEGER, "hour" INTEGER,
+    "n-passengers" INTEGER
+);
+""",
+    "weather-observations": """
+CREATE TABLE "weather-observations" (
+    "day" INTEGER, "month" INTEGER, "year" INTEGER, "hour" INTEGER,
+    "avg-temp" REAL, "avg-humidity" REAL, "avg-precip" REAL, "avg-wind" REAL,
+    "avg-winddir" REAL
+);
+""",
+}
+
+# name -> (query on the former schema, query on the 'hour-key' schema)
+QUERIES = {
+    "join all hours": (
+        """
+        SELECT t."year", t."month", SUM(t."n-passengers"), AVG(w."avg-temp")
+        FROM "transportation-load" AS t
+        JOIN "weather-observations" AS w
+          ON t."year" = w."year" AND t."month" = w."month"
+         AND t."day" = w."day" AND t."hour" = w."hour"
+        GROUP BY t."year", t."month"
+        """,
+        """
+        SELECT t."year", t."month", SUM(t."n-passengers"), AVG(w."avg-temp")
+        FROM "transportation-load" AS t
+        JOIN "weather-observations" AS w ON t."hour-key" = w."hour-key"
+        GROUP BY t."year", t."month"
+        """,
+    ),
+    "join a month range": (
+        """
+        SELECT SUM(t."n-passengers"), AVG(w."avg-wind")
+        FROM "transportation-load" AS t
+        JOIN "weather-observations" AS w
+          ON t."year" = w."year" AND t."month" = w."month"
+         AND t."day" = w."day" AND t."hour" = w."hour"
+        WHERE t."year" = 2020 AND t."month" BETWEEN 3 AND 5
+        """,
+        """
+        SELECT SUM(t."n-passengers"), AVG(w."avg-wind")
+        FROM "transportation-load" AS t
+        JOIN "weather-observations" AS w ON t."hour-key" = w."hour-key"
+        WHERE t."year" = 2020 AND t."month" BETWEEN 3 AND 5
+        """,
+    ),
+    "join an hour of day": (
+        """
+        SELECT SUM(t."n-passengers"), AVG(w."avg-precip")
+        FROM "transportation-load" AS t
+        JOIN "weather-observations" AS w
+          ON t."year" = w."year" AND t."month" = w."month"
+         AND t."day" = w."day" AND t."hour" = w."hour"
+        WHERE t."hour" = 8
+        """,
+        """
+        SELECT SUM(t."n-passengers"), AVG(w."avg-precip")
+        FROM "transportation-load" AS t
+        JOIN "weather-observations" AS w ON t."hour-key" = w."hour-key"
+        WHERE t."hour" = 8
+        """,
+    ),
+    "passengers per weekday": (
+        """
+        SELECT strftime('%w', printf('%04d-%02d-%02d', "year", "month", "day")),
+               SUM("n-passengers")
+        FROM "transportation-load"
+        GROUP BY 1
+        """,
+        """
+        SELECT "weekday", SUM("n-passengers")
+        FROM "transportation-load"
+        GROUP BY "weekday"
+        """,
+    ),
+}
+
+
+def stack_years(name, repeat, cleaned_dir=CLEANED_DIR):
+    # 'repeat' copies of the dataset, each shifted by a whole number of years'
+    # worth of hours, with the time columns recomputed from the shifted key
+    dataset = read_dataset(name, cleaned_dir).to_pandas()
+    n_hours = len(dataset)
+    copies = []
+    for i in range(repeat):
+        copy = dataset.copy()
+        copy["hour-key"] += i * n_hours
+        date_times = HOUR_KEY_EPOCH + pd.to_timedelta(copy["hour-key"], unit="h")
+        copy["day"] = date_times.dt.day
+        copy["month"] = date_times.dt.month
+        copy["year"] = date_times.dt.year
+        copy["hour"] = date_times.dt.hour
+        copy["weekday"] = date_times.dt.weekday
+        copies.append(copy)
+    return to_arrow_table(name, pd.concat(copies, ignore_index=True))
+
+
+def create_db(db_path, datasets, tables, indexes):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for name in HOURLY_TABLES:
+            conn.execute(tables[name])
+            table = datasets[name]
+            cols = [
+                col for col in table.column_names if '"{}"'.format(col) in tables[name]
+            ]
+            table = table.select(cols)
+            conn.executemany(
+                'INSERT INTO "{}" ({}) VALUES ({})'.format(
+                    name,
+                    ", ".join('"{}"'.format(col) for col in cols),
+                    ", ".join("?" for _ in cols),
+                ),
+                table_rows(table),
+            )
+        for query in indexes:
+            conn.execute(query)
+    conn.execute("ANALYZE")
+    return conn
+
+
+def check_same_results(name, former_rows, keyed_rows):
+    # the groups may be labelled differently (e.g. weekday numbers), so only
+    # the sorted values of the last column are compared
+    former_values = np.sort(np.array(former_rows, dtype=float)[:, -1])
+    keyed_values = np.sort(np.array(keyed_rows, dtype=float)[:, -1])
+    if former_values.shape != keyed_values.shape or not np.allclose(
+        former_values, keyed_values, equal_nan=True
+    ):
+        raise RuntimeError("'{}' gives different results".format(name))
+
+
+def median_ms(conn, query, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        conn.execute(query).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--cleaned-dir", type=Path, default=CLEANED_DIR)
+    args = parser.parse_args(argv)
+
+    datasets = {
+        name: stack_years(name, args.repeat, args.cleaned_dir) for name in HOURLY_TABLES
+    }
+    hourly_indexes = [
+        query
+        for query in INDEXES.values()
+        if any('ON "{}"'.format(name) in query for name in HOURLY_TABLES)
+    ]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        former = create_db(
+            Path(tmp_dir) / "former.sqlite3", datasets, FORMER_TABLES, []
+        )
+        keyed = create_db(
+            Path(tmp_dir) / "keyed.sqlite3", datasets, TABLES, hourly_indexes
+        )
+        print(
+            "{:,} hours per table, median of {} runs".format(
+                datasets[HOURLY_TABLES[0]].num_rows, args.runs
+            )
+        )
+        for name, (former_query, keyed_query) in QUERIES.items():
+            check_same_results(
+                name,
+                former.execute(former_query).fetchall(),
+                keyed.execute(keyed_query).fetchall(),
+            )
+            former_ms = median_ms(former, former_query, args.runs)
+            keyed_ms = median_ms(keyed, keyed_query, args.runs)
+            print(
+                "{:<24} former {:>9.2f} ms   hour-key {:>9.2f} ms   {:>6.1f}x".format(
+                    name, former_ms, keyed_ms, former_ms / keyed_ms
+                )
+            )
+        former.close()
+        keyed.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Time every stage of the pipeline on synthetic data of growing scale.
+
+Usage: python src/utility-scripts/benchmark_pipeline.py
+           [--scale YEARSxSENSORS ...] [--output PATH] [--work-dir DIR]
+
+For every scale (e.g. '5x1': 5 years with the sensor network of the raw
+data, '1x8': 1 year with 8 times the sensors), generate_synthetic_data.py
+writes the raw datasets into a working directory, and then clean_raw.py
+(default and '--streaming'), and create_db.py are run there. Each stage runs
+in its own process; its wall time and its peak memory are recorded. The peak
+memory is the largest sum of the RSS of the stage's process and all its
+descendants (e.g. the process pool of the cleaning DAG), sampled every
+RSS_INTERVAL seconds from /proc on Linux. Elsewhere only the peak RSS of the
+largest single process is known, which is reported instead.
+
+The report lists the seconds per million raw rows and, between scales that
+only differ in years or in sensors, the scaling exponent of each stage's time
+(1 is linear, higher is worse). '--output' also writes the results as JSON,
+e.g. to compare runs.
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+SCRIPTS = {
+    "generate": REPO_DIR / "src/utility-scripts/generate_synthetic_data.py",
+    "clean_raw": REPO_DIR / "src/cleaning/clean_raw.py",
+    "create_db": REPO_DIR / "src/processing/create_db.py",
+}
+RAW_DIRS = [
+    "data/raw/historic-transportation-load",
+    "data/raw/historic-weather-observations",
+]
+DEFAULT_SCALES = ["1x1", "5x1", "10x1", "1x8"]
+# seconds between two samples of the RSS of a stage's process tree
+RSS_INTERVAL = 0.05
+PROC_DIR = Path("/proc")
+
+
+def parse_scale(scale):
+    years, sensor_factor = scale.lower().split("x")
+    return int(years), int(sensor_factor)
+
+
+def stages(work_dir, years, sensor_factor):
+    # stage name -> command, run with 'work_dir' as working directory
+    return {
+        "generate": [
+            sys.executable,
+            str(SCRIPTS["generate"]),
+            str(work_dir),
+            "--years",
+            str(years),
+            "--sensor-factor",
+            str(sensor_factor),
+            "--raw-dir",
+            str(REPO_DIR / "data/raw"),
+        ],
+        "clean_raw": [sys.executable, str(SCRIPTS["clean_raw"]), "--no-cache"],
+        "clean_raw --streaming": [
+            sys.executable,
+            str(SCRIPTS["clean_raw"]),
+            "--no-cache",
+            "--streaming",
+        ],
+        "create_db": [sys.executable, str(SCRIPTS["create_db"])],
+    }
+
+
+def measure(command, cwd):
+    # run 'command' from a fresh process, so that the peak RSS of its
+    # children is the peak of this stage alone (where it is only known from
+    # getrusage())
+    result = subprocess.run(
+        [sys.executable, __file__, "--measure", "--", *command],
+        cwd=cwd,
+        env=dict(os.environ, PYTHONPATH=str(REPO_DIR)),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def tree_rss(pid):
+    # summed RSS in bytes of process 'pid' and its descendants, from /proc
+    children = {}
+    for stat_path in PROC_DIR.glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text()
+        except OSError:  # exited meanwhile
+            continue
+        # the fields after the command name, which may contain spaces
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(stat_path.parent.name))
+
+    rss = 0
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        pids += children.get(pid, [])
+        try:
+            rss += int((PROC_DIR / str(pid) / "statm").read_text().split()[1])
+        except OSError:  # exited meanwhile
+            pass
+    return rss * page_size
+
+
+def run_measured(command):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    peak = 0
+    sample_tree = sys.platform.startswith("linux") and PROC_DIR.is_dir()
+    while True:
+        if sample_tree:
+            peak = max(peak, tree_rss(process.pid))
+        try:
+            returncode = process.wait(timeout=RSS_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+    seconds = time.perf_counter() - start
+
+    peak_mb = peak / (1 << 20) if sample_tree else None
+    if peak_mb is None and resource is not None:
+        # the largest single process only; KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_mb = peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+    print(json.dumps({"seconds": seconds, "peak-mb": peak_mb}))
+    return returncode
+
+
+def count_raw_rows(work_dir):
+    n_rows = 0
+    for raw_dir in RAW_DIRS:
+        for path in (Path(work_dir) / raw_dir).glob("*.csv"):
+            with open(path, "rb") as f:
+                n_rows += sum(1 for _ in f) - 1
+    return n_rows
+
+
+def run_scale(scale, work_dir):
+    years, sensor_factor = parse_scale(scale)
+    results = []
+    for stage, command in stages(work_dir, years, sensor_factor).items():
+        timing = measure(command, work_dir)
+        if stage == "generate":
+            n_raw_rows = count_raw_rows(work_dir)
+        results.append(
+            {
+                "scale": scale,
+                "years": years,
+                "sensor-factor": sensor_factor,
+                "stage": stage,
+                "raw-rows": n_raw_rows,
+                **timing,
+            }
+        )
+        print(
+            "{:<6} {:<22} {:>8.2f} s {:>8.1f} s/M rows {:>8} MiB peak".format(
+                scale,
+                stage,
+                timing["seconds"],
+                timing["seconds"] / n_raw_rows * 1e6,
+                (
+                    "-"
+                    if timing["peak-mb"] is None
+                    else "{:.0f}".format(timing["peak-mb"])
+                ),
+            ),
+            flush=True,
+        )
+    return results
+
+
+def print_scaling(results):
+    # exponent k of time ~ factor^k between consecutive scales of each stage
+    # that only differ in their number of years, or in their sensor factor
+    print("\nscaling exponents (1 = linear)")
+    for axis, fixed in [("years", "sensor-factor"), ("sensor-factor", "years")]:
+        groups = {}
+        for result in results:
+            groups.setdefault((result["stage"], result[fixed]), []).append(result)
+        for (stage, _), group in groups.items():
+            group = sorted(group, key=lambda result: result[axis])
+            for smaller, larger in zip(group, group[1:]):
+                exponent = math.log(larger["seconds"] / smaller["seconds"]) / math.log(
+                    larger[axis] / smaller[axis]
+                )
+                print(
+                    "{:<22} {:>6} -> {:<6} {:>5.2f}".format(
+                        stage, smaller["scale"], larger["scale"], exponent
+                    )
+                )
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:2] == ["--measure", "--"]:
+        sys.exit(run_measured(argv[2:]))
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scale", action="append", default=None, help="YEARSxSENSORS, e.g. 5x1"
+    )
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        default=None,
+        help="keep the generated data and DBs under this directory",
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_dir = args.work_dir or Path(tmp_dir)
+        for scale in args.scale or DEFAULT_SCALES:
+            work_dir = base_dir / scale
+            work_dir.mkdir(parents=True, exist_ok=True)
+            results += run_scale(scale, work_dir.resolve())
+    print_scaling(results)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Write synthetic raw datasets, in the layout of 'data/raw', at a chosen scale.
+
+Usage: python src/utility-scripts/generate_synthetic_data.py OUT_DIR
+           [--years N] [--start-year YEAR] [--sensor-factor K] [--seed S]
+
+The 2020 raw files are the templates. Each synthetic year gets twelve
+'transportation-load_YYYYMM.csv' files: the rows of the same 2020 month,
+moved to that year (without Feb 29 outside leap years), with the passengers
+scaled by a random factor. 'observations_YYYYMM.csv' files are built from the
+May 2020 observations (the only month in the raw data), whose days are used in
+turn, with the temperatures shifted by a seasonal offset and noise added.
+
+'--sensor-factor K' adds K - 1 copies of every station with a known location
+to the observations ('AKOM_1', ...), and registers each copy as a sensor, a
+little away from the sensor of its station, in the geolocation file of that
+sensor. The stations are matched to the sensors like clean_raw.py does (see
+match_observatories() in weather_cube.py). The ferry lines are copied
+without their rows that have extra, unquoted fields, which clean_raw.py can't
+read. The other geolocation and summary files are copied as they are. The
+files are written under 'OUT_DIR/data/raw', so that the cleaning and
+processing scripts can be run with OUT_DIR as working directory.
+"""
+
+import argparse
+import calendar
+import csv
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.helper_functions import parse_coords
+from src.weather_cube import match_observatories
+
+RAW_DIR = Path("data/raw")
+TRANSPORTATION_DIR = "historic-transportation-load"
+WEATHER_DIR = "historic-weather-observations"
+COPIED_FILES = [
+    "geolocation/ferry-terminals-geoloc.csv",
+    "summary-stats/trips-per-ferry-line_2020.csv",
+]
+FERRY_LINES_FILE = "geolocation/ferry-lines-geoloc.csv"
+# fields of a ferry-lines row (see 'import_dicts' in clean_raw.py)
+FERRY_LINES_FIELDS = 6
+AUTOMATED_STATIONS_FILE = "geolocation/automated-weather-stations-geoloc.csv"
+ICING_SENSORS_FILE = "geolocation/icing-sensors-geoloc.csv"
+WEATHER_TEMPLATE = "observations_202005.csv"
+TEMPLATE_YEAR = 2020
+TEMPLATE_WEATHER_MONTH = 5
+
+# temperature columns that get the seasonal offset (the road temperatures
+# are kept, as they hold sentinel values)
+TEMPERATURE_COLS = [
+    "MINIMUM_TEMPERATURE",
+    "MAXIMUM_TEMPERATURE",
+    "AVERAGE_TEMPERATURE",
+    "MINIMUM_FELT_TEMPERATURE",
+    "MAXIMUM_FELT_TEMPERATURE",
+    "AVERAGE_FELT_TEMPERATURE",
+]
+# columns that get multiplicative noise, and are kept >= 0
+POSITIVE_COLS = [
+    "MINIMUM_WIND",
+    "MAXIMUM_WIND",
+    "AVERAGE_WIND",
+    "MINIMUM_PRECIPITATION",
+    "MAXIMUM_PRECIPITATION",
+    "AVERAGE_PRECIPITATION",
+]
+
+# standard deviation, in degrees, of the offset of a sensor copy from the
+# position of its template sensor (about 2 km)
+SENSOR_JITTER = 0.02
+
+
+def seasonal_temperature(month):
+    # rough monthly mean temperature of Istanbul in degrees C, coldest in
+    # February and warmest in August
+    return 14.5 + 9.5 * np.cos(2 * np.pi * (month - 8) / 12)
+
+
+def move_to_year(date_times, year):
+    # the same month, day and hour in 'year'; Feb 29 becomes NaT outside
+    # leap years
+    parts = pd.DataFrame(
+        {
+            "year": year,
+            "month": date_times.dt.month,
+            "day": date_times.dt.day,
+            "hour": date_times.dt.hour,
+        }
+    )
+    return pd.to_datetime(parts, errors="coerce")
+
+
+# --- historic-transportation-load ---
+def generate_transportation_load(template, year, rng):
+    dataset = template.copy()
+    date_times = move_to_year(pd.to_datetime(dataset["DATE_TIME"]), year)
+    dataset = dataset.loc[date_times.notna()].copy()
+    dataset["DATE_TIME"] = date_times[date_times.notna()].dt.strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    factor = rng.lognormal(mean=0.0, sigma=0.15, size=len(dataset))
+    for col in ["NUMBER_OF_PASSENGER", "NUMBER_OF_PASSAGE"]:
+        dataset[col] = np.rint(dataset[col] * factor).astype(np.int64)
+    # raw files are not sorted by time
+    return dataset.sample(frac=1.0, random_state=rng.integers(2**31))
+
+
+# --- historic-weather-observations ---
+def generate_weather_observations(template, year, month, sensor_factor, located, rng):
+    # the copies are only made of the 'located' observatories
+    template_times = pd.to_datetime(template["DATE_TIME"])
+    n_days = calendar.monthrange(year, month)[1]
+    days = []
+    # the template only has some days of May, which are used in turn
+    template_days = np.sort(template_times.dt.day.unique())
+    for day in range(1, n_days + 1):
+        template_day = template_days[(day - 1) % len(template_days)]
+        rows = template.loc[template_times.dt.day == template_day].copy()
+        rows["DATE_TIME"] = (
+            pd.Timestamp(year, month, day)
+            + pd.to_timedelta(template_times[rows.index].dt.hour, unit="h")
+        ).dt.strftime("%Y-%m-%d %H:%M:%S")
+        days.append(rows)
+    dataset = pd.concat(days, ignore_index=True)
+
+    copies = []
+    for copy_i in range(sensor_factor):
+        copy = dataset.copy()
+        if copy_i:
+            copy = copy.loc[copy["OBSERVATORY_NAME"].isin(located)].copy()
+            copy["OBSERVATORY_NAME"] = copy["OBSERVATORY_NAME"] + "_{}".format(copy_i)
+        offset = seasonal_temperature(month) - seasonal_temperature(
+            TEMPLATE_WEATHER_MONTH
+        )
+        noise = rng.normal(0.0, 0.5, size=len(copy))
+        for col in TEMPERATURE_COLS:
+            copy[col] = (copy[col] + offset + noise).round(5)
+        factor = rng.lognormal(mean=0.0, sigma=0.2, size=len(copy))
+        for col in POSITIVE_COLS:
+            copy[col] = (copy[col] * factor).clip(lower=0).round(5)
+        copies.append(copy)
+    dataset = pd.concat(copies, ignore_index=True)
+    return dataset.sample(frac=1.0, random_state=rng.integers(2**31))
+
+
+# --- geolocation files ---
+def format_dms(value, positive, negative):
+    hemisphere = positive if value >= 0 else negative
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = (value - degrees - minutes / 60) * 3600
+    return "{}⁰ {}′ {:.2f}″ {}".format(degrees, minutes, seconds, hemisphere)
+
+
+def ferry_lines_lines(raw_dir):
+    # the lines of the raw ferry-lines file, without the rows with more fields
+    # than there are columns (e.g. unquoted commas in a MULTILINESTRING), on
+    # which read_csv() fails; tests/test_repair.py skips them too
+    with open(raw_dir / FERRY_LINES_FILE, encoding="utf-8") as f:
+        return [
+            line
+            for line in f
+            if len(next(csv.reader([line]), [])) <= FERRY_LINES_FIELDS
+        ]
+
+
+def template_sensors(raw_dir):
+    # every name of the template sensors -> (geolocation file, lat, lon); the
+    # icing sensors are named after their station and their location
+    sensors = {}
+    for name, sep, name_cols, coords_col in [
+        (AUTOMATED_STATIONS_FILE, ";", [1], 2),
+        (ICING_SENSORS_FILE, ",", [1, 2], 3),
+    ]:
+        template = pd.read_csv(raw_dir / name, encoding="utf-8-sig", sep=sep, header=0)
+        # the automated weather stations file ends with empty rows
+        template = template.dropna(subset=[template.columns[1]])
+        lats, lons, invalid = parse_coords(template.iloc[:, coords_col])
+        if len(invalid):
+            raise ValueError(
+                "Unparseable coordinates of the sensors {}".format(
+                    template.iloc[invalid, 1].tolist()
+                )
+            )
+        for col in name_cols:
+            names = template.iloc[:, col].astype(str).str.strip()
+            for sensor_name, lat, lon in zip(names, lats, lons):
+                sensors[sensor_name] = (name, lat, lon)
+    return sensors
+
+
+def sensor_copy_lines(located, sensor_factor, raw_dir, rng):
+    # K - 1 copies of the sensor of every located observatory, named like the
+    # observatory's copies in the observations ('<observatory>_<i>') so that
+    # the cleaning matches them, and jittered around the template sensor.
+    # Returns the lines to append to each geolocation file, in its format
+    n_rows = {}
+    for name in [AUTOMATED_STATIONS_FILE, ICING_SENSORS_FILE]:
+        with open(raw_dir / name, encoding="utf-8-sig") as f:
+            n_rows[name] = sum(1 for line in f if line.strip(";,\n")) - 1
+    lines = {name: [] for name in n_rows}
+    for copy_i in range(1, sensor_factor):
+        for observatory, (name, lat, lon) in sorted(located.items()):
+            n_rows[name] += 1
+            sensor_name = "{}_{}".format(observatory, copy_i)
+            coords = "{}, {}".format(
+                format_dms(lat + rng.normal(0.0, SENSOR_JITTER), "N", "S"),
+                format_dms(lon + rng.normal(0.0, SENSOR_JITTER), "E", "W"),
+            )
+            if name == ICING_SENSORS_FILE:
+                # 'beus<n>,<name>,<location>,"<lat>, <lon>",,'
+                line = 'beus{},{},{},"{}",,\n'.format(
+                    n_rows[name], sensor_name, sensor_name, coords
+                )
+            else:
+                # 'awos<n>;<name>;<lat>, <lon>;;;'
+                line = "awos{};{};{};;;\n".format(n_rows[name], sensor_name, coords)
+            lines[name].append(line)
+    return lines
+
+
+def generate(
+    out_dir, years=1, start_year=TEMPLATE_YEAR, sensor_factor=1, seed=0, raw_dir=RAW_DIR
+):
+    """Write the synthetic raw datasets under 'out_dir/data/raw'.
+
+    Returns the number of transportation-load and weather-observations rows.
+    """
+    rng = np.random.default_rng(seed)
+    raw_dir = Path(raw_dir)
+    out_raw_dir = Path(out_dir) / RAW_DIR
+    for sub_dir in [TRANSPORTATION_DIR, WEATHER_DIR]:
+        if (out_raw_dir / sub_dir).exists():
+            shutil.rmtree(out_raw_dir / sub_dir)
+        (out_raw_dir / sub_dir).mkdir(parents=True)
+
+    for name in COPIED_FILES:
+        (out_raw_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(raw_dir / name, out_raw_dir / name)
+    (out_raw_dir / FERRY_LINES_FILE).parent.mkdir(parents=True, exist_ok=True)
+    with open(out_raw_dir / FERRY_LINES_FILE, "w", encoding="utf-8") as f:
+        f.writelines(ferry_lines_lines(raw_dir))
+
+    # the observatories with a known location, matched like clean_raw.py
+    # does, whose copies are registered as sensors
+    weather_template = pd.read_csv(raw_dir / WEATHER_DIR / WEATHER_TEMPLATE)
+    located = match_observatories(
+        weather_template["OBSERVATORY_NAME"].dropna(), template_sensors(raw_dir)
+    )
+    copy_lines = sensor_copy_lines(located, sensor_factor, raw_dir, rng)
+    for name, lines in copy_lines.items():
+        shutil.copyfile(raw_dir / name, out_raw_dir / name)
+        with open(out_raw_dir / name, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    n_rows = {"transportation-load": 0, "weather-observations": 0}
+    months = [
+        (year, month)
+        for year in range(start_year, start_year + years)
+        for month in range(1, 13)
+    ]
+    for year, month in months:
+        stem = "{}{:02d}".format(year, month)
+        template = pd.read_csv(
+            raw_dir
+            / TRANSPORTATION_DIR
+            / "transportation-load_{}{:02d}.csv".format(TEMPLATE_YEAR, month)
+        )
+        dataset = generate_transportation_load(template, year, rng)
+        dataset.to_csv(
+            out_raw_dir
+            / TRANSPORTATION_DIR
+            / "transportation-load_{}.csv".format(stem),
+            index=False,
+        )
+        n_rows["transportation-load"] += len(dataset)
+
+        dataset = generate_weather_observations(
+            weather_template, year, month, sensor_factor, located, rng
+        )
+        dataset.to_csv(
+            out_raw_dir / WEATHER_DIR / "observations_{}.csv".format(stem),
+            index=False,
+        )
+        n_rows["weather-observations"] += len(dataset)
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start-year", type=int, default=TEMPLATE_YEAR)
+    parser.add_argument("--sensor-factor", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--raw-dir", type=Path, default=RAW_DIR)
+    args = parser.parse_args(argv)
+
+    n_rows = generate(
+        args.out_dir,
+        args.years,
+        args.start_year,
+        args.sensor_factor,
+        args.seed,
+        args.raw_dir,
+    )
+    for name, n in n_rows.items():
+        print("{:<22} {:>12,} rows".format(name, n))
+
+
+if __name__ == "__main__":
+    main()
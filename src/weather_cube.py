@@ -0,0 +1,333 @@
+"""
+Per-station hourly weather observations as a memory-mapped cube.
+
+clean_raw.py writes a dense float32 array of shape (stations, hours,
+variables) to 'data/derived/weather-cube.npy', next to a small JSON sidecar
+'weather-cube.json' with the 'weather-sensors' id of every station, the
+'hour-key' of the first hour and the names of the variables. Hours without
+an observation are NaN. The observatories of the raw observations are
+matched to the weather sensors by name (see match_observatories()).
+
+load_cube() memory-maps the array, so that a slice of a few stations and a
+time range only reads the pages it covers:
+
+    cube = load_cube()
+    values = cube.select(sensor_ids=[3, 17], start="2020-05-01", end="2020-05-31")
+    cube.mean(sensor_ids=[3, 17], start="2020-05-01", end="2020-05-31")
+
+Wind directions are averaged as angles (see circular_mean()).
+"""
+
+import json
+import os
+import re
+import warnings
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.cleaning.aggregate_month import NON_NEGATIVE_WEATHER_COLUMNS
+from src.cleaning.gaps import hour_range
+from src.cleaning.readers import decategorize
+from src.db_layout import hour_keys, to_hour_key
+from src.paths import DERIVED_DIR
+
+CUBE_FILE = "weather-cube.npy"
+INDEX_FILE = "weather-cube.json"
+
+# raw column -> variable of the cube, in the order of the last axis
+CUBE_VARIABLES = {
+    "AVERAGE_TEMPERATURE": "avg-temp",
+    "AVERAGE_HUMIDITY": "avg-humidity",
+    "AVERAGE_PRECIPITATION": "avg-precip",
+    "AVERAGE_WIND": "avg-wind",
+    "AVERAGE_DIRECTIONOFWIND": "avg-winddir",
+}
+# variables in degrees, which are averaged with circular_mean()
+ANGLE_VARIABLES = {"avg-winddir"}
+
+# Observatories are matched to the weather sensors by normalize_name(): the
+# automated weather stations by their 'sensor-name', and the icing sensors,
+# which are named after their location in 'weather-sensors', by the name of
+# their station. Observatories whose names are abbreviated further are
+# matched through OBSERVATORY_ALIASES (observatory -> sensor or station name).
+OBSERVATORY_ALIASES = {
+    "BAHCESEHIR_I_KULE": "Ispartakule",
+    "BEYLIKDUZU_H_DERE": "Haramidere",
+    "CAMLICA_TUNEL_G": "Çamlıca Tunel Güney",
+    "CAMLICA_TUNEL_K": "Çamlıca Tunel Kuzey",
+    "RIVA_TUNEL_G": "Riva Tunel Güney",
+    "RIVA_TUNEL_K": "Riva Tunel Kuzey",
+    "TERKOS_BARAJI": "Terkos",
+    "YSS_KOPRUSU": "Yavuz Sultan Selim",
+}
+# observatories without a known location (e.g. the state weather service's
+# '_MGM' stations), which are left out of the cube. Any other observatory
+# without a weather sensor is an error.
+UNLOCATED_OBSERVATORIES = {
+    "ARNAVUTKOY_MGM",
+    "BEYKOZ_ANADOLU_FENERI",
+    "BEYKOZ_MGM",
+    "BEYLİKDUZU_MGM",
+    "BUYUKCEKMECE_MGM",
+    "CATALCA",
+    "CATALCA_MGM",
+    "CEKMEKOY_OMERLI_MGM",
+    "EMINONU",
+    "EYUP_MGM",
+    "FLORYA",
+    "GOZTEPE",
+    "GUNGOREN_DAVUTPASA_MARMARA",
+    "KADIKOY_GOZTEPE_MGM",
+    "KARTAL",
+    "KARTAL_AYDOS_DAGI",
+    "KILYOS",
+    "PENDIK_OMERL_BARAJI",
+    "SAMANDIRA",
+    "SANCAKTEPE_MGM",
+    "SARIYER",
+    "SARIYER_ITU_MASLAK",
+    "SARIYER_YSS_KOPRU_MGM",
+    "SILE_2",
+    "SILE_DARLIK",
+    "SILE_ISAKOY",
+    "SILIVRI_MGM",
+    "SILIVRI_ORMAN_SAHASI",
+    "SISLİ_MGM",
+    "TUZLA_MGM",
+    "UMRANIYE_MGM",
+    "USKUDAR_MGM",
+}
+# Turkish letters -> ASCII, for normalize_name()
+ASCII_LETTERS = str.maketrans("çğıİöşüÇĞÖŞÜ", "cgiIosuCGOSU")
+
+# the raw columns that the cube is built from, and their dtypes at read time
+STATION_OBSERVATIONS_COLUMNS = ["DATE_TIME", "OBSERVATORY_NAME"] + list(CUBE_VARIABLES)
+STATION_OBSERVATIONS_DTYPES = {
+    "DATE_TIME": "category",
+    "OBSERVATORY_NAME": "category",
+    **{col: "float32" for col in CUBE_VARIABLES},
+}
+
+CubeSlice = namedtuple("CubeSlice", ["values", "sensor_ids", "hour_keys", "variables"])
+
+
+# --- build ---
+def normalize_name(name):
+    # upper case ASCII letters and digits only, so that e.g. 'AHL_BAKIRKOY'
+    # of the observations and 'AHL-Bakırköy' of the geolocation file match
+    return re.sub(r"[^A-Z0-9]", "", str(name).translate(ASCII_LETTERS).upper())
+
+
+def match_observatories(observatories, sensor_names):
+    """Map every observatory to the id of its weather sensor.
+
+    'sensor_names' maps every name of a sensor to its id. Names are compared
+    after normalize_name(), and OBSERVATORY_ALIASES are applied first.
+    Raises a ValueError if a name is shared by two sensors, or if an
+    observatory matches no sensor and isn't in UNLOCATED_OBSERVATORIES.
+    """
+    ids = {}
+    for name, sensor_id in sensor_names.items():
+        ids.setdefault(normalize_name(name), set()).add(sensor_id)
+    ambiguous = sorted(name for name, matches in ids.items() if len(matches) > 1)
+    if ambiguous:
+        raise ValueError(
+            "Names shared by several weather sensors: {}".format(ambiguous)
+        )
+
+    observatory_ids = {}
+    unknown = []
+    for observatory in sorted(set(observatories)):
+        matches = ids.get(
+            normalize_name(OBSERVATORY_ALIASES.get(observatory, observatory))
+        )
+        if matches:
+            (observatory_ids[observatory],) = matches
+        elif observatory not in UNLOCATED_OBSERVATORIES:
+            unknown.append(observatory)
+    if unknown:
+        raise ValueError(
+            "Observatories without a weather sensor: {}. Add their locations to "
+            "the geolocation files, or list them in UNLOCATED_OBSERVATORIES to "
+            "leave them out of the weather cube".format(unknown)
+        )
+    return observatory_ids
+
+
+def build_cube(
+    observations,
+    weather_sensors,
+    station_names=None,
+    start=None,
+    end=None,
+    whole_years=False,
+):
+    """Scatter the raw 'observations' into a (stations, hours, variables) cube.
+
+    The stations are the 'weather-sensors' ids in order, matched to the
+    observatories by their 'sensor-name' or by their name in 'station_names'
+    (station name -> 'sensor-name'). The hours range over those of the
+    observations, over their whole calendar years with 'whole_years', or
+    from 'start' to 'end' (see gaps.py). Returns the cube and its index.
+    """
+    observations = decategorize(observations)
+    sensor_ids = dict(
+        zip(weather_sensors["sensor-name"].str.strip(), weather_sensors["id"])
+    )
+    sensor_names = dict(sensor_ids)
+    for station, sensor_name in (station_names or {}).items():
+        if sensor_name in sensor_ids:
+            sensor_names[station] = sensor_ids[sensor_name]
+    observatories = observations["OBSERVATORY_NAME"]
+    observatory_ids = match_observatories(observatories.dropna(), sensor_names)
+
+    ids = np.sort(weather_sensors["id"].to_numpy())
+    keys = hour_keys(pd.to_datetime(observations["DATE_TIME"]))
+    first, last = hour_range(keys, start, end, whole_years)
+    cube = np.full((len(ids), last - first + 1, len(CUBE_VARIABLES)), np.nan, "f4")
+
+    # one station and hour per row, the last observation of a duplicate wins
+    station = np.searchsorted(ids, observatories.map(observatory_ids).to_numpy())
+    hour = keys.to_numpy() - first
+    valid = observatories.isin(observatory_ids).to_numpy()
+    valid &= (hour >= 0) & (hour <= last - first)
+    observations = observations.loc[valid, list(CUBE_VARIABLES)]
+    for col in NON_NEGATIVE_WEATHER_COLUMNS:
+        observations.loc[observations[col] < 0, col] = np.nan
+    cube[station[valid], hour[valid]] = observations.to_numpy(dtype="f4")
+
+    index = {
+        "sensor-ids": ids.tolist(),
+        "first-hour-key": first,
+        "n-hours": last - first + 1,
+        "variables": list(CUBE_VARIABLES.values()),
+    }
+    return cube, index
+
+
+def write_cube(cube, index, derived_dir=DERIVED_DIR):
+    # like the Arrow files, write to temporary files first so that a reader
+    # never maps a half written cube
+    derived_dir = Path(derived_dir)
+    derived_dir.mkdir(parents=True, exist_ok=True)
+    for name, write in [
+        (CUBE_FILE, lambda f: np.save(f, cube)),
+        (INDEX_FILE, lambda f: f.write(json.dumps(index, indent=2).encode("utf-8"))),
+    ]:
+        path = derived_dir / name
+        tmp_path = path.with_name("{}.{}.tmp".format(name, os.getpid()))
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+
+# --- load ---
+def circular_mean(degrees, axis=None):
+    """Mean of angles in degrees, in [0, 360), ignoring NaN.
+
+    The unit vectors of the angles are averaged, so e.g. 350 and 10 average
+    to 0 rather than 180. The mean of only NaN, or of opposite angles, is
+    NaN.
+    """
+    radians = np.deg2rad(degrees)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        sin = np.nanmean(np.sin(radians), axis=axis)
+        cos = np.nanmean(np.cos(radians), axis=axis)
+    # arctan2 is in [-180, 180], and e.g. -1e-14 % 360 would be 360
+    mean = (np.rad2deg(np.arctan2(sin, cos)) + 360) % 360
+    return np.where(np.hypot(sin, cos) < 1e-9, np.nan, mean)
+
+
+class WeatherCube:
+    """A memory-mapped weather cube and its index."""
+
+    def __init__(self, values, index):
+        self.values = values
+        self.sensor_ids = np.asarray(index["sensor-ids"])
+        self.first_hour_key = index["first-hour-key"]
+        self.variables = list(index["variables"])
+
+    @property
+    def hour_keys(self):
+        return np.arange(
+            self.first_hour_key, self.first_hour_key + self.values.shape[1]
+        )
+
+    def _stations(self, sensor_ids):
+        if sensor_ids is None:
+            return slice(None)
+        sensor_ids = np.atleast_1d(sensor_ids)
+        stations = np.searchsorted(self.sensor_ids, sensor_ids)
+        stations = np.minimum(stations, len(self.sensor_ids) - 1)
+        unknown = sensor_ids[self.sensor_ids[stations] != sensor_ids]
+        if len(unknown):
+            raise KeyError("Unknown weather sensor ids: {}".format(unknown.tolist()))
+        return stations
+
+    def _hours(self, start, end):
+        # 'start' and 'end' are included and clipped to the cube
+        n_hours = self.values.shape[1]
+        first = 0 if start is None else to_hour_key(start) - self.first_hour_key
+        last = n_hours - 1 if end is None else to_hour_key(end) - self.first_hour_key
+        return slice(max(first, 0), max(min(last, n_hours - 1) + 1, 0))
+
+    def select(self, sensor_ids=None, start=None, end=None, variables=None):
+        """Return a CubeSlice of the given stations, hours and variables.
+
+        Only the selected stations and hours are read from the file.
+        """
+        stations = self._stations(sensor_ids)
+        hours = self._hours(start, end)
+        columns = [
+            self.variables.index(variable) for variable in (variables or self.variables)
+        ]
+        return CubeSlice(
+            values=np.asarray(self.values[stations, hours][:, :, columns]),
+            sensor_ids=self.sensor_ids[stations],
+            hour_keys=self.hour_keys[hours],
+            variables=[self.variables[column] for column in columns],
+        )
+
+    def mean(self, sensor_ids=None, start=None, end=None, over="stations"):
+        """Mean over the stations (per hour) or over the hours (per station).
+
+        Returns a DataFrame indexed by 'hour-key' or by 'sensor-id' with one
+        column per variable. Angles are averaged with circular_mean().
+        """
+        selected = self.select(sensor_ids, start, end)
+        axis = {"stations": 0, "hours": 1}[over]
+        means = {}
+        with warnings.catch_warnings():
+            # the mean of a station or hour without observations is NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for i, variable in enumerate(selected.variables):
+                values = selected.values[:, :, i].astype("f8")
+                if variable in ANGLE_VARIABLES:
+                    means[variable] = circular_mean(values, axis=axis)
+                else:
+                    means[variable] = np.nanmean(values, axis=axis)
+        if over == "stations":
+            index = pd.Index(selected.hour_keys, name="hour-key")
+        else:
+            index = pd.Index(selected.sensor_ids, name="sensor-id")
+        return pd.DataFrame(means, index=index)
+
+
+def load_cube(derived_dir=DERIVED_DIR):
+    """Memory-map the weather cube under 'derived_dir'."""
+    derived_dir = Path(derived_dir)
+    with open(derived_dir / INDEX_FILE, encoding="utf-8") as f:
+        index = json.load(f)
+    values = np.load(derived_dir / CUBE_FILE, mmap_mode="r")
+    expected = (len(index["sensor-ids"]), index["n-hours"], len(index["variables"]))
+    if values.shape != expected:
+        raise ValueError(
+            "'{}' has shape {}, its index expects {}".format(
+                derived_dir / CUBE_FILE, values.shape, expected
+            )
+        )
+    return WeatherCube(values, index)
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.db_layout import hour_keys
+
+
+def hourly_frame(start, n_hours):
+    # the time columns of the hourly datasets, from 'start' on
+    date_times = pd.Series(pd.date_range(start, periods=n_hours, freq="h"))
+    return pd.DataFrame(
+        {
+            "hour-key": hour_keys(date_times),
+            "day": date_times.dt.day,
+            "month": date_times.dt.month,
+            "year": date_times.dt.year,
+            "hour": date_times.dt.hour,
+            "weekday": date_times.dt.weekday,
+        }
+    )
+
+
+def make_datasets(n_hours=24 * 45, seed=0):
+    """Small cleaned datasets, as DataFrames, in the shape of clean_raw.py's."""
+    rng = np.random.default_rng(seed)
+    passengers = hourly_frame("2020-01-01", n_hours)
+    passengers["n-passengers"] = pd.array(rng.integers(0, 5000, n_hours), dtype="Int64")
+    # a few missing hours
+    passengers.loc[rng.choice(n_hours, 20, replace=False), "n-passengers"] = pd.NA
+
+    weather = hourly_frame("2020-01-01", n_hours)
+    for col, scale in [
+        ("avg-temp", 10),
+        ("avg-humidity", 80),
+        ("avg-precip", 1),
+        ("avg-wind", 5),
+        ("avg-winddir", 360),
+    ]:
+        weather[col] = rng.random(n_hours) * scale
+    weather.loc[rng.choice(n_hours, 20, replace=False), "avg-temp"] = np.nan
+
+    per_line = passengers.loc[:, ["hour-key"]].merge(
+        pd.DataFrame({"line-id": [1, 2]}), how="cross"
+    )
+    per_line["transfer-type-id"] = 1
+    per_line["n-passengers"] = rng.integers(0, 2500, len(per_line))
+
+    return {
+        "ferry-lines": pd.DataFrame(
+            {
+                "id": [1, 2],
+                "line-name": ["Kadıköy - Karaköy", "Bosphorus Line"],
+                "shape-data": [
+                    "LINESTRING (29.02 40.99, 29.0 41.0, 28.975 41.02)",
+                    "MULTILINESTRING ((28.98 41.02, 29.01 41.05, 29.05 41.1), "
+                    "(29.05 41.1, 29.07 41.15))",
+                ],
+            }
+        ),
+        "ferry-terminals": pd.DataFrame(
+            {
+                "id": [1, 2, 3],
+                "terminal-name": ["Kadıköy", "Karaköy", "Sarıyer"],
+                "shape-data": [
+                    "POINT (29.02 40.99)",
+                    "POINT (28.975 41.02)",
+                    "POINT (29.06 41.17)",
+                ],
+            }
+        ),
+        "terminals-lines": pd.DataFrame(
+            {
+                "terminal-id": [1, 2, 2, 3],
+                "terminal-name": ["Kadıköy", "Karaköy", "Karaköy", "Sarıyer"],
+                "has-line": ["Kadıköy - Karaköy"] * 2 + ["Bosphorus Line"] * 2,
+                "line-id": [1, 1, 2, 2],
+            }
+        ),
+        "trips-per-ferry-line": pd.DataFrame(
+            {
+                "year": [2020, 2020],
+                "line-name": ["Kadıköy - Karaköy", "Bosphorus Line"],
+                "n-trips": [1200, 800],
+            }
+        ),
+        "transportation-load": passengers,
+        "load-lines": pd.DataFrame(
+            {"id": [1, 2], "line-name": ["A", "B"], "ferry-line-id": [1, None]}
+        ),
+        "transfer-types": pd.DataFrame({"id": [1], "transfer-type": ["Normal"]}),
+        "transportation-load-per-line": per_line,
+        "weather-sensors": pd.DataFrame(
+            {
+                "id": [1, 2, 3, 4],
+                "sensor-name": ["AKOM", "Beykoz", "Kamiloba", "Pendik"],
+                "shape-data": [
+                    "POINT (29.01 41.0)",
+                    "POINT (29.09 41.13)",
+                    "POINT (28.7 41.0)",
+                    "POINT (29.23 40.88)",
+                ],
+            }
+        ),
+        "weather-observations": weather,
+    }
+
+
+def to_arrow_tables(datasets):
+    from src.intermediate import to_arrow_table
+
+    return {name: to_arrow_table(name, dataset) for name, dataset in datasets.items()}
+
+
+@pytest.fixture
+def datasets():
+    return make_datasets()
+
+
+@pytest.fixture
+def db_path(tmp_path, datasets):
+    """A database built by build_db() from the small cleaned datasets."""
+    from src.processing.create_db import build_db
+
+    path = tmp_path / "db.sqlite3"
+    build_db(to_arrow_tables(datasets), db_path=path, dump_path=None)
+    return path
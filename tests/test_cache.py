@@ -0,0 +1,74 @@
+import os
+import time
+
+import pandas as pd
+
+from src.cleaning.cache import STALE_TMP_AGE, ParsedFrameCache
+
+
+def write_raw(path, text):
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def parse(path):
+    return pd.read_csv(path)
+
+
+def test_reuses_entry_until_the_content_changes(tmp_path):
+    cache = ParsedFrameCache(cache_dir=tmp_path / "cache")
+    raw = write_raw(tmp_path / "month.csv", "a,b\n1,2\n")
+    calls = []
+
+    def counting_parse(path):
+        calls.append(path)
+        return parse(path)
+
+    first = cache.load_or_parse(raw, "stage", counting_parse)
+    second = cache.load_or_parse(raw, "stage", counting_parse)
+    pd.testing.assert_frame_equal(first, second)
+    assert len(calls) == 1
+
+    write_raw(raw, "a,b\n3,4\n")
+    assert cache.load_or_parse(raw, "stage", counting_parse)["a"].tolist() == [3]
+    assert len(calls) == 2
+    # the entry of the old content was evicted
+    assert len(list((tmp_path / "cache").glob("*.feather"))) == 1
+
+
+def test_evict_stale_with_dashes_in_names(tmp_path):
+    cache = ParsedFrameCache(cache_dir=tmp_path / "cache", version=2)
+    live = write_raw(tmp_path / "live--2020.csv", "a\n1\n")
+    gone = write_raw(tmp_path / "gone--2020.csv", "a\n1\n")
+    cache.load_or_parse(live, "load--ferries", parse)
+    cache.load_or_parse(gone, "load--ferries", parse)
+    cache.load_or_parse(gone, "other", parse)
+    # an old version's entry, and a file that isn't an entry at all
+    old = cache.cache_dir / "load--ferries--live--2020.csv--{}--v1.feather".format(
+        "0" * 32
+    )
+    old.touch()
+    foreign = tmp_path / "cache" / "not--an--entry.feather"
+    foreign.touch()
+
+    cache.evict_stale(stage="load--ferries", live_paths=[live])
+    names = sorted(path.name for path in (tmp_path / "cache").iterdir())
+    assert len(names) == 3
+    assert any(name.startswith("load--ferries--live--2020.csv--") for name in names)
+    assert any(name.startswith("other--gone--2020.csv--") for name in names)
+    assert "not--an--entry.feather" in names
+
+
+def test_evict_stale_removes_old_tmp_files(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    old_tmp = cache_dir / "stage--a.csv--{}--v3.feather.123.tmp".format("0" * 32)
+    new_tmp = cache_dir / "stage--b.csv--{}--v3.feather.456.tmp".format("0" * 32)
+    old_tmp.touch()
+    new_tmp.touch()
+    past = time.time() - STALE_TMP_AGE - 60
+    os.utime(old_tmp, (past, past))
+
+    ParsedFrameCache(cache_dir=cache_dir).evict_stale()
+    assert not old_tmp.exists()
+    assert new_tmp.exists()
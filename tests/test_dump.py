@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+from src.processing.dump import dump_db, restore_db, schema_objects
+from src.processing.spatial import GEOMETRY_TABLES, dump_statements, within_bbox
+
+
+def table_contents(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        tables, others = schema_objects(conn)
+        contents = {
+            table: sorted(
+                conn.execute('SELECT * FROM "{}"'.format(table)).fetchall(),
+                key=repr,
+            )
+            for table, _ in tables
+        }
+        (user_version,) = conn.execute("PRAGMA user_version").fetchone()
+    finally:
+        conn.close()
+    return contents, sorted(others), user_version
+
+
+def assert_same_db(left, right):
+    left_contents, left_others, left_version = table_contents(left)
+    right_contents, right_others, right_version = table_contents(right)
+    assert left_contents.keys() == right_contents.keys()
+    for table in left_contents:
+        assert left_contents[table] == right_contents[table], table
+    assert left_others == right_others
+    assert left_version == right_version
+
+
+def assert_rtrees_work(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        for table in GEOMETRY_TABLES:
+            assert len(within_bbox(conn, table, (28.0, 40.0, 30.0, 42.0)))
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_per_table_dump_round_trip(tmp_path, db_path, compression):
+    dump_dir = tmp_path / "dump"
+    n_rows = dump_db(db_path, dump_dir, compression, max_workers=2, batch_size=100)
+    assert n_rows["transportation-load"] == 24 * 45
+
+    restored = tmp_path / "restored.sqlite3"
+    restore_db(dump_dir, restored)
+    assert_same_db(db_path, restored)
+    assert_rtrees_work(restored)
+
+
+def test_restore_refuses_to_overwrite(tmp_path, db_path):
+    dump_db(db_path, tmp_path / "dump", max_workers=1)
+    with pytest.raises(FileExistsError):
+        restore_db(tmp_path / "dump", db_path)
+
+
+def test_single_file_dump_round_trip(tmp_path, db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        script = "\n".join(dump_statements(conn))
+    finally:
+        conn.close()
+
+    restored = tmp_path / "restored.sqlite3"
+    conn = sqlite3.connect(restored)
+    try:
+        conn.executescript(script)
+    finally:
+        conn.close()
+    contents, _, _ = table_contents(db_path)
+    restored_contents, _, _ = table_contents(restored)
+    assert contents == restored_contents
+    assert_rtrees_work(restored)
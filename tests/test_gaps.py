@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cleaning.gaps import coverage_by_month, fill_hourly_gaps, hour_range
+from src.db_layout import to_hour_key
+
+
+def hourly(start, end, drop=()):
+    date_times = pd.date_range(start, end, freq="h")
+    dataset = pd.DataFrame(
+        {"DATE_TIME": date_times, "value": np.arange(len(date_times))}
+    )
+    return dataset.drop(index=list(drop)).reset_index(drop=True)
+
+
+def test_range_of_the_data_by_default():
+    dataset = hourly("2020-05-03 04:00", "2020-05-20 12:00")
+    filled, coverage = fill_hourly_gaps(dataset)
+    assert filled["DATE_TIME"].iloc[0] == pd.Timestamp("2020-05-03 04:00")
+    assert filled["DATE_TIME"].iloc[-1] == pd.Timestamp("2020-05-20 12:00")
+    assert coverage[["year", "month", "n-missing"]].values.tolist() == [[2020, 5, 0]]
+
+
+def test_whole_years():
+    keys = pd.Series([to_hour_key("2020-05-03 04:00"), to_hour_key("2021-02-01")])
+    first, last = hour_range(keys, whole_years=True)
+    assert first == to_hour_key("2020-01-01 00:00")
+    assert last == to_hour_key("2021-12-31 23:00")
+    # an explicit start or end wins over the padding
+    assert hour_range(keys, start="2020-06-01", whole_years=True) == (
+        to_hour_key("2020-06-01"),
+        last,
+    )
+
+
+def test_start_and_end():
+    dataset = hourly("2020-05-01", "2020-05-10")
+    filled, _ = fill_hourly_gaps(dataset, start="2020-04-30 22:00", end="2020-05-02")
+    assert len(filled) == 27
+    assert filled["value"].isna().sum() == 2
+    assert filled["value"].iloc[2] == 0
+    with pytest.raises(ValueError):
+        hour_range(pd.Series([0, 1]), start="2020-05-02", end="2020-05-01")
+
+
+def test_missing_hours_are_filled_and_counted():
+    # hours 10-12 and 40 missing
+    dataset = hourly("2020-01-31 00:00", "2020-02-02 23:00", drop=[10, 11, 12, 40])
+    filled, coverage = fill_hourly_gaps(dataset.sample(frac=1.0, random_state=0))
+    assert len(filled) == 72
+    assert filled["DATE_TIME"].is_monotonic_increasing
+    assert filled["value"].isna().to_numpy().nonzero()[0].tolist() == [10, 11, 12, 40]
+    assert coverage.values.tolist() == [
+        [2020, 1, 24, 3, 1, 3],
+        [2020, 2, 48, 1, 1, 1],
+    ]
+
+
+def test_gaps_count_in_the_month_they_start():
+    keys = pd.RangeIndex(
+        to_hour_key("2020-01-31 22:00"), to_hour_key("2020-02-01 02:00")
+    )
+    missing = np.array([False, True, True, True])
+    coverage = coverage_by_month(keys, missing)
+    assert coverage[["n-missing", "n-gaps", "longest-gap"]].values.tolist() == [
+        [1, 1, 3],
+        [2, 0, 0],
+    ]
+
+
+def test_invalid_datasets():
+    with pytest.raises(ValueError):
+        fill_hourly_gaps(hourly("2020-01-01", "2020-01-01 00:00").iloc[:0])
+    dataset = hourly("2020-01-01", "2020-01-01 02:00")
+    with pytest.raises(ValueError):
+        fill_hourly_gaps(pd.concat([dataset, dataset]))
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.db_layout import hour_keys, to_hour_key
+from src.helper_functions import convert_coord, parse_coords
+
+
+@pytest.mark.parametrize(
+    "coord_str, lat, lon",
+    [
+        # degrees and minutes, with and without the minute glyph
+        ("41⁰ 6’ N, 28⁰ 5 E", 41.1, 28 + 5 / 60),
+        ("41⁰ 5’ N, 29⁰ 9’ E", 41 + 5 / 60, 29.15),
+        # degrees, minutes and seconds
+        ("40⁰ 59′ 35.79″ N, 28⁰ 49′ 3.55″ E", 40.99327500, 28.81765278),
+        ("41°12'24.00\"N, 29°6'36.00\"E", 41.20666667, 29.11),
+        ("41°12\\'24\\\"N,29°6'36\"E", 41.20666667, 29.11),
+        # southern and western hemispheres
+        ("33⁰ 30’ S, 70⁰ 45’ W", -33.5, -70.75),
+        # longitude first
+        ("28⁰ 49′ 3.55″ E, 40⁰ 59′ 35.79″ N", 40.99327500, 28.81765278),
+    ],
+)
+def test_parse_coords(coord_str, lat, lon):
+    coords = parse_coords([coord_str])
+    np.testing.assert_allclose(coords.lat, [lat], atol=1e-8)
+    np.testing.assert_allclose(coords.lon, [lon], atol=1e-8)
+    assert len(coords.invalid) == 0
+
+
+def test_invalid_coords_are_reported():
+    coords = parse_coords(
+        [
+            "41⁰ 6’ N, 28⁰ 5 E",
+            "garbage",
+            "",
+            None,
+            np.nan,
+            # two latitudes
+            "41⁰ 6’ N, 40⁰ 5’ S",
+            # no hemisphere
+            "41⁰ 6’, 28⁰ 5’",
+            "41⁰ 6’ N",
+        ]
+    )
+    assert coords.invalid.tolist() == [1, 2, 3, 4, 5, 6, 7]
+    assert np.isnan(coords.lat[1:]).all() and np.isnan(coords.lon[1:]).all()
+    assert not np.isnan(coords.lat[0])
+
+
+@pytest.mark.parametrize(
+    "path, sep, column, from_format",
+    [
+        (
+            "data/raw/geolocation/automated-weather-stations-geoloc.csv",
+            ";",
+            2,
+            "degrees_minutes",
+        ),
+        (
+            "data/raw/geolocation/icing-sensors-geoloc.csv",
+            ",",
+            3,
+            "degrees_minutes_seconds",
+        ),
+    ],
+)
+def test_same_result_as_the_per_string_parsers(path, sep, column, from_format):
+    coord_strs = pd.read_csv(path, sep=sep).iloc[:, column].dropna()
+    coord_strs = coord_strs[coord_strs.str.contains(",")]
+    coords = parse_coords(coord_strs)
+    assert len(coords.invalid) == 0
+
+    for coord_str, lat, lon in zip(coord_strs, coords.lat, coords.lon):
+        expected_lat, expected_lon = [
+            convert_coord(part.strip(), from_format, "degrees")
+            for part in coord_str.split(",")
+        ]
+        assert lat == pytest.approx(expected_lat)
+        assert lon == pytest.approx(expected_lon)
+
+
+def test_hour_keys():
+    date_times = pd.Series(pd.to_datetime(["1970-01-01 00:00", "2020-05-01 13:45"]))
+    assert hour_keys(date_times).tolist() == [0, to_hour_key("2020-05-01 13:00")]
+    assert to_hour_key("1970-01-02 01:59") == 25
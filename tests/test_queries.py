@@ -0,0 +1,141 @@
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_datasets, to_arrow_tables
+from src import queries
+from src.processing.create_db import build_db
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    queries.clear_cache()
+    yield
+    queries.close_pools()
+
+
+def test_passengers_and_weather(db_path, datasets):
+    result = queries.passengers("2020-01-02", "2020-01-03", db_path=db_path)
+    expected = datasets["transportation-load"].iloc[24:48]
+    assert result["hour-key"].tolist() == expected["hour-key"].tolist()
+    np.testing.assert_array_equal(
+        result["n-passengers"].to_numpy(dtype="f8"),
+        expected["n-passengers"].to_numpy(dtype="f8", na_value=np.nan),
+    )
+
+    weather = queries.weather("2020-01-01", "2020-01-01 06:00", db_path=db_path)
+    assert len(weather) == 6
+    assert list(weather.columns[-5:]) == [
+        "avg-temp",
+        "avg-humidity",
+        "avg-precip",
+        "avg-wind",
+        "avg-winddir",
+    ]
+
+
+def test_terminal_lines_and_rollups(db_path):
+    assert queries.terminal_lines(2, db_path=db_path)["id"].tolist() == [1, 2]
+    monthly = queries.rollup("transportation-load", "monthly", db_path=db_path)
+    assert monthly["month"].tolist() == [1, 2]
+    with pytest.raises(ValueError):
+        queries.rollup("transportation-load", "yearly", db_path=db_path)
+
+
+def test_line_shapes_by_scale(db_path):
+    assert (queries.line_shapes(db_path=db_path)["level"] == 0).all()
+    assert (queries.line_shapes(scale=30, db_path=db_path)["level"] == 2).all()
+    assert (queries.line_shapes(scale=1e6, db_path=db_path)["level"] == 4).all()
+    shapes = queries.line_shapes(zoom=16, db_path=db_path)
+    assert shapes["shape-data"].notna().all()
+
+
+def test_results_are_cached_per_db_content(tmp_path, db_path):
+    hits = queries.cache_info()["hits"]
+    first = queries.passengers("2020-01-01", "2020-01-02", db_path=db_path)
+    queries.passengers("2020-01-01", "2020-01-02", db_path=db_path)
+    assert queries.cache_info()["hits"] == hits + 1
+
+    # a rebuilt DB with other contents is never served from the cache
+    build_db(to_arrow_tables(make_datasets(seed=1)), db_path=db_path, dump_path=None)
+    second = queries.passengers("2020-01-01", "2020-01-02", db_path=db_path)
+    assert queries.cache_info()["hits"] == hits + 1
+    assert not first.equals(second)
+
+
+def test_returned_results_are_copies(db_path):
+    result = queries.passengers("2020-01-01", "2020-01-02", db_path=db_path)
+    result.loc[:, "n-passengers"] = -1
+    again = queries.passengers("2020-01-01", "2020-01-02", db_path=db_path)
+    assert (again["n-passengers"].dropna() >= 0).all()
+
+
+def test_chunks_are_read_in_batches(db_path, monkeypatch):
+    monkeypatch.setattr(queries, "BATCH_ROWS", 100)
+    expected = queries.weather("2020-01-01", "2020-02-01", db_path=db_path)
+    queries.clear_cache()
+    # more open iterators than pooled connections: none of them holds one
+    iterators = [
+        queries.weather("2020-01-01", "2020-02-01", db_path=db_path, chunk_rows=30)
+        for _ in range(queries.POOL_SIZE + 2)
+    ]
+    firsts = [next(iterator) for iterator in iterators]
+    for first, iterator in zip(firsts, iterators):
+        chunks = [first, *iterator]
+        # 3 chunks of 30 rows per batch of 90
+        assert [len(chunk) for chunk in chunks[:4]] == [30] * 4
+        result = pd.concat(chunks, ignore_index=True)
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_a_rebuild_between_batches_fails_the_read(db_path, monkeypatch):
+    monkeypatch.setattr(queries, "BATCH_ROWS", 100)
+    chunks = queries.weather(
+        "2020-01-01", "2020-02-01", db_path=db_path, chunk_rows=100
+    )
+    next(chunks)
+    build_db(to_arrow_tables(make_datasets(seed=1)), db_path=db_path, dump_path=None)
+    with pytest.raises(RuntimeError):
+        next(chunks)
+
+
+def test_queries_wait_for_a_writer(db_path):
+    writer = sqlite3.connect(db_path, check_same_thread=False)
+    writer.execute("BEGIN EXCLUSIVE")
+    writer.execute('DELETE FROM "transportation-load" WHERE "hour-key" < 0')
+
+    def commit_later():
+        time.sleep(0.3)
+        writer.commit()
+
+    thread = threading.Thread(target=commit_later)
+    thread.start()
+    start = time.perf_counter()
+    result = queries.passengers("2020-01-01", "2020-01-02", db_path=db_path)
+    thread.join()
+    writer.close()
+    assert len(result) == 24
+    assert time.perf_counter() - start >= 0.2
+
+
+def test_missing_db(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        queries.passengers("2020-01-01", "2020-01-02", db_path=tmp_path / "no.db")
+
+
+def test_import_does_not_load_the_build_code():
+    # pandas may import pyarrow itself, so only the repo's modules and shapely
+    # are checked
+    code = (
+        "import sys, src.queries; "
+        "assert not [m for m in sys.modules if m.startswith('src.processing')]; "
+        "assert 'src.intermediate' not in sys.modules; "
+        "assert 'shapely' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cleaning.clean_raw import (
+    DASH_REPL,
+    HAS_LINE_REPAIR,
+    HAS_LINE_REPL,
+    LINE_NAME_REPAIR,
+    LINE_NAME_REPL,
+    TRIPS_LINE_NAME_REPAIR,
+    TRIPS_LINE_NAME_REPL,
+    import_dicts,
+)
+from src.cleaning.repair import ReplacementEngine
+
+
+def replace_loop(series, rules):
+    # the former cleaning code: one str.replace() over the column per rule
+    for pat, repl in rules:
+        series = series.str.replace(pat, repl, regex=True)
+    return series
+
+
+def raw_column(tag, column):
+    (import_dict,) = [d for d in import_dicts if d["tag"] == tag]
+    dataset = pd.read_csv(
+        import_dict["path"],
+        encoding=import_dict["encoding"],
+        sep=import_dict["sep"],
+        skiprows=import_dict["skiprows"],
+        names=import_dict["headers"],
+        # a few raw ferry-lines rows have an extra field; only the names are
+        # needed here
+        on_bad_lines="skip",
+    )
+    return dataset[column]
+
+
+@pytest.mark.parametrize(
+    "engine, rules, tag",
+    [
+        (HAS_LINE_REPAIR, [*HAS_LINE_REPL.items(), DASH_REPL], "ferry-terminals"),
+        (LINE_NAME_REPAIR, [*LINE_NAME_REPL.items(), DASH_REPL], "ferry-lines"),
+        (
+            TRIPS_LINE_NAME_REPAIR,
+            [(pat.upper(), repl) for pat, repl in TRIPS_LINE_NAME_REPL.items()],
+            "trips-per-ferry-line",
+        ),
+    ],
+)
+def test_same_result_as_the_replace_loop(engine, rules, tag):
+    column = "has-line" if tag == "ferry-terminals" else "line-name"
+    raw = raw_column(tag, column)
+    # the raw values, the patterns themselves and values no rule changes
+    series = pd.concat(
+        [
+            raw,
+            pd.Series([pat for pat, _ in rules if isinstance(pat, str)]),
+            pd.Series(["Kadýköy-Beþiktaþ", "unchanged", "", np.nan, None]),
+        ],
+        ignore_index=True,
+    )
+    pd.testing.assert_series_equal(engine.apply(series), replace_loop(series, rules))
+
+
+def test_rules_chain_in_order():
+    engine = ReplacementEngine({"a": "b", "b": "c"})
+    assert engine.repair("a") == "c"
+    engine = ReplacementEngine({"b": "c", "a": "b"})
+    assert engine.repair("a") == "b"
+
+
+def test_non_strings_become_nan():
+    engine = ReplacementEngine({"a": "b"})
+    repaired = engine.apply(pd.Series(["a", 1, None, np.nan], dtype=object))
+    assert repaired[0] == "b"
+    assert repaired[1:].isna().all()
@@ -0,0 +1,139 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_datasets, to_arrow_tables
+from src.processing.create_db import build_db, bulk_load
+from src.db_layout import GRAINS, ROLLUP_SOURCES, rollup_name
+from src.processing.rollups import refresh_rollups
+
+ROLLUPS = [rollup_name(table, grain) for table in ROLLUP_SOURCES for grain in GRAINS]
+
+
+def first_hours(datasets, n_hours):
+    # the datasets as they were before the later hours were added
+    datasets = dict(datasets)
+    for table in ROLLUP_SOURCES:
+        datasets[table] = datasets[table].iloc[:n_hours]
+    return datasets
+
+
+def read_rollups(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return {
+            name: pd.read_sql_query('SELECT * FROM "{}"'.format(name), conn)
+            for name in ROLLUPS
+        }
+
+
+def assert_same_rollups(left, right):
+    for name in ROLLUPS:
+        pd.testing.assert_frame_equal(left[name], right[name], check_exact=False)
+
+
+def build(datasets, path):
+    build_db(to_arrow_tables(datasets), db_path=path, dump_path=None)
+    return path
+
+
+def test_incremental_refresh_matches_a_full_build(tmp_path, datasets):
+    incremental = build(first_hours(datasets, 24 * 20), tmp_path / "inc.sqlite3")
+    build(datasets, incremental)
+    full = build(datasets, tmp_path / "full.sqlite3")
+    assert_same_rollups(read_rollups(incremental), read_rollups(full))
+
+
+def load(path, datasets):
+    # bulk_load() into an existing DB, and the refresh that follows it
+    conn = sqlite3.connect(path)
+    try:
+        bulk_load(conn, to_arrow_tables(datasets))
+        return refresh_rollups(conn)
+    finally:
+        conn.close()
+
+
+def test_only_changed_hours_are_aggregated(tmp_path, datasets):
+    n_hours = 24 * 20
+    path = build(first_hours(datasets, n_hours), tmp_path / "db.sqlite3")
+    assert load(path, first_hours(datasets, n_hours)) == {
+        table: 0 for table in ROLLUP_SOURCES
+    }
+    assert load(path, datasets) == {
+        table: len(datasets[table]) - n_hours for table in ROLLUP_SOURCES
+    }
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM "rollup-changes"').fetchone() == (0,)
+
+
+def test_an_unchanged_load_reads_no_hours(tmp_path, datasets):
+    # the work of the refresh doesn't grow with the history
+    n_steps = []
+    for n_days in [10, 45]:
+        hours = first_hours(datasets, 24 * n_days)
+        path = build(hours, tmp_path / "{}.sqlite3".format(n_days))
+        conn = sqlite3.connect(path)
+        try:
+            bulk_load(conn, to_arrow_tables(hours))
+            steps = []
+            conn.set_progress_handler(lambda: steps.append(1) and 0, 1)
+            assert refresh_rollups(conn) == {table: 0 for table in ROLLUP_SOURCES}
+            n_steps.append(len(steps))
+        finally:
+            conn.close()
+    assert n_steps[0] == n_steps[1]
+
+
+def test_changed_and_deleted_hours(tmp_path, datasets):
+    path = build(datasets, tmp_path / "db.sqlite3")
+    changed = first_hours(datasets, len(datasets["transportation-load"]) - 30)
+    for table, variable in [
+        ("transportation-load", "n-passengers"),
+        ("weather-observations", "avg-wind"),
+    ]:
+        changed[table] = changed[table].copy()
+        changed[table].loc[100, variable] = changed[table].loc[100, variable] * 2
+    assert load(path, changed) == {table: 31 for table in ROLLUP_SOURCES}
+    full = build(changed, tmp_path / "full.sqlite3")
+    assert_same_rollups(read_rollups(path), read_rollups(full))
+
+
+def test_changed_earlier_hours_rebuild_the_rollups(tmp_path, datasets):
+    path = build(datasets, tmp_path / "db.sqlite3")
+    changed = make_datasets(seed=1)
+    build(changed, path)
+    full = build(changed, tmp_path / "full.sqlite3")
+    assert_same_rollups(read_rollups(path), read_rollups(full))
+
+
+@pytest.mark.parametrize(
+    "table, variable",
+    [("transportation-load", "n-passengers"), ("weather-observations", "avg-temp")],
+)
+def test_monthly_rollup_matches_pandas(tmp_path, datasets, table, variable):
+    path = build(first_hours(datasets, 24 * 20), tmp_path / "db.sqlite3")
+    build(datasets, path)
+    rollup = read_rollups(path)[rollup_name(table, "monthly")].set_index(
+        ["year", "month"]
+    )
+
+    hours = datasets[table].astype({variable: "float64"})
+    grouped = hours.groupby(["year", "month"])[variable]
+    expected = pd.DataFrame(
+        {
+            "hours": grouped.size(),
+            "sum": grouped.sum(),
+            "mean": grouped.mean(),
+            "min": grouped.min(),
+            "max": grouped.max(),
+            "count": grouped.count(),
+        }
+    )
+    expected["missing"] = expected["hours"] - expected["count"]
+    for stat in expected:
+        col = stat if stat == "hours" else "{}-{}".format(variable, stat)
+        np.testing.assert_allclose(
+            rollup[col].to_numpy(dtype="f8"), expected[stat].to_numpy(dtype="f8")
+        )
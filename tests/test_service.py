@@ -0,0 +1,287 @@
+import asyncio
+import http.client
+import io
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from conftest import make_datasets, to_arrow_tables
+from src import queries, service
+from src.processing.create_db import build_db
+
+
+@contextmanager
+def serving(db_path):
+    """A QueryService on a free localhost port, served from another thread."""
+    queries.clear_cache()
+    query_service = service.QueryService(db_path, workers=2)
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(service.start_server(query_service, port=0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    host, port = server.sockets[0].getsockname()[:2]
+    try:
+        yield query_service, host, port
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        # let the handlers of closed connections finish before closing the loop
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        loop.close()
+        query_service.close()
+
+
+@pytest.fixture
+def server(db_path):
+    with serving(db_path) as served:
+        yield served
+
+
+@pytest.fixture
+def year_db_path(tmp_path):
+    # a year of hours: a stream of its weather doesn't fit in the socket buffers
+    path = tmp_path / "year.sqlite3"
+    build_db(
+        to_arrow_tables(make_datasets(n_hours=24 * 366)), db_path=path, dump_path=None
+    )
+    return path
+
+
+def get(server, path, method="GET", **params):
+    _, host, port = server
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        conn.request(method, "{}?{}".format(path, urlencode(params)))
+        response = conn.getresponse()
+        return response.status, response.getheaders(), response.read()
+    finally:
+        conn.close()
+
+
+def test_json(server, datasets):
+    status, headers, body = get(
+        server, "/passengers", start="2020-01-01", end="2020-01-02"
+    )
+    assert status == 200
+    records = json.loads(body)
+    assert [r["hour-key"] for r in records] == datasets["transportation-load"][
+        "hour-key"
+    ].iloc[:24].tolist()
+
+
+def test_ndjson_is_chunked(server):
+    status, headers, body = get(
+        server,
+        "/weather",
+        start="2020-01-01",
+        end="2020-01-05",
+        format="ndjson",
+        **{"chunk-rows": 10}
+    )
+    assert status == 200
+    assert ("Transfer-Encoding", "chunked") in headers
+    lines = body.decode("utf-8").splitlines()
+    assert len(lines) == 96
+    assert json.loads(lines[0])["hour-key"] == 438288
+
+
+def test_arrow_is_sent_batch_by_batch(server, db_path):
+    status, _, body = get(
+        server,
+        "/weather",
+        start="2020-01-01",
+        end="2020-01-31",
+        format="arrow",
+        **{"chunk-rows": 100}
+    )
+    assert status == 200
+    reader = pa.ipc.open_stream(body)
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [100] * 7 + [20]
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    expected = queries.weather("2020-01-01", "2020-01-31", db_path=db_path)
+    pd.testing.assert_frame_equal(table.to_pandas(), expected)
+
+
+def test_arrow_geometries_are_wkb(server):
+    status, _, body = get(server, "/line-shapes", format="arrow", zoom=11)
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.schema.field("shape-data").type == pa.binary()
+    assert table.num_rows == 2
+
+
+def test_arrow_stream_settles_the_schema_on_typed_chunks():
+    chunks = [
+        pd.DataFrame({"a": [1, 2], "b": [None, None]}),
+        pd.DataFrame({"a": [3, 4], "b": [None, 0.5]}),
+        pd.DataFrame({"a": [5.0, np.nan], "b": [None, None]}),
+    ]
+    encoded = list(service.arrow_stream(iter(chunks)))
+    # the first chunk waits for the type of 'b'
+    assert len(encoded) == 4
+    table = pa.ipc.open_stream(b"".join(encoded)).read_all()
+    assert table.schema == pa.schema([("a", pa.int64()), ("b", pa.float64())])
+    assert table.column("a").to_pylist() == [1, 2, 3, 4, 5, None]
+
+
+def test_arrow_stream_of_only_nulls():
+    encoded = b"".join(service.arrow_stream(iter([pd.DataFrame({"a": [None]})])))
+    table = pa.ipc.open_stream(encoded).read_all()
+    assert table.schema.field("a").type == pa.null()
+    assert table.num_rows == 1
+
+
+def test_empty_results(server):
+    for output_format in ["json", "ndjson", "arrow"]:
+        status, _, body = get(
+            server,
+            "/passengers",
+            start="1999-01-01",
+            end="1999-01-02",
+            format=output_format,
+        )
+        assert status == 200
+    assert pa.ipc.open_stream(body).read_all().num_rows == 0
+
+
+@pytest.mark.parametrize(
+    "path, params, status",
+    [
+        ("/passengers", {"start": "2020-01-01"}, 400),
+        ("/passengers", {"start": "not a date", "end": "2020-01-02"}, 400),
+        (
+            "/passengers",
+            {"start": "2020-01-01", "end": "2020-01-02", "format": "x"},
+            400,
+        ),
+        ("/rollups", {"table": "weather-observations", "grain": "yearly"}, 400),
+        ("/line-shapes", {"scale": "abc", "format": "arrow"}, 400),
+        ("/nothing", {}, 404),
+    ],
+)
+def test_errors(server, path, params, status):
+    response_status, _, body = get(server, path, **params)
+    assert response_status == status
+    assert "error" in json.loads(body)
+
+
+def test_only_get(server):
+    status, _, _ = get(server, "/health", method="POST")
+    assert status == 405
+
+
+def test_failure_after_the_head_cuts_the_response(server, monkeypatch):
+    def failing_stream(chunks):
+        yield b'{"first": 1}\n'
+        raise RuntimeError("lost the DB")
+
+    monkeypatch.setattr(service, "ndjson_stream", failing_stream)
+    _, host, port = server
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.request("GET", "/passengers?start=2020-01-01&end=2020-01-02&format=ndjson")
+    response = conn.getresponse()
+    assert response.status == 200
+    with pytest.raises(http.client.IncompleteRead) as e:
+        response.read()
+    # no second status line in the body
+    assert e.value.partial == b'{"first": 1}\n'
+    conn.close()
+
+
+def test_identical_requests_share_a_query(server, monkeypatch):
+    calls = []
+
+    def slow_route(params, db_path, chunk_rows=None):
+        calls.append(params)
+        time.sleep(0.3)
+        return pd.DataFrame({"value": [1, 2, 3]})
+
+    monkeypatch.setitem(service.ROUTES, "/slow", slow_route)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(get(server, "/slow", x="1")))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [status for status, _, _ in results] == [200] * 3
+    _, _, body = get(server, "/health")
+    assert json.loads(body)["coalesced"] == 2
+
+
+def test_streams_reuse_a_running_query(server, monkeypatch):
+    def slow_route(params, db_path, chunk_rows=None):
+        time.sleep(0.3)
+        return pd.DataFrame({"value": range(10)})
+
+    monkeypatch.setitem(service.ROUTES, "/slow", slow_route)
+    results = {}
+    json_request = threading.Thread(
+        target=lambda: results.update(json=get(server, "/slow"))
+    )
+    json_request.start()
+    time.sleep(0.05)
+    _, _, body = get(server, "/slow", format="arrow", **{"chunk-rows": 4})
+    json_request.join()
+    table = pa.ipc.open_stream(io.BytesIO(body)).read_all()
+    assert table.column("value").to_pylist() == list(range(10))
+    assert len(json.loads(results["json"][2])) == 10
+
+
+def test_open_streams_do_not_starve_other_requests(year_db_path):
+    # more streams than pooled connections, whose clients don't read
+    n_streams = queries.POOL_SIZE + 2
+    with serving(year_db_path) as (_, host, port):
+        streams = []
+        for _ in range(n_streams):
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            conn.request(
+                "GET",
+                "/weather?start=2020-01-01&end=2021-01-01&format=ndjson&chunk-rows=1",
+            )
+            response = conn.getresponse()
+            assert response.status == 200
+            streams.append((conn, response, response.read(100)))
+
+        statuses = []
+        requests = [
+            threading.Thread(
+                target=lambda: statuses.append(
+                    get(
+                        (None, host, port),
+                        "/passengers",
+                        start="2020-03-01",
+                        end="2020-0{}-01".format(4 + i),
+                    )[0]
+                )
+            )
+            for i in range(2)
+        ]
+        for request in requests:
+            request.start()
+        for request in requests:
+            request.join()
+        assert statuses == [200, 200]
+
+        for conn, response, first in streams:
+            lines = (first + response.read()).decode("utf-8").splitlines()
+            assert len(lines) == 24 * 366
+            conn.close()
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.analysis.timeseries import (
+    align,
+    conditional_means,
+    lagged_correlation,
+    load_hourly,
+    rolling_mean,
+    rolling_std,
+    sweep_correlations,
+)
+from src.db_layout import to_hour_key
+
+
+def series(seed=0, n=500, missing=40):
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=n).cumsum()
+    values[rng.choice(n, missing, replace=False)] = np.nan
+    return values
+
+
+def test_load_hourly_from_the_db(db_path, datasets):
+    loaded = load_hourly(db_path)
+    passengers = datasets["transportation-load"]
+    np.testing.assert_array_equal(loaded.hour_keys, passengers["hour-key"])
+    np.testing.assert_array_equal(
+        loaded.values["n-passengers"],
+        passengers["n-passengers"].to_numpy(dtype="f8", na_value=np.nan),
+    )
+    np.testing.assert_array_equal(
+        loaded.values["avg-temp"], datasets["weather-observations"]["avg-temp"]
+    )
+
+
+def test_load_hourly_reads_only_the_range(db_path, datasets):
+    loaded = load_hourly(db_path, start="2019-12-31 22:00", end="2020-01-02 23:00")
+    assert loaded.hour_keys[0] == to_hour_key("2019-12-31 22:00")
+    assert len(loaded.hour_keys) == 50
+    assert np.isnan(loaded.values["avg-wind"][:2]).all()
+    np.testing.assert_array_equal(
+        loaded.values["avg-wind"][2:],
+        datasets["weather-observations"]["avg-wind"].iloc[:48],
+    )
+
+
+def test_load_hourly_without_a_db(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_hourly(tmp_path / "missing.sqlite3")
+
+
+def test_align():
+    aligned = align({"a": ([5, 7], [1.0, 2.0]), "b": ([3], [4.0])})
+    assert aligned.hour_keys.tolist() == [3, 4, 5, 6, 7]
+    np.testing.assert_array_equal(aligned.values["a"], [np.nan, np.nan, 1, np.nan, 2])
+    np.testing.assert_array_equal(
+        aligned.values["b"], [4, np.nan, np.nan, np.nan, np.nan]
+    )
+
+
+@pytest.mark.parametrize("min_periods", [None, 1])
+def test_rolling_statistics_match_pandas(min_periods):
+    values = series()
+    windows = [1, 3, 24, 100]
+    means = rolling_mean(values, windows, min_periods)
+    stds = rolling_std(values, windows, min_periods)
+    for i, window in enumerate(windows):
+        rolling = pd.Series(values).rolling(window, min_periods=min_periods or window)
+        np.testing.assert_allclose(means[i], rolling.mean(), atol=1e-9)
+        np.testing.assert_allclose(stds[i], rolling.std(), atol=1e-9)
+
+
+def test_lagged_correlation_matches_pandas():
+    x, y = series(1), series(2)
+    lags = range(-30, 31)
+    correlations = lagged_correlation(x, y, lags)
+    expected = [pd.Series(x).corr(pd.Series(y).shift(lag)) for lag in lags]
+    np.testing.assert_allclose(correlations, expected, atol=1e-9)
+
+
+def test_sweep_correlations():
+    x, y = series(3), series(4)
+    sweep = sweep_correlations(x, y, windows=[1, 6], lags=[-2, 0, 5], min_periods=1)
+    assert sweep.shape == (2, 3)
+    expected = pd.Series(rolling_mean(x, 6, 1)).corr(
+        pd.Series(rolling_mean(y, 6, 1)).shift(5)
+    )
+    assert sweep.loc[6, 5] == pytest.approx(expected)
+
+
+def test_conditional_means_match_groupby():
+    keys = np.arange(to_hour_key("2020-01-01"), to_hour_key("2020-03-01"))
+    values = series(5, n=len(keys))
+    date_times = pd.Series(pd.to_datetime("1970-01-01") + pd.to_timedelta(keys, "h"))
+    frame = pd.DataFrame({"value": values, "hour": date_times.dt.hour})
+    frame["weekday"] = date_times.dt.weekday
+    frame["hour-of-week"] = frame["weekday"] * 24 + frame["hour"]
+    for by in ["hour", "weekday", "hour-of-week"]:
+        expected = frame.groupby(by)["value"].mean()
+        np.testing.assert_allclose(conditional_means(values, keys, by), expected)
@@ -0,0 +1,158 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_datasets
+from src.cleaning.cache import ParsedFrameCache
+from src.cleaning.clean_raw import (
+    clean_automated_weather_stations,
+    clean_icing_sensors,
+    icing_station_names,
+    import_dicts,
+    load_raw_dataset,
+    merge_weather_sensors,
+)
+from src.db_layout import to_hour_key
+from src.weather_cube import (
+    build_cube,
+    circular_mean,
+    load_cube,
+    match_observatories,
+    normalize_name,
+    write_cube,
+)
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+
+
+def observations():
+    # two hours of three stations, one of them without a known location
+    return pd.DataFrame(
+        {
+            "DATE_TIME": ["2020-05-01 00:00:00", "2020-05-01 01:00:00"] * 3,
+            "OBSERVATORY_NAME": ["AKOM"] * 2 + ["PENDIK"] * 2 + ["FLORYA"] * 2,
+            "AVERAGE_TEMPERATURE": [15.0, 16.0, 17.0, np.nan, 1.0, 1.0],
+            "AVERAGE_HUMIDITY": [60.0, 61.0, -9999.0, 63.0, 1.0, 1.0],
+            "AVERAGE_PRECIPITATION": [0.0] * 6,
+            "AVERAGE_WIND": [2.0] * 6,
+            "AVERAGE_DIRECTIONOFWIND": [350.0, 10.0, 10.0, 30.0, 1.0, 1.0],
+        }
+    )
+
+
+def test_normalize_name():
+    assert normalize_name("AHL-Bakırköy") == normalize_name("AHL_BAKIRKOY")
+    assert normalize_name("B.Çekmece-S Virajları") == "BCEKMECESVIRAJLARI"
+    assert normalize_name(" Başakşehir ") == "BASAKSEHIR"
+    assert normalize_name("Maslak-İTÜ") == "MASLAKITU"
+
+
+def test_match_observatories():
+    sensor_names = {"AKOM": 1, "Terkos": 2, "AHL": 3, "AHL-Bakırköy": 3, "AKOM_1": 4}
+    matched = match_observatories(
+        ["AKOM", "AKOM_1", "TERKOS_BARAJI", "AHL_BAKIRKOY", "FLORYA"], sensor_names
+    )
+    assert matched == {"AKOM": 1, "AKOM_1": 4, "TERKOS_BARAJI": 2, "AHL_BAKIRKOY": 3}
+
+
+def test_unmatched_observatories_fail():
+    with pytest.raises(ValueError, match="AKOM_2"):
+        match_observatories(["AKOM", "AKOM_2"], {"AKOM": 1})
+    with pytest.raises(ValueError, match="shared"):
+        match_observatories(["AKOM"], {"AKOM": 1, "akom": 2})
+
+
+def test_build_write_and_load(tmp_path):
+    sensors = make_datasets(n_hours=24)["weather-sensors"]
+    cube, index = build_cube(observations(), sensors)
+    assert cube.shape == (4, 2, 5)
+    assert index["first-hour-key"] == to_hour_key("2020-05-01 00:00")
+
+    write_cube(cube, index, derived_dir=tmp_path)
+    loaded = load_cube(tmp_path)
+    selected = loaded.select(sensor_ids=[1, 4], variables=["avg-temp", "avg-humidity"])
+    np.testing.assert_array_equal(
+        selected.values,
+        [[[15.0, 60.0], [16.0, 61.0]], [[17.0, np.nan], [np.nan, 63.0]]],
+    )
+    # stations without observations stay NaN
+    assert np.isnan(loaded.select(sensor_ids=[2, 3]).values).all()
+
+    means = loaded.mean(sensor_ids=[1, 4], over="hours")
+    assert means.loc[1, "avg-temp"] == 15.5
+    assert means.loc[1, "avg-winddir"] == pytest.approx(0.0, abs=1e-9)
+    assert loaded.mean(sensor_ids=[1, 4], start="2020-05-01 01:00").index.tolist() == [
+        to_hour_key("2020-05-01 01:00")
+    ]
+    with pytest.raises(KeyError):
+        loaded.select(sensor_ids=[99])
+
+
+def test_station_names_and_hour_range():
+    sensors = make_datasets(n_hours=24)["weather-sensors"]
+    renamed = observations().replace({"OBSERVATORY_NAME": {"PENDIK": "PENDIK_TUZLA"}})
+    with pytest.raises(ValueError, match="PENDIK_TUZLA"):
+        build_cube(renamed, sensors)
+    cube, index = build_cube(
+        renamed, sensors, station_names={"Pendik-Tuzla": "Pendik"}, whole_years=True
+    )
+    assert index["first-hour-key"] == to_hour_key("2020-01-01")
+    assert index["n-hours"] == 366 * 24
+    assert not np.isnan(cube[3]).all()
+
+
+def test_circular_mean():
+    assert circular_mean(np.array([350.0, 10.0])) == pytest.approx(0.0, abs=1e-9)
+    assert circular_mean(np.array([90.0, np.nan, 180.0])) == pytest.approx(135.0)
+    assert np.isnan(circular_mean(np.array([0.0, 180.0])))
+    assert np.isnan(circular_mean(np.array([np.nan])))
+
+
+def test_generated_station_copies_are_sensors(tmp_path):
+    # the sensors that the synthetic data generator registers for the copies
+    # of the stations are cleaned into 'weather-sensors' and matched to them
+    spec = importlib.util.spec_from_file_location(
+        "generate_synthetic_data",
+        REPO_DIR / "src/utility-scripts/generate_synthetic_data.py",
+    )
+    generator = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(generator)
+
+    raw_dir = REPO_DIR / "data/raw"
+    sensors = generator.template_sensors(raw_dir)
+    located = {"AKOM": sensors["AKOM"], "AHL_BAKIRKOY": sensors["AHL-Bakırköy"]}
+    lines = generator.sensor_copy_lines(located, 3, raw_dir, np.random.default_rng(0))
+    raw = {}
+    for import_dict in import_dicts:
+        name = {
+            "automated-weather-stations": generator.AUTOMATED_STATIONS_FILE,
+            "icing-sensors": generator.ICING_SENSORS_FILE,
+        }.get(import_dict["tag"])
+        if name is None:
+            continue
+        path = tmp_path / Path(name).name
+        path.write_bytes((raw_dir / name).read_bytes())
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(lines[name])
+        raw[import_dict["tag"]] = load_raw_dataset(
+            dict(import_dict, path=path), ParsedFrameCache(enabled=False)
+        )
+
+    weather_sensors = merge_weather_sensors(
+        clean_automated_weather_stations(raw["automated-weather-stations"]),
+        clean_icing_sensors(raw["icing-sensors"]),
+    )
+    assert len(weather_sensors) == 67 + 4
+    copies = observations().assign(
+        OBSERVATORY_NAME=["AKOM_1", "AKOM_2", "AHL_BAKIRKOY_1", "AHL_BAKIRKOY_2"]
+        + ["AHL_BAKIRKOY"] * 2
+    )
+    cube, index = build_cube(
+        copies, weather_sensors, icing_station_names(raw["icing-sensors"])
+    )
+    ids = weather_sensors.set_index("sensor-name")["id"]
+    stations = [index["sensor-ids"].index(ids[name]) for name in ["AKOM_1", "AHL"]]
+    np.testing.assert_array_equal(cube[stations, :, 0], [[15.0, np.nan], [1.0, 1.0]])